@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+截图步骤微基准：旧路径 vs 复用 mss + frombuffer + reduce
+
+旧路径：每次新建 mss()，screenshot.rgb（Python 逐字节 BGRA→RGB）+ Image.frombytes + 全尺寸 LANCZOS
+新路径：常驻 mss 实例，Image.frombuffer 包装原始 BGRA 缓冲区 + reduce() + 最终 LANCZOS
+
+默认使用合成的 BGRA 缓冲区（无需显示器），--live 时抓取真实屏幕。
+
+运行方式:
+  python -m agent.benchmarks.capture --width 3840 --height 2160
+  python -m agent.benchmarks.capture --live
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from mss import mss
+from mss.screenshot import ScreenShot
+from PIL import Image
+
+from agent.grabber import ScreenGrabber, bgra_to_image, downscale
+
+
+def synthetic_shot(width: int, height: int) -> ScreenShot:
+    """生成类似桌面内容的合成截图（色块 + 细节）"""
+    base = Image.effect_noise((width // 8, height // 8), 64).convert('RGB').resize((width, height), Image.Resampling.NEAREST)
+    raw = bytearray(base.tobytes('raw', 'BGRX'))
+    return ScreenShot(raw, {"left": 0, "top": 0, "width": width, "height": height})
+
+
+def legacy_convert(shot, max_width: int, max_height: int) -> Image.Image:
+    img = Image.frombytes('RGB', shot.size, shot.rgb)
+    img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
+    return img
+
+
+def new_convert(shot, max_width: int, max_height: int) -> Image.Image:
+    return downscale(bgra_to_image(shot.raw, shot.size), max_width, max_height)
+
+
+def measure(fn, rounds: int) -> dict:
+    samples = []
+    cpu_start = time.process_time()
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    cpu = time.process_time() - cpu_start
+    return {
+        "p50_ms": statistics.median(samples) * 1000,
+        "max_ms": max(samples) * 1000,
+        "cpu_ms_per_frame": cpu / rounds * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="截图步骤微基准")
+    parser.add_argument("--width", type=int, default=3840, help="合成截图宽度")
+    parser.add_argument("--height", type=int, default=2160, help="合成截图高度")
+    parser.add_argument("--max-width", type=int, default=1024, help="缩放目标宽度")
+    parser.add_argument("--max-height", type=int, default=640, help="缩放目标高度")
+    parser.add_argument("--rounds", type=int, default=20, help="每种路径的执行次数")
+    parser.add_argument("--live", action="store_true", help="抓取真实屏幕（包含 mss 抓取耗时）")
+    args = parser.parse_args()
+
+    if args.live:
+        grabber = ScreenGrabber()
+
+        def legacy():
+            with mss() as sct:
+                shot = sct.grab(sct.monitors[1])
+            legacy_convert(shot, args.max_width, args.max_height)
+
+        def new():
+            new_convert(grabber.grab(), args.max_width, args.max_height)
+
+        size = grabber.grab().size
+    else:
+        shot = synthetic_shot(args.width, args.height)
+        size = shot.size
+
+        def legacy():
+            # screenshot.rgb 有缓存，每轮重新包装以计入转换耗时
+            legacy_convert(ScreenShot(shot.raw, {"left": 0, "top": 0, "width": size[0], "height": size[1]}),
+                           args.max_width, args.max_height)
+
+        def new():
+            new_convert(shot, args.max_width, args.max_height)
+
+    # 预热
+    legacy()
+    new()
+
+    results = [("legacy", measure(legacy, args.rounds)), ("frombuffer+reduce", measure(new, args.rounds))]
+
+    print(f"\n截图尺寸: {size[0]}x{size[1]} -> {args.max_width}x{args.max_height}, 轮数: {args.rounds}, 模式: {'live' if args.live else 'synthetic'}")
+    columns = ["p50_ms", "max_ms", "cpu_ms_per_frame"]
+    print(f"{'path':>20}  " + "  ".join(f"{c:>16}" for c in columns))
+    for name, r in results:
+        print(f"{name:>20}  " + "  ".join(f"{r[c]:>16.1f}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
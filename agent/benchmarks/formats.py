@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+上传格式基准：JPEG vs WebP vs AVIF
+
+对同一批截图按各格式编码，比较平均体积、编码耗时和服务端解码耗时。
+默认使用合成的桌面画面（文字窗口 + 色块 + 照片区域），也可以传入真实截图。
+
+运行方式:
+  python -m agent.benchmarks.formats
+  python -m agent.benchmarks.formats --images ~/Desktop/shots/*.png --quality 60
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from io import BytesIO
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from agent.screenshot_agent import ScreenshotAgent, local_formats
+from agent.grabber import downscale
+
+
+def synthetic_desktop(width: int, height: int, seed: int) -> Image.Image:
+    """生成类似桌面的画面：标题栏、侧边栏、分段文字、色块和一块平滑的照片区域"""
+    rng = random.Random(seed)
+    img = Image.new('RGB', (width, height), (250, 250, 250))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, width, 32), fill=(52, 58, 70))
+    draw.rectangle((0, 32, 220, height), fill=(236, 238, 242))
+    for y in range(48, height - 40, 24):
+        draw.text((16, y), "".join(rng.choice("abcdefghij") for _ in range(rng.randint(4, 14))), fill=(60, 60, 60))
+    for y in range(52, height - 40, 22):
+        if rng.random() < 0.2:
+            continue  # 段落间空行
+        x = 240
+        line_end = rng.uniform(0.35, 0.6) * width
+        while x < line_end:
+            word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 9)))
+            draw.text((x, y), word, fill=(30, 30, 30))
+            x += len(word) * 6 + 6
+    for _ in range(4):
+        x0, y0 = rng.randint(240, width - 200), rng.randint(40, height - 120)
+        draw.rectangle((x0, y0, x0 + rng.randint(60, 200), y0 + rng.randint(20, 40)),
+                       fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    photo_size = (width // 3, height // 2)
+    photo = Image.effect_noise((photo_size[0] // 16, photo_size[1] // 16), 60).convert('RGB')
+    photo = photo.resize(photo_size, Image.Resampling.BICUBIC).filter(ImageFilter.GaussianBlur(2))
+    tint = Image.linear_gradient('L').resize(photo_size).convert('RGB')
+    img.paste(Image.blend(photo, tint, 0.4), (int(width * 0.64), 60))
+    return img
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上传格式基准")
+    parser.add_argument("--images", nargs="*", help="真实截图文件（默认使用合成画面）")
+    parser.add_argument("--count", type=int, default=8, help="合成画面数量")
+    parser.add_argument("--quality", type=int, default=60, help="编码质量")
+    parser.add_argument("--max-width", type=int, default=1024, help="缩放目标宽度")
+    parser.add_argument("--max-height", type=int, default=640, help="缩放目标高度")
+    args = parser.parse_args()
+
+    if args.images:
+        frames = [Image.open(path).convert('RGB') for path in args.images]
+    else:
+        frames = [synthetic_desktop(1920, 1080, seed) for seed in range(args.count)]
+    frames = [downscale(img, args.max_width, args.max_height) for img in frames]
+
+    agent = ScreenshotAgent.__new__(ScreenshotAgent)
+    agent.quality = args.quality
+    agent.encoder = None
+
+    results = []
+    for fmt in local_formats():
+        sizes, encode_times, decode_times = [], [], []
+        for img in frames:
+            started = time.perf_counter()
+            data, _ = agent.encode_image(img, fmt)
+            encode_times.append(time.perf_counter() - started)
+            sizes.append(len(data))
+            started = time.perf_counter()
+            Image.open(BytesIO(data)).load()
+            decode_times.append(time.perf_counter() - started)
+        results.append({
+            "format": fmt,
+            "avg_kb": statistics.mean(sizes) / 1024,
+            "encode_ms": statistics.median(encode_times) * 1000,
+            "decode_ms": statistics.median(decode_times) * 1000,
+        })
+
+    jpeg_kb = next(r["avg_kb"] for r in results if r["format"] == "jpeg")
+    print(f"\n帧数: {len(frames)}, 尺寸: {frames[0].width}x{frames[0].height}, quality: {args.quality}")
+    print(f"{'format':>8}  {'avg_kb':>10}  {'vs_jpeg':>8}  {'encode_ms':>10}  {'decode_ms':>10}")
+    for r in results:
+        print(f"{r['format']:>8}  {r['avg_kb']:>10.1f}  {r['avg_kb'] / jpeg_kb:>8.0%}  "
+              f"{r['encode_ms']:>10.1f}  {r['decode_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
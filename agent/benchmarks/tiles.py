@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+分块增量上传基准：模拟打字为主的会话
+
+在合成桌面画面的终端区域逐行输出文字，比较每帧完整上传与增量上传（关键帧 + 变化块）的字节数。
+
+运行方式:
+  python -m agent.benchmarks.tiles
+  python -m agent.benchmarks.tiles --frames 60 --format jpeg --tile-size 32
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from PIL import ImageDraw
+
+from agent.benchmarks.formats import synthetic_desktop
+from agent.encoder import encode
+from agent.grabber import downscale
+from agent.tiles import TileTracker, tile_hashes, pack_tiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分块增量上传基准")
+    parser.add_argument("--frames", type=int, default=30, help="模拟的帧数")
+    parser.add_argument("--format", default="webp", choices=["avif", "webp", "jpeg"], help="上传格式")
+    parser.add_argument("--quality", type=int, default=60, help="编码质量")
+    parser.add_argument("--tile-size", type=int, default=64, help="块边长")
+    parser.add_argument("--keyframe-interval", type=int, default=30, help="强制完整上传的间隔帧数")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    img = downscale(synthetic_desktop(1920, 1080, 0), 1024, 640)
+    terminal = (240, img.height - 200, img.width - 20, img.height - 20)
+    ImageDraw.Draw(img).rectangle(terminal, fill=(20, 20, 20))
+
+    tracker = TileTracker(args.tile_size, keyframe_interval=args.keyframe_interval)
+    full_bytes = delta_bytes = 0
+    hash_times = []
+    for i in range(args.frames):
+        # 终端里多输出一行
+        img = img.copy()
+        line = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz $-_/.") for _ in range(rng.randint(20, 100)))
+        y = terminal[1] + 8 + (i % 8) * 20
+        draw = ImageDraw.Draw(img)
+        if i % 8 == 0:
+            draw.rectangle(terminal, fill=(20, 20, 20))
+        draw.text((terminal[0] + 8, y), line, fill=(220, 220, 220))
+
+        full = encode(img, args.format, args.quality)
+        full_bytes += len(full)
+
+        started = time.perf_counter()
+        hashes = tile_hashes(img, args.tile_size)
+        hash_times.append(time.perf_counter() - started)
+        boxes = tracker.changed_boxes(img.size, hashes)
+        if boxes is None:
+            delta_bytes += len(full)
+            tracker.set_keyframe(f"frame_{i}", img.size, hashes)
+        else:
+            delta_bytes += len(encode(pack_tiles(img, boxes, args.tile_size), args.format, args.quality))
+            tracker.record_delta(f"frame_{i}", hashes, len(boxes))
+
+    print(f"\n帧数: {args.frames}, 尺寸: {img.width}x{img.height}, 格式: {args.format}, 块: {args.tile_size}px")
+    print(f"完整上传: {full_bytes / 1024:.0f} KB")
+    print(f"增量上传: {delta_bytes / 1024:.0f} KB ({full_bytes / delta_bytes:.1f}x), {tracker.stats}")
+    print(f"块哈希耗时: {sum(hash_times) / len(hash_times) * 1000:.1f} ms/帧")
+
+
+if __name__ == "__main__":
+    main()
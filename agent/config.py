@@ -12,12 +12,61 @@ class AgentSettings(BaseSettings):
     agent_auth_password: Optional[str] = None
     
     # Screenshot
-    screenshot_interval: int = 60
+    screenshot_interval: int = 60  # 基准间隔（自适应模式下屏幕有正常变化时使用）
+    
+    # 自适应截图间隔
+    adaptive_interval: bool = True
+    min_interval: int = 5  # 屏幕变化剧烈时的最短截图间隔，也是探测屏幕变化的间隔（秒）
+    max_interval: int = 300  # 画面不变时截图（心跳）间隔退避的上限（秒）
+    interval_backoff: float = 2.0  # 画面不变时间隔的增长倍数
+    change_threshold_low: float = 0.01  # 变化比例不超过该值视为未变化
+    change_threshold_high: float = 0.15  # 变化比例达到该值时切到最短间隔
+    idle_pause_seconds: int = 300  # 无键鼠输入超过该时长暂停截图（0 表示不检测）
+    pause_on_lock: bool = True  # 锁屏时暂停截图
     # 优化压缩参数：quality=60 + progressive + optimize
     screenshot_quality: int = 60
     # 降低分辨率以减小文件（对 AI 分析足够）
     screenshot_max_width: int = 1024
     screenshot_max_height: int = 640
+    # 活动窗口截图：auto（macOS 使用 AppleScript，Linux X11 会话使用 python-xlib）/ false（始终截取全屏）
+    active_window: str = "auto"
+    # 截取的显示器：all（所有显示器）或逗号分隔的编号，如 1,2（1 为主显示器；全屏模式或取不到活动窗口时使用）
+    capture_monitors: str = "all"
+    # 上传格式：auto（向服务端协商，选择本机支持的体积最小的格式）/ avif / webp / jpeg
+    upload_format: str = "auto"
+    
+    # 编码模式：fixed（固定 screenshot_quality）/ budget（按每帧字节预算搜索质量和分辨率）
+    encoder_mode: str = "fixed"
+    target_frame_kb: int = 60  # 每帧目标体积（KB）
+    budget_tolerance: float = 0.15  # 体积落在 [目标 × (1 - 容差), 目标] 即停止搜索
+    min_quality: int = 35  # 质量下限（低于该值文字难以辨认）
+    max_quality: int = 90
+    budget_allow_downscale: bool = True  # 最低质量仍超出预算时缩小分辨率
+    budget_min_scale: float = 0.5
+    
+    # 本地感知哈希去重
+    dedup_enabled: bool = True
+    dedup_threshold: int = 5  # 汉明距离不超过该值视为未变化（服务端相似阈值为 10）
+    dedup_ring_size: int = 8  # 参与比较的最近帧数量
+    heartbeat_interval: int = 300  # 屏幕未变化时发送心跳的间隔（秒）
+    
+    # 分块增量上传：只上传相对关键帧变化的块，服务端拼回完整画面
+    delta_enabled: bool = True
+    delta_tile_size: int = 64  # 块边长（像素，建议为 16 的倍数）
+    delta_max_ratio: float = 0.3  # 变化块占比超过该值时完整上传（产生新的关键帧）
+    keyframe_interval: int = 30  # 连续增量上传该帧数后强制完整上传一次
+    
+    # 上传
+    upload_timeout: float = 30.0
+    max_inflight_uploads: int = 2  # 同时进行的上传数（截取下一帧时上一帧可继续上传）
+    
+    # 离线缓存（服务端不可达时暂存截图，恢复后批量补传）
+    spool_enabled: bool = True
+    spool_path: str = os.path.join(os.path.dirname(__file__), "spool")
+    spool_max_mb: float = 500  # 缓存容量上限，超出时丢弃最旧的截图
+    spool_max_age_hours: float = 72  # 超过该时长的缓存截图直接丢弃
+    spool_batch_size: int = 20  # 每次补传请求的截图数
+    spool_retry_interval: int = 30  # 离线时探测服务端的间隔（秒）
     
     class Config:
         # 从 agent 目录下的 .env 文件读取
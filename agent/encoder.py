@@ -0,0 +1,138 @@
+"""
+按字节预算编码
+
+为每帧搜索编码质量（必要时再降低分辨率），使输出体积落在 [目标 × (1 - 容差), 目标] 区间：
+- 文字多的画面在预算内尽量提高质量，保证 AI 能看清文字
+- 照片/视频类画面降低质量，不浪费带宽
+- 质量降到 min_quality 仍超出预算时才缩小分辨率（不低于 min_scale）
+
+体积与质量近似满足 ln(size) ∝ quality，搜索时先用该模型外推，找到上下界后在两者之间插值。
+每个 (应用, 格式) 缓存上一次收敛的质量和缩放比例作为起点，同一应用的画面通常一到两次编码即可收敛。
+"""
+import math
+import time
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+# ln(size) 对质量的斜率初始估计（每个质量点约 3%）
+DEFAULT_SLOPE = 0.03
+# 单帧最多编码次数
+MAX_ATTEMPTS = 5
+# 缓存的 (应用, 格式) 数量
+CACHE_SIZE = 64
+
+
+def encode(img: Image.Image, image_format: str, quality: int) -> bytes:
+    """按上传格式编码（JPEG 使用 Progressive + optimize = 更小文件）"""
+    buffer = BytesIO()
+    if image_format == "webp":
+        img.save(buffer, format='WEBP', quality=quality, method=4)
+    elif image_format == "avif":
+        img.save(buffer, format='AVIF', quality=quality, speed=8)
+    else:
+        img.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+class BudgetEncoder:
+    """按字节预算自动调整质量和分辨率的编码器"""
+
+    def __init__(
+        self,
+        target_bytes: int,
+        tolerance: float = 0.15,
+        min_quality: int = 35,
+        max_quality: int = 90,
+        default_quality: int = 60,
+        allow_downscale: bool = True,
+        min_scale: float = 0.5
+    ):
+        self.target_bytes = target_bytes
+        self.tolerance = tolerance
+        self.min_quality = min_quality
+        self.max_quality = max(min_quality, max_quality)
+        self.default_quality = min(max(default_quality, min_quality), self.max_quality)
+        self.allow_downscale = allow_downscale
+        self.min_scale = min_scale
+        # (应用, 格式) -> (质量, 缩放比例)
+        self.cache: Dict[Tuple[str, str], Tuple[int, float]] = {}
+
+    def _next_quality(self, quality: int, size: int, low: Optional[Tuple[int, int]], high: Optional[Tuple[int, int]]) -> int:
+        """根据已知的上下界估计下一次尝试的质量"""
+        target = self.target_bytes * (1 - self.tolerance / 2)
+        if low and high and high[0] > low[0]:
+            # 在 ln(size) 上对上下界线性插值
+            slope = (math.log(high[1]) - math.log(low[1])) / (high[0] - low[0])
+            if slope > 0:
+                guess = low[0] + (math.log(target) - math.log(low[1])) / slope
+                return int(min(max(guess, low[0] + 1), high[0] - 1))
+            return (low[0] + high[0]) // 2
+        guess = quality + math.log(target / size) / DEFAULT_SLOPE
+        return int(round(min(max(guess, self.min_quality), self.max_quality)))
+
+    def encode(self, img: Image.Image, image_format: str, app_name: Optional[str] = None) -> Tuple[bytes, Dict]:
+        """
+        按预算编码一帧
+
+        Returns:
+            (编码数据, {"quality", "scale", "attempts", "encode_ms"})
+        """
+        started = time.perf_counter()
+        key = (app_name or "", image_format)
+        quality, scale = self.cache.get(key, (self.default_quality, 1.0))
+        frame = self._scaled(img, scale)
+
+        attempts = 0
+        best = None  # 预算内质量最高的结果 (quality, data)
+        low = high = None  # 预算内 / 超出预算的 (quality, size)
+        data = b""
+        while attempts < MAX_ATTEMPTS:
+            data = encode(frame, image_format, quality)
+            attempts += 1
+            size = len(data)
+
+            if size <= self.target_bytes:
+                if best is None or quality > best[0]:
+                    best = (quality, data)
+                low = (quality, size)
+                if size >= self.target_bytes * (1 - self.tolerance) or quality >= self.max_quality:
+                    break
+            else:
+                high = (quality, size)
+                if quality <= self.min_quality:
+                    # 最低质量仍超出预算：缩小分辨率后用最低质量再试
+                    if not self.allow_downscale or scale <= self.min_scale:
+                        break
+                    scale = max(self.min_scale, scale * math.sqrt(self.target_bytes / size) * 0.95)
+                    frame = self._scaled(img, scale)
+                    low = high = None
+                    continue
+
+            next_quality = self._next_quality(quality, size, low, high)
+            if next_quality == quality or (best and next_quality <= best[0] and size <= self.target_bytes):
+                break
+            quality = next_quality
+
+        if best is not None:
+            quality, data = best
+        # 分辨率被缩小过且质量仍有余量时，下一帧尝试恢复分辨率
+        next_scale = min(1.0, scale * 1.15) if scale < 1.0 and quality >= self.min_quality + 10 else scale
+        self.cache[key] = (quality, next_scale)
+        while len(self.cache) > CACHE_SIZE:
+            self.cache.pop(next(iter(self.cache)))
+
+        return data, {
+            "quality": quality,
+            "scale": round(scale, 2),
+            "attempts": attempts,
+            "encode_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+
+    @staticmethod
+    def _scaled(img: Image.Image, scale: float) -> Image.Image:
+        if scale >= 1.0:
+            return img
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        return img.resize(size, Image.Resampling.LANCZOS)
@@ -0,0 +1,124 @@
+"""
+屏幕抓取
+
+- mss 实例在所属线程内只创建一次（mss 的底层句柄绑定创建它的线程）
+- 直接用 Image.frombuffer 包装原始 BGRA 缓冲区，由 PIL 的 C 解码器一次完成
+  BGRA→RGB 转换，不经过 screenshot.rgb 的逐字节 Python 转换
+- 缩放时先用 reduce() 做整数倍盒式缩小，再对小得多的图做一次 LANCZOS 重采样
+"""
+import threading
+import time
+from typing import List, Tuple
+
+from mss import mss
+from PIL import Image
+
+# reduce() 之后保留的尺寸至少是目标尺寸的该倍数（最终 LANCZOS 至少还有一次真正的缩小）
+REDUCE_MARGIN = 1.25
+
+
+def bgra_to_image(raw, size: Tuple[int, int]) -> Image.Image:
+    """把 mss 原始 BGRA 缓冲区包装为 RGB 图像"""
+    return Image.frombuffer('RGB', size, raw, 'raw', 'BGRX', 0, 1)
+
+
+def fit_size(width: int, height: int, max_width: int, max_height: int) -> Tuple[int, int]:
+    """等比缩放到不超过 max_width × max_height 的尺寸"""
+    scale = min(max_width / width, max_height / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def downscale(img: Image.Image, max_width: int, max_height: int) -> Image.Image:
+    """reduce() 快速整数倍缩小 + 最后一次 LANCZOS 重采样"""
+    target = fit_size(img.width, img.height, max_width, max_height)
+    if target == img.size:
+        return img
+    factor = int(min(img.width / target[0], img.height / target[1]) / REDUCE_MARGIN)
+    if factor > 1:
+        img = img.reduce(factor)
+    return img.resize(target, Image.Resampling.LANCZOS)
+
+
+class ScreenGrabber:
+    """复用 mss 实例的屏幕抓取器（每个线程一个实例）"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def sct(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is None:
+            sct = self._local.sct = mss()
+        return sct
+
+    @property
+    def monitors(self) -> list:
+        return self.sct.monitors
+
+    def select_monitors(self, spec: str) -> List[int]:
+        """
+        解析要截取的显示器
+        
+        Args:
+            spec: all（所有显示器）或逗号分隔的 mss 显示器编号（从 1 开始），如 "1,2"；
+                  不存在的编号被忽略，全部无效时回退到主显示器
+        """
+        count = len(self.monitors) - 1  # monitors[0] 是所有显示器的合并区域
+        if spec.strip().lower() == "all":
+            return list(range(1, count + 1)) or [1]
+        selected = []
+        for part in spec.split(","):
+            part = part.strip()
+            if part.isdigit() and 1 <= int(part) <= count and int(part) not in selected:
+                selected.append(int(part))
+        return selected or [1]
+    
+    def grab(self, monitor_index: int = 1, max_age: float = 0.0):
+        """
+        抓取显示器原始画面
+
+        Args:
+            max_age: 同一线程内距上次抓取不超过该秒数时直接复用上次的结果
+                     （自适应调度的探测帧与随后的截图共用一次抓取）
+        """
+        last = getattr(self._local, "last", None)
+        if last is None:
+            last = self._local.last = {}
+        now = time.monotonic()
+        if max_age > 0 and monitor_index in last and now - last[monitor_index][0] <= max_age:
+            return last[monitor_index][1]
+        shot = self.sct.grab(self.sct.monitors[monitor_index])
+        last[monitor_index] = (now, shot)
+        return shot
+
+    def grab_region(self, left: int, top: int, width: int, height: int):
+        """
+        抓取屏幕上的矩形区域（如活动窗口），超出屏幕的部分被裁掉
+
+        Returns:
+            mss 截图；区域完全在屏幕外时返回 None
+        """
+        screen = self.sct.monitors[0]
+        x0, y0 = max(left, screen["left"]), max(top, screen["top"])
+        x1 = min(left + width, screen["left"] + screen["width"])
+        y1 = min(top + height, screen["top"] + screen["height"])
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return self.sct.grab({"left": x0, "top": y0, "width": x1 - x0, "height": y1 - y0})
+
+    def grab_image(self, max_width: int, max_height: int, monitor_index: int = 1, max_age: float = 0.0) -> Image.Image:
+        """抓取并缩放为 RGB 图像"""
+        shot = self.grab(monitor_index, max_age)
+        return downscale(bgra_to_image(shot.raw, shot.size), max_width, max_height)
+
+    def close(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is not None:
+            sct.close()
+            self._local.sct = None
+        self._local.last = None
+
+
+# 全局实例
+screen_grabber = ScreenGrabber()
@@ -0,0 +1,66 @@
+"""
+用户空闲与锁屏检测
+
+无法检测时返回 None，调用方按"未空闲 / 未锁屏"处理。
+- macOS：ioreg（HIDIdleTime / CGSSessionScreenIsLocked），无需 pyobjc
+- Linux：xprintidle（X11 空闲时间）、loginctl（LockedHint）
+- Windows：GetLastInputInfo
+"""
+import os
+import re
+import shutil
+import subprocess
+import sys
+from typing import Optional
+
+
+def _run(args: list, timeout: float = 2) -> Optional[str]:
+    try:
+        result = subprocess.run(args, capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout if result.returncode == 0 else None
+
+
+def get_idle_seconds() -> Optional[float]:
+    """距离最后一次键盘/鼠标输入的秒数"""
+    if sys.platform == 'darwin':
+        output = _run(['ioreg', '-c', 'IOHIDSystem', '-d', '4'])
+        match = re.search(r'"HIDIdleTime"\s*=\s*(\d+)', output or "")
+        return int(match.group(1)) / 1e9 if match else None
+
+    if sys.platform.startswith('linux'):
+        if os.environ.get('DISPLAY') and shutil.which('xprintidle'):
+            output = _run(['xprintidle'])
+            if output and output.strip().isdigit():
+                return int(output.strip()) / 1000
+        return None
+
+    if sys.platform == 'win32':
+        import ctypes
+
+        class LASTINPUTINFO(ctypes.Structure):
+            _fields_ = [("cbSize", ctypes.c_uint), ("dwTime", ctypes.c_uint)]
+
+        info = LASTINPUTINFO()
+        info.cbSize = ctypes.sizeof(info)
+        if ctypes.windll.user32.GetLastInputInfo(ctypes.byref(info)):
+            return (ctypes.windll.kernel32.GetTickCount() - info.dwTime) / 1000
+    return None
+
+
+def is_screen_locked() -> Optional[bool]:
+    """屏幕是否已锁定"""
+    if sys.platform == 'darwin':
+        output = _run(['ioreg', '-n', 'Root', '-d1'])
+        if output is None:
+            return None
+        return '"CGSSessionScreenIsLocked"=Yes' in output.replace(' ', '')
+
+    if sys.platform.startswith('linux'):
+        session_id = os.environ.get('XDG_SESSION_ID')
+        if session_id and shutil.which('loginctl'):
+            output = _run(['loginctl', 'show-session', session_id, '-p', 'LockedHint', '--value'])
+            if output:
+                return output.strip() == 'yes'
+    return None
@@ -0,0 +1,49 @@
+"""
+感知哈希（纯 Python 实现，不依赖 numpy/scipy）
+
+与后端使用的 imagehash.phash 算法一致（32×32 灰度图 → DCT → 左上 8×8 低频与中位数比较），
+生成的十六进制字符串可以直接与服务端的哈希比较。
+"""
+import math
+from PIL import Image
+
+HASH_SIZE = 8
+IMG_SIZE = HASH_SIZE * 4
+
+# DCT-II 基函数的前 HASH_SIZE 行（缩放系数不影响与中位数的比较）
+_DCT = [
+    [math.cos(math.pi * k * (2 * n + 1) / (2 * IMG_SIZE)) for n in range(IMG_SIZE)]
+    for k in range(HASH_SIZE)
+]
+
+
+def phash(img: Image.Image) -> str:
+    """计算 64 位感知哈希（十六进制字符串）"""
+    small = img.convert('L').resize((IMG_SIZE, IMG_SIZE), Image.Resampling.LANCZOS)
+    data = list(small.getdata())
+    pixels = [data[r * IMG_SIZE:(r + 1) * IMG_SIZE] for r in range(IMG_SIZE)]
+    
+    # 行方向 DCT：tmp[k][c] = Σ_r DCT[k][r] * pixels[r][c]
+    tmp = [
+        [sum(_DCT[k][r] * pixels[r][c] for r in range(IMG_SIZE)) for c in range(IMG_SIZE)]
+        for k in range(HASH_SIZE)
+    ]
+    # 列方向 DCT：low[k][l] = Σ_c tmp[k][c] * DCT[l][c]
+    low = [
+        [sum(tmp[k][c] * _DCT[l][c] for c in range(IMG_SIZE)) for l in range(HASH_SIZE)]
+        for k in range(HASH_SIZE)
+    ]
+    
+    values = [v for row in low for v in row]
+    ordered = sorted(values)
+    median = (ordered[len(ordered) // 2 - 1] + ordered[len(ordered) // 2]) / 2
+    
+    bits = 0
+    for v in values:
+        bits = (bits << 1) | (1 if v > median else 0)
+    return f"{bits:016x}"
+
+
+def hamming(hash1: str, hash2: str) -> int:
+    """两个哈希的汉明距离（与 imagehash 的 h1 - h2 一致）"""
+    return bin(int(hash1, 16) ^ int(hash2, 16)).count("1")
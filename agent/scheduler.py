@@ -0,0 +1,149 @@
+"""
+自适应截图间隔
+
+每 min_interval 秒做一次廉价探测：从 mss 原始 BGRA 缓冲区按网格抽取绿色通道（每个显示器约 6000 个采样点），
+与上一次实际截图时的探测结果比较变化比例（多显示器时任一显示器的变化都计入），再按截图间隔决定是否截图：
+- 变化大（>= change_high）：立即截图，截图间隔降到 min_interval，跟上快速的上下文切换
+- 有变化：距上次截图满截图间隔时截图，间隔逐步回到 screenshot_interval
+- 几乎不变（<= change_low）：距上次截图满截图间隔时截图一次（经本地去重后变成心跳），
+  截图间隔按 backoff 指数增长，直到 max_interval
+- 锁屏或空闲超过 idle_pause_seconds：暂停截图
+
+退避只拉长截图和心跳的间隔，探测始终按 min_interval 进行，长时间不变后的上下文切换也能在几秒内截到。
+"""
+import logging
+import time
+from typing import Optional, Tuple
+
+from agent.grabber import screen_grabber
+from agent.idle import get_idle_seconds, is_screen_locked
+
+logger = logging.getLogger(__name__)
+
+# 探测网格大小（行数 × 每行采样数）
+PROBE_ROWS = 60
+PROBE_COLS = 100
+# 单个采样点的亮度差超过该值才算变化（过滤光标闪烁、压缩噪声等）
+PIXEL_DELTA = 24
+
+
+def change_ratio(a: bytes, b: bytes) -> float:
+    """两次探测结果中发生变化的采样点比例"""
+    if len(a) != len(b) or not a:
+        return 1.0
+    changed = sum(1 for x, y in zip(a, b) if abs(x - y) > PIXEL_DELTA)
+    return changed / len(a)
+
+
+class AdaptiveScheduler:
+    """根据屏幕变化率和用户空闲状态决定下一次截图的时机"""
+
+    def __init__(
+        self,
+        base_interval: float,
+        min_interval: float,
+        max_interval: float,
+        backoff: float = 2.0,
+        change_low: float = 0.01,
+        change_high: float = 0.15,
+        idle_pause_seconds: float = 300,
+        pause_on_lock: bool = True,
+        monitors: str = "1"
+    ):
+        self.min_interval = max(1.0, min_interval)
+        self.max_interval = max(self.min_interval, max_interval)
+        self.base_interval = min(max(base_interval, self.min_interval), self.max_interval)
+        self.backoff = max(1.0, backoff)
+        self.change_low = change_low
+        self.change_high = change_high
+        self.idle_pause_seconds = idle_pause_seconds
+        self.pause_on_lock = pause_on_lock
+        # 参与探测的显示器（与截图使用同一配置）
+        self.monitors = monitors
+
+        # 截图间隔（探测间隔固定为 min_interval）
+        self.interval = self.base_interval
+        # 上一次实际截图时的探测结果
+        self.reference: Optional[bytes] = None
+        self.last_capture_at = 0.0
+        self.paused = False
+        self.stats = {"probes": 0, "captures": 0, "skipped": 0, "paused": 0}
+
+    def probe(self) -> bytes:
+        """抓取各显示器，从原始 BGRA 缓冲区按网格抽取绿色通道（紧接着的全屏截图会复用这些抓取）"""
+        return b"".join(self._sample(screen_grabber.grab(index))
+                        for index in screen_grabber.select_monitors(self.monitors))
+    
+    @staticmethod
+    def _sample(shot) -> bytes:
+        width, height = shot.size
+        raw = shot.raw
+        row_bytes = width * 4
+        row_step = max(1, height // PROBE_ROWS)
+        col_step = max(1, width // PROBE_COLS) * 4
+        samples = bytearray()
+        for y in range(0, height, row_step):
+            start = y * row_bytes + 1
+            samples += raw[start:start + row_bytes:col_step]
+        return bytes(samples)
+
+    def is_paused(self) -> bool:
+        """锁屏或长时间无输入"""
+        if self.pause_on_lock and is_screen_locked():
+            return True
+        if self.idle_pause_seconds > 0:
+            idle = get_idle_seconds()
+            if idle is not None and idle >= self.idle_pause_seconds:
+                return True
+        return False
+
+    def decide(self) -> Tuple[bool, float]:
+        """
+        探测一次并决定是否截图（在截图线程中调用）
+
+        Returns:
+            (是否截图, 距下一次探测的秒数，即 min_interval)
+        """
+        if self.is_paused():
+            if not self.paused:
+                logger.info("User is idle or screen is locked, pausing capture")
+            self.paused = True
+            self.stats["paused"] += 1
+            # 恢复后第一帧总是截图
+            self.reference = None
+            return False, self.min_interval
+        if self.paused:
+            logger.info("User is back, resuming capture")
+            self.paused = False
+            self.interval = self.base_interval
+
+        probe = self.probe()
+        self.stats["probes"] += 1
+        change = 1.0 if self.reference is None else change_ratio(self.reference, probe)
+        now = time.monotonic()
+
+        if change >= self.change_high:
+            self.interval = self.min_interval
+            capture = True
+        elif change > self.change_low:
+            # 静止一段时间后又有变化：退避的间隔立即回到基准间隔
+            self.interval = min(self.interval, self.base_interval)
+            capture = now - self.last_capture_at >= self.interval
+            if capture:
+                # 变化放缓：从最短间隔逐步回到基准间隔
+                self.interval = min(self.interval * self.backoff, self.base_interval)
+        else:
+            # 画面不变：到期时截图一次（心跳），之后的截图间隔继续退避
+            capture = now - self.last_capture_at >= self.interval
+            if capture:
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+
+        if capture:
+            self.reference = probe
+            self.last_capture_at = now
+            self.stats["captures"] += 1
+        else:
+            self.stats["skipped"] += 1
+
+        logger.debug(f"Screen change {change:.3f}, capture: {capture}, capture interval {self.interval:.0f}s")
+        return capture, self.min_interval
@@ -3,26 +3,53 @@
 桌面截屏 Agent
 定期截取活动窗口并上传到后端服务器
 """
+import asyncio
+import json
 import time
 import sys
 import os
 import subprocess
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
-from io import BytesIO
+from typing import Optional
 import logging
 
 # 添加父目录到路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from mss import mss
-from PIL import Image
+from PIL import Image, features
 import httpx
 from agent.config import agent_settings
+from agent.phash import phash, hamming
+from agent.spool import DiskSpool
+from agent.scheduler import AdaptiveScheduler
+from agent.grabber import screen_grabber, downscale, bgra_to_image
+from agent.encoder import BudgetEncoder, encode
+from agent.tiles import TileTracker, tile_hashes, pack_tiles
+from agent.stream import FrameStream
+from agent.x11 import X11WindowTracker, x11_available
+
+# 多显示器并行转换/缩放/哈希的线程数
+MONITOR_WORKERS = 4
+# 活动窗口小于该尺寸（如菜单、弹出框）时截取全屏
+MIN_WINDOW_SIZE = 64
 
 # 北京时区
 BEIJING_TZ = timezone(timedelta(hours=8))
 
+# 上传格式：名称 -> (Pillow 格式, MIME 类型, 扩展名)，按体积从小到大排列
+UPLOAD_FORMATS = {
+    "avif": ("AVIF", "image/avif", ".avif"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+}
+
+
+def local_formats() -> list:
+    """本机 Pillow 能编码的上传格式"""
+    return [name for name in UPLOAD_FORMATS if name == "jpeg" or features.check(name)]
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -42,16 +69,83 @@ class ScreenshotAgent:
         self.max_width = agent_settings.screenshot_max_width
         self.max_height = agent_settings.screenshot_max_height
         self.running = False
-        # macOS 默认支持 AppleScript
-        self.use_active_window = sys.platform == 'darwin'
+        # 活动窗口截图：macOS 使用 AppleScript，Linux X11 会话使用 python-xlib；其他情况截取全屏
+        self.window_backend = None
+        if agent_settings.active_window.lower() != "false":
+            if sys.platform == 'darwin':
+                self.window_backend = "applescript"
+            elif x11_available():
+                self.window_backend = "x11"
+        self.use_active_window = self.window_backend == "applescript"
+        # X 连接在截图线程中首次使用时建立
+        self.x11 = X11WindowTracker() if self.window_backend == "x11" else None
         # 认证 token
         self.auth_token = None
+        # 每个显示器一个截图流（本地去重、心跳和增量上传各自独立）
+        self.streams: dict = {}
+        # 长连接 HTTP 客户端（复用 TCP/TLS 连接）
+        self.client: Optional[httpx.AsyncClient] = None
+        # 截图在专用线程中执行，不阻塞事件循环上的上传
+        self.capture_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="capture")
+        # 多显示器时各显示器的画面并行转换、缩放和计算哈希
+        self.monitor_executor = ThreadPoolExecutor(max_workers=MONITOR_WORKERS, thread_name_prefix="monitor")
+        # 正在进行的上传任务
+        self.uploads: set = set()
+        # 离线缓存：服务端不可达时暂存截图，恢复后批量补传
+        self.spool = DiskSpool(
+            agent_settings.spool_path,
+            agent_settings.spool_max_mb,
+            agent_settings.spool_max_age_hours
+        ) if agent_settings.spool_enabled else None
+        # 服务端是否不可达（离线期间新截图直接写入缓存，由补传任务探测恢复）
+        self.offline = False
+        # 自适应截图间隔（关闭时按 screenshot_interval 固定节拍截图）
+        self.scheduler = AdaptiveScheduler(
+            base_interval=self.interval,
+            min_interval=agent_settings.min_interval,
+            max_interval=agent_settings.max_interval,
+            backoff=agent_settings.interval_backoff,
+            change_low=agent_settings.change_threshold_low,
+            change_high=agent_settings.change_threshold_high,
+            idle_pause_seconds=agent_settings.idle_pause_seconds,
+            pause_on_lock=agent_settings.pause_on_lock,
+            monitors=agent_settings.capture_monitors
+        ) if agent_settings.adaptive_interval else None
+        # 已上传的帧数和字节数
+        self.upload_stats = {"frames": 0, "bytes": 0, "encode_ms": 0.0}
+        # 上传格式（与服务端协商前使用 JPEG，所有服务端都支持）
+        self.upload_format = "jpeg"
+        # 按字节预算编码（关闭时使用固定的 screenshot_quality）
+        self.encoder = BudgetEncoder(
+            target_bytes=agent_settings.target_frame_kb * 1024,
+            tolerance=agent_settings.budget_tolerance,
+            min_quality=agent_settings.min_quality,
+            max_quality=agent_settings.max_quality,
+            default_quality=self.quality,
+            allow_downscale=agent_settings.budget_allow_downscale,
+            min_scale=agent_settings.budget_min_scale
+        ) if agent_settings.encoder_mode == "budget" else None
+        # 分块增量上传：局部变化的画面只上传变化的块（旧版本服务端不支持时关闭）
+        self.delta_enabled = agent_settings.delta_enabled
         
         logger.info(f"Screenshot Agent initialized")
         logger.info(f"Server: {self.server_url}")
-        logger.info(f"Interval: {self.interval}s")
+        if self.encoder is not None:
+            logger.info(f"Encoder: byte budget {agent_settings.target_frame_kb} KB/frame")
+        if agent_settings.adaptive_interval:
+            logger.info(f"Interval: adaptive {agent_settings.min_interval}-{agent_settings.max_interval}s (base {self.interval}s)")
+        else:
+            logger.info(f"Interval: {self.interval}s")
         logger.info(f"Auth enabled: {bool(self.auth_password)}")
-        logger.info(f"Capture mode: {'Active Window (AppleScript)' if self.use_active_window else 'Full Screen'}")
+        capture_modes = {"applescript": "Active Window (AppleScript)", "x11": "Active Window (X11)"}
+        logger.info(f"Capture mode: {capture_modes.get(self.window_backend, 'Full Screen')}")
+        logger.info(f"Local dedup: {agent_settings.dedup_enabled} (threshold: {agent_settings.dedup_threshold})")
+        if not self.use_active_window:
+            logger.info(f"Monitors: {agent_settings.capture_monitors}")
+        if self.delta_enabled:
+            logger.info(f"Delta upload: {agent_settings.delta_tile_size}px tiles, keyframe every {agent_settings.keyframe_interval} frames")
+        if self.spool is not None:
+            logger.info(f"Offline spool: {agent_settings.spool_path} ({len(self.spool)} pending)")
     
     def get_active_window_id(self) -> tuple[int, str]:
         """获取当前活动窗口 ID 和应用名称（使用 AppleScript）"""
@@ -79,7 +173,31 @@ class ScreenshotAgent:
             logger.warning(f"Failed to get active window info: {e}")
         return None, None
     
-    def capture_active_window_applescript(self) -> tuple[BytesIO, str]:
+    def resize_image(self, img: Image.Image) -> Image.Image:
+        """转换为 RGB 并按配置缩放（reduce + LANCZOS）"""
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        return downscale(img, self.max_width, self.max_height)
+    
+    def encode_image(self, img: Image.Image, image_format: str = "jpeg", app_name: str = None) -> tuple[bytes, dict]:
+        """
+        编码一帧
+        
+        Returns:
+            (编码数据, {"quality", "scale", "attempts", "encode_ms"})
+        """
+        if self.encoder is not None:
+            return self.encoder.encode(img, image_format, app_name)
+        started = time.perf_counter()
+        data = encode(img, image_format, self.quality)
+        return data, {
+            "quality": self.quality,
+            "scale": 1.0,
+            "attempts": 1,
+            "encode_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+    
+    def capture_active_window_applescript(self) -> tuple[Image.Image, str]:
         """使用 macOS screencapture 工具捕获活动窗口（非交互式）"""
         window_id, app_name = self.get_active_window_id()
         
@@ -102,26 +220,16 @@ class ScreenshotAgent:
             if result.returncode == 0 and os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
                 # 读取并处理图片
                 img = Image.open(tmp_path)
+                img.load()
                 
                 # 删除临时文件
                 os.unlink(tmp_path)
                 
-                # 转换为 RGB
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # 调整大小
-                if img.width > self.max_width or img.height > self.max_height:
-                    img.thumbnail((self.max_width, self.max_height), Image.Resampling.LANCZOS)
-                
-                # 保存到内存（优化压缩）
-                buffer = BytesIO()
-                # Progressive JPEG + optimize = 更小文件
-                img.save(buffer, format='JPEG', quality=self.quality, optimize=True, progressive=True)
-                buffer.seek(0)
+                # 转换为 RGB 并调整大小
+                img = self.resize_image(img)
                 
                 logger.info(f"Captured active window: {app_name} ({img.width}x{img.height})")
-                return buffer, app_name
+                return img, app_name
             else:
                 logger.warning(f"screencapture failed (window_id: {window_id}), falling back to full screen")
                 # 清理临时文件
@@ -136,36 +244,64 @@ class ScreenshotAgent:
                 os.unlink(tmp_path)
             return self.capture_full_screen()
     
-    def capture_full_screen(self) -> tuple[BytesIO, str]:
+    def capture_full_screen(self) -> tuple[Image.Image, str]:
         """捕获全屏（备用方案）"""
-        with mss() as sct:
-            # 捕获主显示器
-            monitor = sct.monitors[1]
-            screenshot = sct.grab(monitor)
-            
-            # 转换为 PIL Image
-            img = Image.frombytes('RGB', screenshot.size, screenshot.rgb)
-            
-            # 调整大小
-            if img.width > self.max_width or img.height > self.max_height:
-                img.thumbnail((self.max_width, self.max_height), Image.Resampling.LANCZOS)
-            
-            # 保存到内存（使用 JPEG 格式，但优化压缩参数）
-            buffer = BytesIO()
-            # Progressive JPEG + 优化 = 更小文件
-            img.save(buffer, format='JPEG', quality=self.quality, optimize=True, progressive=True)
-            buffer.seek(0)
-            
-            logger.info(f"Captured full screen ({img.width}x{img.height})")
-            return buffer, "Desktop"
+        # 复用常驻的 mss 实例；自适应调度刚探测过时直接复用那次抓取
+        img = screen_grabber.grab_image(self.max_width, self.max_height, max_age=1.0)
+        
+        logger.info(f"Captured full screen ({img.width}x{img.height})")
+        return img, "Desktop"
+    
+    def capture_active_window_x11(self) -> Optional[tuple[Image.Image, str, str]]:
+        """
+        截取 X11 活动窗口（从屏幕上只抓取窗口所在的矩形）
+        
+        Returns:
+            (图片, 应用名称, 窗口标题)；没有活动窗口或窗口过小时返回 None
+        """
+        info = self.x11.active_window()
+        if info is None or info.width < MIN_WINDOW_SIZE or info.height < MIN_WINDOW_SIZE:
+            return None
+        shot = screen_grabber.grab_region(info.x, info.y, info.width, info.height)
+        if shot is None:
+            return None
+        img = downscale(bgra_to_image(shot.raw, shot.size), self.max_width, self.max_height)
+        logger.info(f"Captured active window: {info.app_name} - {info.title} ({img.width}x{img.height})")
+        return img, info.app_name or "Desktop", info.title
     
-    def capture_screenshot(self) -> tuple[BytesIO, str]:
+    def capture_screenshot(self) -> tuple[Image.Image, str]:
         """捕获屏幕截图"""
         if self.use_active_window:
             return self.capture_active_window_applescript()
         else:
             return self.capture_full_screen()
     
+    def get_client(self) -> httpx.AsyncClient:
+        """获取长连接客户端（首次调用时创建）"""
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                base_url=self.server_url,
+                timeout=agent_settings.upload_timeout,
+                limits=httpx.Limits(
+                    max_connections=agent_settings.max_inflight_uploads + 1,
+                    max_keepalive_connections=agent_settings.max_inflight_uploads + 1,
+                    keepalive_expiry=max(60, self.interval * 2)
+                )
+            )
+        return self.client
+    
+    async def close(self):
+        """关闭 HTTP 客户端和截图线程"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        # mss 实例和 X 连接属于截图线程，在该线程中释放
+        await asyncio.get_running_loop().run_in_executor(self.capture_executor, screen_grabber.close)
+        if self.x11 is not None:
+            await asyncio.get_running_loop().run_in_executor(self.capture_executor, self.x11.close)
+        self.capture_executor.shutdown(wait=False)
+        self.monitor_executor.shutdown(wait=False)
+    
     async def login(self) -> bool:
         """登录并获取 token"""
         if not self.auth_password:
@@ -173,24 +309,23 @@ class ScreenshotAgent:
             return True
         
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.post(
-                    f"{self.server_url}/api/auth/login",
-                    json={"password": self.auth_password}
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get("success"):
-                        self.auth_token = data.get("token")
-                        logger.info("Authentication successful")
-                        return True
-                    else:
-                        logger.error(f"Login failed: {data.get('message')}")
-                        return False
+            response = await self.get_client().post(
+                "/api/auth/login",
+                json={"password": self.auth_password}
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
+                if data.get("success"):
+                    self.auth_token = data.get("token")
+                    logger.info("Authentication successful")
+                    return True
                 else:
-                    logger.error(f"Login failed: {response.status_code} - {response.text}")
+                    logger.error(f"Login failed: {data.get('message')}")
                     return False
+            else:
+                logger.error(f"Login failed: {response.status_code} - {response.text}")
+                return False
         except Exception as e:
             logger.error(f"Error during login: {str(e)}")
             return False
@@ -201,85 +336,471 @@ class ScreenshotAgent:
             return {"Authorization": f"Bearer {self.auth_token}"}
         return {}
     
-    async def upload_screenshot(self, image_buffer: BytesIO, app_name: str = None) -> bool:
-        """上传截图到服务器"""
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        """发送 POST 请求，token 过期时重新登录并重试一次"""
+        client = self.get_client()
+        response = await client.post(path, headers=self.get_auth_headers(), **kwargs)
+        if response.status_code == 401 and self.auth_password:
+            logger.warning("Authentication expired, attempting to re-login...")
+            if await self.login():
+                response = await client.post(path, headers=self.get_auth_headers(), **kwargs)
+        return response
+    
+    async def negotiate_format(self):
+        """向服务端查询接受的上传格式，选择本机能编码的体积最小的格式"""
+        supported = local_formats()
+        preferred = agent_settings.upload_format.lower()
+        if preferred != "auto":
+            self.upload_format = preferred if preferred in supported else "jpeg"
+            logger.info(f"Upload format: {self.upload_format} (configured)")
+            return
+        
         try:
-            filename = f"screenshot_{datetime.now(BEIJING_TZ).strftime('%Y%m%d_%H%M%S')}.jpg"
+            response = await self.get_client().get("/api/upload/formats", headers=self.get_auth_headers(), timeout=10.0)
+            # 旧版本服务端没有该接口，只接受 JPEG
+            server_formats = response.json().get("formats", []) if response.status_code == 200 else ["jpeg"]
+        except Exception as e:
+            logger.warning(f"Format negotiation failed, keeping {self.upload_format}: {str(e)}")
+            return
+        self.upload_format = next((f for f in server_formats if f in supported), "jpeg")
+        logger.info(f"Upload format: {self.upload_format} (server: {server_formats}, local: {supported})")
+    
+    async def upload_screenshot(self, image_data: bytes, app_name: str = None, image_hash: str = None,
+                                captured_at: datetime = None, image_format: str = "jpeg", tiles: tuple = None,
+                                monitor_id: int = None, window_title: str = None) -> bool:
+        """
+        上传截图到服务器（附带感知哈希和截图时间）
+        
+        服务端不可达或返回 5xx 时写入离线缓存，稍后批量补传（同样返回 True）
+        
+        Args:
+            tiles: (尺寸, 块哈希)；服务端完整保存了这一帧时作为增量上传的关键帧
+            monitor_id: 显示器编号（服务端按显示器分别判断相似帧）
+            window_title: 活动窗口标题
+        """
+        captured_at = captured_at or datetime.now(BEIJING_TZ)
+        if self.offline and self.spool is not None:
+            return await self.spool_screenshot(
+                image_data, app_name, image_hash, captured_at, image_format, monitor_id, window_title
+            )
+        
+        try:
+            _, mime_type, ext = UPLOAD_FORMATS[image_format]
+            filename = f"screenshot_{captured_at.strftime('%Y%m%d_%H%M%S')}{ext}"
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                files = {'file': (filename, image_buffer, 'image/jpeg')}
-                data = {}
-                if app_name:
-                    data['app_name'] = app_name
-                
-                response = await client.post(
-                    f"{self.server_url}/api/upload",
-                    files=files,
-                    data=data,
-                    headers=self.get_auth_headers()
+            files = {'file': (filename, image_data, mime_type)}
+            data = {'captured_at': captured_at.isoformat()}
+            if app_name:
+                data['app_name'] = app_name
+            if image_hash:
+                data['phash'] = image_hash
+            if tiles is not None:
+                data['keyframe'] = 'true'
+            if monitor_id is not None:
+                data['monitor_id'] = str(monitor_id)
+            if window_title:
+                data['window_title'] = window_title
+            
+            response = await self.post("/api/upload", files=files, data=data)
+            
+            if response.status_code == 200:
+                result = response.json()
+                logger.info(f"Upload successful: {result.get('filename')} (similar: {result.get('is_similar')}, app: {app_name})")
+                # 服务端原样尺寸完整保存的帧才能作为关键帧（相似帧只记录了指针）
+                tracker = self.get_stream(monitor_id).tiles
+                if tiles is not None and tracker is not None and result.get("stored_full") \
+                        and (result.get("width"), result.get("height")) == tiles[0]:
+                    tracker.set_keyframe(result["filename"], *tiles)
+                self.upload_stats["frames"] += 1
+                self.upload_stats["bytes"] += len(image_data)
+                return True
+            logger.error(f"Upload failed: {response.status_code} - {response.text}")
+            if response.status_code >= 500 and self.spool is not None:
+                return await self.spool_screenshot(
+                    image_data, app_name, image_hash, captured_at, image_format, monitor_id, window_title
                 )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    logger.info(f"Upload successful: {result.get('filename')} (similar: {result.get('is_similar')}, app: {app_name})")
-                    return True
-                elif response.status_code == 401:
-                    logger.warning("Authentication expired, attempting to re-login...")
-                    # 尝试重新登录
-                    if await self.login():
-                        # 重试上传
-                        response = await client.post(
-                            f"{self.server_url}/api/upload",
-                            files=files,
-                            data=data,
-                            headers=self.get_auth_headers()
-                        )
-                        if response.status_code == 200:
-                            result = response.json()
-                            logger.info(f"Upload successful after re-login: {result.get('filename')}")
-                            return True
-                    logger.error(f"Upload failed after re-login: {response.status_code} - {response.text}")
-                    return False
-                else:
-                    logger.error(f"Upload failed: {response.status_code} - {response.text}")
-                    return False
+            return False
                     
+        except httpx.TransportError as e:
+            logger.error(f"Server unreachable: {str(e)}")
+            if self.spool is not None:
+                self.offline = True
+                return await self.spool_screenshot(
+                    image_data, app_name, image_hash, captured_at, image_format, monitor_id, window_title
+                )
+            return False
         except Exception as e:
             logger.error(f"Error uploading screenshot: {str(e)}")
             return False
     
+    async def upload_delta(self, stream: FrameStream, img: Image.Image, boxes: list, hashes: list,
+                           app_name: str = None, image_hash: str = None, captured_at: datetime = None,
+                           window_title: str = None) -> Optional[bool]:
+        """
+        只上传相对上一帧变化的块，由服务端拼回完整画面
+        
+        Returns:
+            是否成功；需要改为完整上传时（服务端找不到上一帧、不支持增量上传或不可达）返回 None
+        """
+        tracker = stream.tiles
+        base = tracker.base
+        tile_size = tracker.tile_size
+        image_format = self.upload_format
+        captured_at = captured_at or datetime.now(BEIJING_TZ)
+        image_data = await asyncio.to_thread(
+            lambda: encode(pack_tiles(img, boxes, tile_size), image_format, self.quality)
+        )
+        
+        _, mime_type, ext = UPLOAD_FORMATS[image_format]
+        files = {'file': (f"tiles_{captured_at.strftime('%Y%m%d_%H%M%S')}{ext}", image_data, mime_type)}
+        data = {
+            'base_filename': base,
+            'tiles': json.dumps([[x0, y0] for x0, y0, _, _ in boxes]),
+            'tile_size': str(tile_size),
+            'width': str(img.width),
+            'height': str(img.height),
+            'captured_at': captured_at.isoformat()
+        }
+        if app_name:
+            data['app_name'] = app_name
+        if image_hash:
+            data['phash'] = image_hash
+        if stream.monitor_id is not None:
+            data['monitor_id'] = str(stream.monitor_id)
+        if window_title:
+            data['window_title'] = window_title
+        
+        try:
+            response = await self.post("/api/upload/delta", files=files, data=data)
+        except httpx.TransportError as e:
+            logger.error(f"Server unreachable: {str(e)}")
+            self.offline = self.spool is not None
+            return None
+        
+        if response.status_code == 200:
+            result = response.json()
+            tracker.record_delta(result["filename"], hashes, len(boxes))
+            self.upload_stats["frames"] += 1
+            self.upload_stats["bytes"] += len(image_data)
+            logger.info(
+                f"Delta upload successful: {result.get('filename')} ({len(boxes)} tiles, "
+                f"{len(image_data) / 1024:.1f} KB, base: {base}, similar: {result.get('is_similar')})"
+            )
+            return True
+        if response.status_code in (404, 405):
+            # 旧版本服务端没有增量上传接口
+            logger.warning("Server does not support delta uploads, disabling")
+            self.delta_enabled = False
+            for s in self.streams.values():
+                s.tiles = None
+            return None
+        # 服务端找不到上一帧（409）或其他错误：重新建立关键帧
+        logger.warning(f"Delta upload rejected: {response.status_code} - {response.text}, falling back to full upload")
+        tracker.reset()
+        return None
+    
+    async def spool_screenshot(self, image_data: bytes, app_name: str, image_hash: str, captured_at: datetime,
+                               image_format: str = "jpeg", monitor_id: int = None, window_title: str = None) -> bool:
+        """写入离线缓存"""
+        try:
+            await asyncio.to_thread(
+                self.spool.put, image_data, captured_at, image_hash, app_name, image_format, monitor_id, window_title
+            )
+            logger.info(f"Screenshot spooled for later upload ({len(self.spool)} pending)")
+            return True
+        except Exception as e:
+            logger.error(f"Error spooling screenshot: {str(e)}")
+            return False
+    
+    async def send_heartbeat(self, image_hash: str, app_name: str = None, monitor_id: int = None,
+                             window_title: str = None) -> dict:
+        """
+        屏幕未变化时发送心跳（只带哈希，不带图片）
+        
+        Returns:
+            服务端响应；need_upload 为 True 表示服务端的最新帧与该哈希不匹配，需要上传完整图片
+        """
+        if self.offline:
+            # 离线期间心跳没有意义（补传的截图本身就保留了时间线）
+            return {"success": True, "need_upload": False}
+        try:
+            response = await self.post(
+                "/api/heartbeat",
+                json={"phash": image_hash, "app_name": app_name, "window_title": window_title, "monitor_id": monitor_id}
+            )
+            if response.status_code == 200:
+                result = response.json()
+                logger.info(f"Heartbeat sent (hash: {image_hash}, need_upload: {result.get('need_upload')})")
+                return result
+            logger.error(f"Heartbeat failed: {response.status_code} - {response.text}")
+        except httpx.TransportError as e:
+            logger.error(f"Server unreachable: {str(e)}")
+            self.offline = self.spool is not None
+        except Exception as e:
+            logger.error(f"Error sending heartbeat: {str(e)}")
+        return {"success": False, "need_upload": False}
+    
+    async def check_server(self) -> bool:
+        """探测服务端是否可达"""
+        try:
+            response = await self.get_client().get("/health", timeout=10.0)
+            return response.status_code == 200
+        except Exception:
+            return False
+    
+    async def drain_spool(self) -> int:
+        """
+        批量补传离线缓存中的截图（按截图时间从旧到新）
+        
+        Returns:
+            补传成功的截图数
+        """
+        uploaded = 0
+        while self.spool is not None:
+            items = await asyncio.to_thread(self.spool.peek, agent_settings.spool_batch_size)
+            if not items:
+                break
+            files = []
+            for key, meta, data in items:
+                _, mime_type, ext = UPLOAD_FORMATS.get(meta.get("format") or "jpeg", UPLOAD_FORMATS["jpeg"])
+                files.append(("files", (f"{key}{ext}", data, mime_type)))
+            manifest = json.dumps([meta for _, meta, _ in items])
+            try:
+                response = await self.post("/api/upload/batch", files=files, data={"manifest": manifest})
+            except httpx.TransportError as e:
+                logger.error(f"Server unreachable during backfill: {str(e)}")
+                self.offline = True
+                break
+            if response.status_code != 200:
+                logger.error(f"Backfill failed: {response.status_code} - {response.text}")
+                break
+            
+            results = response.json().get("items", [])
+            for (key, _, data), result in zip(items, results):
+                if result.get("success"):
+                    self.upload_stats["frames"] += 1
+                    self.upload_stats["bytes"] += len(data)
+                else:
+                    # 服务端无法处理的图片（如已损坏）重试也不会成功，直接丢弃
+                    logger.warning(f"Server rejected spooled screenshot {key}: {result.get('error')}")
+            await asyncio.to_thread(self.spool.remove, [key for key, _, _ in items])
+            uploaded += sum(1 for r in results if r.get("success"))
+            logger.info(f"Backfilled {len(items)} screenshots ({len(self.spool)} pending)")
+        return uploaded
+    
+    async def spool_worker(self):
+        """后台补传任务：离线时定期探测服务端，恢复后清空缓存"""
+        while self.running:
+            try:
+                if self.offline and await self.check_server():
+                    logger.info("Server is reachable again")
+                    self.offline = False
+                    await self.negotiate_format()
+                if not self.offline and len(self.spool):
+                    await self.drain_spool()
+            except Exception as e:
+                logger.error(f"Error in spool worker: {str(e)}")
+            await asyncio.sleep(agent_settings.spool_retry_interval)
+    
+    def get_stream(self, monitor_id: Optional[int]) -> FrameStream:
+        """获取显示器对应的截图流（首次出现时创建）"""
+        stream = self.streams.get(monitor_id)
+        if stream is None:
+            tiles = TileTracker(
+                tile_size=agent_settings.delta_tile_size,
+                max_ratio=agent_settings.delta_max_ratio,
+                keyframe_interval=agent_settings.keyframe_interval
+            ) if self.delta_enabled else None
+            stream = self.streams[monitor_id] = FrameStream(monitor_id, agent_settings.dedup_ring_size, tiles)
+        return stream
+    
+    def is_duplicate(self, image_hash: str, monitor_id: Optional[int] = None) -> bool:
+        """与同一显示器最近上传的帧比较感知哈希"""
+        if not agent_settings.dedup_enabled:
+            return False
+        recent_hashes = self.get_stream(monitor_id).recent_hashes
+        return any(hamming(image_hash, h) <= agent_settings.dedup_threshold for h in recent_hashes)
+    
+    def _process_shot(self, shot, monitor_id: int, captured_at: datetime) -> tuple:
+        """把一个显示器的原始画面转换、缩放并计算感知哈希（多显示器时在 monitor 线程中并行执行）"""
+        img = downscale(bgra_to_image(shot.raw, shot.size), self.max_width, self.max_height)
+        logger.info(f"Captured monitor {monitor_id} ({img.width}x{img.height})")
+        return img, "Desktop", phash(img), captured_at, monitor_id, None
+    
+    def _capture_frames(self) -> list:
+        """
+        截图并计算感知哈希（在截图线程中执行）
+        
+        Returns:
+            [(img, app_name, phash, captured_at, monitor_id, window_title)]，
+            活动窗口模式下只有一帧，全屏模式下每个显示器一帧
+        """
+        captured_at = datetime.now(BEIJING_TZ)
+        if self.use_active_window:
+            img, app_name = self.capture_screenshot()
+            return [(img, app_name, phash(img), captured_at, None, None)]
+        if self.x11 is not None:
+            window = self.capture_active_window_x11()
+            if window is not None:
+                img, app_name, title = window
+                return [(img, app_name, phash(img), captured_at, None, title)]
+        
+        # mss 句柄属于截图线程，在这里依次抓取（每个显示器只需几毫秒，自适应调度刚探测过时直接复用）；
+        # 耗时的格式转换、缩放和哈希按显示器并行
+        monitors = screen_grabber.select_monitors(agent_settings.capture_monitors)
+        shots = [(screen_grabber.grab(index, max_age=1.0), index) for index in monitors]
+        if len(shots) == 1:
+            return [self._process_shot(*shots[0], captured_at)]
+        futures = [self.monitor_executor.submit(self._process_shot, shot, index, captured_at) for shot, index in shots]
+        return [future.result() for future in futures]
+    
+    async def capture_frames(self) -> list:
+        """在截图线程中截图，期间事件循环可以继续上传上一帧"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.capture_executor, self._capture_frames)
+    
+    async def process_frame(self, img: Image.Image, app_name: str, image_hash: str, captured_at: datetime = None,
+                            monitor_id: int = None, window_title: str = None) -> bool:
+        """去重后上传一帧（编码在线程中执行；各显示器分别去重）"""
+        stream = self.get_stream(monitor_id)
+        if self.is_duplicate(image_hash, monitor_id):
+            # 屏幕基本未变化：跳过上传，定期发送心跳
+            if time.monotonic() - stream.last_sent_at < agent_settings.heartbeat_interval:
+                logger.info(f"Screen unchanged (monitor: {monitor_id}, hash: {image_hash}), skipping upload")
+                return True
+            stream.last_sent_at = time.monotonic()
+            result = await self.send_heartbeat(image_hash, app_name, monitor_id, window_title)
+            if not result.get("need_upload"):
+                return result.get("success", False)
+        
+        # 先记录哈希，流水线中紧随其后的重复帧不会再次上传；失败时撤销
+        stream.recent_hashes.append(image_hash)
+        stream.last_sent_at = time.monotonic()
+        
+        # 局部变化的画面只上传变化的块（离线时直接完整写入缓存）
+        # 增量帧依赖上一帧，启用时同一显示器的上传按顺序串行执行
+        if stream.tiles is not None and not self.offline:
+            async with stream.lock:
+                success = await self.upload_frame(stream, img, app_name, image_hash, captured_at, window_title)
+        else:
+            success = await self.upload_frame(stream, img, app_name, image_hash, captured_at, window_title)
+        if not success and image_hash in stream.recent_hashes:
+            stream.recent_hashes.remove(image_hash)
+        return success
+    
+    async def upload_frame(self, stream: FrameStream, img: Image.Image, app_name: str, image_hash: str,
+                           captured_at: datetime = None, window_title: str = None) -> bool:
+        """增量上传变化的块；不适合增量上传时编码并上传完整截图"""
+        success = None
+        tiles = None
+        tracker = stream.tiles
+        if tracker is not None and not self.offline:
+            hashes = await asyncio.to_thread(tile_hashes, img, tracker.tile_size)
+            tiles = (img.size, hashes)
+            boxes = tracker.changed_boxes(img.size, hashes)
+            if boxes is not None:
+                success = await self.upload_delta(
+                    stream, img, boxes, hashes, app_name, image_hash, captured_at, window_title
+                )
+        
+        if success is None:
+            image_format = self.upload_format
+            image_data, info = await asyncio.to_thread(self.encode_image, img, image_format, app_name)
+            self.upload_stats["encode_ms"] += info["encode_ms"]
+            logger.info(
+                f"Uploading screenshot (app: {app_name}, monitor: {stream.monitor_id}, {image_format} q={info['quality']} "
+                f"scale={info['scale']}, {len(image_data) / 1024:.0f} KB, "
+                f"encoded in {info['encode_ms']:.0f} ms / {info['attempts']} tries)..."
+            )
+            # 按预算缩小过分辨率的帧尺寸已变，不能作为关键帧
+            if info["scale"] < 1.0:
+                tiles = None
+            success = await self.upload_screenshot(
+                image_data, app_name, image_hash, captured_at, image_format, tiles, stream.monitor_id, window_title
+            )
+        return success
+    
     async def run_once(self):
-        """执行一次截屏和上传"""
+        """执行一次截屏和上传（多显示器时各显示器并行上传）"""
         try:
             logger.info("Capturing screenshot...")
-            image_buffer, app_name = self.capture_screenshot()
-            
-            logger.info(f"Uploading screenshot (app: {app_name})...")
-            success = await self.upload_screenshot(image_buffer, app_name)
-            
-            return success
+            frames = await self.capture_frames()
+            results = await asyncio.gather(*(self.process_frame(*frame) for frame in frames))
+            return all(results)
             
         except Exception as e:
             logger.error(f"Error in screenshot cycle: {str(e)}")
             return False
     
+    async def submit_upload(self, frame: tuple, limit: int = None):
+        """把一帧交给后台上传；在途上传达到上限时等待最早的一个完成"""
+        limit = max(1, limit or agent_settings.max_inflight_uploads)
+        while len(self.uploads) >= limit:
+            await asyncio.wait(set(self.uploads), return_when=asyncio.FIRST_COMPLETED)
+        task = asyncio.create_task(self.process_frame(*frame))
+        self.uploads.add(task)
+        task.add_done_callback(self.uploads.discard)
+    
+    async def next_tick(self) -> tuple[bool, float]:
+        """是否在本节拍截图，以及到下一节拍的秒数"""
+        if self.scheduler is None:
+            return True, self.interval
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.capture_executor, self.scheduler.decide)
+    
+    def log_stats(self):
+        """输出截图与上传统计（有效帧 / 上传字节）"""
+        frames, nbytes = self.upload_stats["frames"], self.upload_stats["bytes"]
+        per_mb = frames / (nbytes / 1024 / 1024) if nbytes else 0
+        logger.info(f"Uploaded {frames} frames, {nbytes / 1024 / 1024:.1f} MB ({per_mb:.1f} frames/MB)")
+        if frames:
+            logger.info(f"Average encode time: {self.upload_stats['encode_ms'] / frames:.1f} ms/frame")
+        if self.scheduler is not None:
+            logger.info(f"Scheduler stats: {self.scheduler.stats}")
+        trackers = [s.tiles for s in self.streams.values() if s.tiles is not None]
+        if trackers:
+            stats = {key: sum(t.stats[key] for t in trackers) for key in trackers[0].stats}
+            logger.info(f"Delta upload stats: {stats}")
+    
     async def run(self):
-        """运行代理（持续模式）"""
+        """运行代理（持续模式：截取下一帧与上传上一帧并行）"""
         self.running = True
         logger.info("Screenshot Agent started")
+        next_at = time.monotonic()
+        spool_task = asyncio.create_task(self.spool_worker()) if self.spool is not None else None
         
         try:
             while self.running:
-                await self.run_once()
+                delay = self.interval
+                try:
+                    capture, delay = await self.next_tick()
+                    if capture:
+                        # 多显示器时每个显示器一帧，在途上传上限按显示器数放大
+                        frames = await self.capture_frames()
+                        for frame in frames:
+                            await self.submit_upload(frame, agent_settings.max_inflight_uploads * len(frames))
+                except Exception as e:
+                    logger.error(f"Error in screenshot cycle: {str(e)}")
                 
-                # 等待下一次截屏
-                logger.info(f"Waiting {self.interval} seconds until next screenshot...")
-                await asyncio.sleep(self.interval)
+                # 按节拍截图（截图和编码耗时不累加到间隔上）
+                next_at += delay
+                delay = next_at - time.monotonic()
+                if delay < 0:
+                    logger.warning(f"Capture cycle is {-delay:.1f}s behind schedule")
+                    next_at = time.monotonic()
+                    delay = 0
+                await asyncio.sleep(delay)
                 
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, asyncio.CancelledError):
             logger.info("Received interrupt signal")
         finally:
             self.running = False
+            if spool_task is not None:
+                spool_task.cancel()
+            if self.uploads:
+                await asyncio.gather(*self.uploads, return_exceptions=True)
+            await self.close()
+            self.log_stats()
             logger.info("Screenshot Agent stopped")
     
     def stop(self):
@@ -292,29 +813,33 @@ async def main():
     agent = ScreenshotAgent()
     
     # 测试连接
-    try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(f"{agent.server_url}/health")
-            if response.status_code == 200:
-                logger.info("Server connection OK")
-            else:
-                logger.warning(f"Server returned status {response.status_code}")
-    except Exception as e:
-        logger.error(f"Cannot connect to server: {str(e)}")
+    if await agent.check_server():
+        logger.info("Server connection OK")
+    elif agent.spool is not None:
+        # 离线启动：截图先写入本地缓存，服务端恢复后自动补传
+        logger.warning("Cannot connect to server, starting in offline mode")
+        agent.offline = True
+    else:
+        logger.error("Cannot connect to server")
         logger.error("Please make sure the backend server is running")
+        await agent.close()
         return
     
-    # 如果启用认证，先登录
-    if agent.auth_password:
+    # 如果启用认证，先登录（离线启动时在首次请求返回 401 后再登录）
+    if agent.auth_password and not agent.offline:
         logger.info("Authentication required, logging in...")
         if not await agent.login():
             logger.error("Login failed, cannot start agent")
+            await agent.close()
             return
     
+    # 协商上传格式（离线启动时在恢复连接后协商）
+    if not agent.offline:
+        await agent.negotiate_format()
+    
     # 运行代理
     await agent.run()
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
@@ -0,0 +1,128 @@
+"""
+离线截图缓存
+
+服务端不可达时把截图写入本地目录，恢复连接后批量补传。
+
+每条记录由两个文件组成：
+  <截图时间毫秒>_<随机串>.jpg   图片（扩展名固定，实际格式见元数据 format）
+  <截图时间毫秒>_<随机串>.json  元数据（captured_at / phash / app_name / format / monitor_id / window_title）
+
+先写图片再写元数据，两者都通过临时文件 + fsync + rename 原子落盘；
+元数据文件存在即表示记录完整，进程崩溃留下的半成品会在启动时清理。
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _atomic_write(path: str, data: bytes):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class DiskSpool:
+    """有容量和时间上限的本地截图缓存"""
+
+    def __init__(self, path: str, max_mb: float, max_age_hours: float):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age_seconds = max_age_hours * 3600
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._cleanup()
+
+    def _cleanup(self):
+        """删除临时文件和缺少元数据的图片（写入中途崩溃的残留）"""
+        names = set(os.listdir(self.path))
+        for name in names:
+            if name.endswith(".tmp") or (name.endswith(".jpg") and name[:-4] + ".json" not in names):
+                os.remove(os.path.join(self.path, name))
+
+    def _entries(self) -> List[str]:
+        """完整记录的键，按截图时间从旧到新排序"""
+        return sorted(name[:-5] for name in os.listdir(self.path) if name.endswith(".json"))
+
+    def _remove(self, key: str):
+        # 先删元数据，中途崩溃只会留下会被清理的孤立图片
+        for ext in (".json", ".jpg"):
+            path = os.path.join(self.path, key + ext)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _size(self, key: str) -> int:
+        try:
+            return os.path.getsize(os.path.join(self.path, key + ".jpg"))
+        except OSError:
+            return 0
+
+    def put(self, image_data: bytes, captured_at: datetime, image_hash: str = None, app_name: str = None,
+            image_format: str = "jpeg", monitor_id: int = None, window_title: str = None) -> str:
+        """缓存一张截图，超出容量时丢弃最旧的记录"""
+        key = f"{int(captured_at.timestamp() * 1000):015d}_{uuid.uuid4().hex[:8]}"
+        meta = {
+            "captured_at": captured_at.isoformat(),
+            "phash": image_hash,
+            "app_name": app_name,
+            "format": image_format,
+            "monitor_id": monitor_id,
+            "window_title": window_title
+        }
+        with self.lock:
+            _atomic_write(os.path.join(self.path, key + ".jpg"), image_data)
+            _atomic_write(os.path.join(self.path, key + ".json"), json.dumps(meta).encode("utf-8"))
+            self._enforce_limits()
+        return key
+
+    def _enforce_limits(self):
+        entries = self._entries()
+        now_ms = time.time() * 1000
+        sizes = {key: self._size(key) for key in entries}
+        total = sum(sizes.values())
+        for key in entries:
+            expired = now_ms - int(key.split("_")[0]) > self.max_age_seconds * 1000
+            if not expired and total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= sizes[key]
+            logger.warning(f"Dropped spooled screenshot {key} ({'expired' if expired else 'spool full'})")
+
+    def peek(self, limit: int) -> List[Tuple[str, Dict, bytes]]:
+        """读取最旧的若干条记录 [(key, meta, image_data)]，不删除"""
+        items = []
+        with self.lock:
+            self._enforce_limits()
+            for key in self._entries()[:limit]:
+                try:
+                    with open(os.path.join(self.path, key + ".json"), "r", encoding="utf-8") as f:
+                        meta = json.load(f)
+                    with open(os.path.join(self.path, key + ".jpg"), "rb") as f:
+                        items.append((key, meta, f.read()))
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Dropping unreadable spool entry {key}: {e}")
+                    self._remove(key)
+        return items
+
+    def remove(self, keys: List[str]):
+        with self.lock:
+            for key in keys:
+                self._remove(key)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            entries = self._entries()
+            return {"count": len(entries), "bytes": sum(self._size(key) for key in entries)}
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self._entries())
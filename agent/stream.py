@@ -0,0 +1,26 @@
+"""
+截图流
+
+每个显示器（活动窗口模式下为单一画面）是一个独立的截图流，各自维护：
+- 最近上传帧的感知哈希（本地去重）
+- 最近一次上传或心跳的时间
+- 增量上传的上一帧块哈希
+同一截图流的增量上传按顺序串行（增量帧依赖上一帧），不同截图流之间互不等待。
+"""
+import asyncio
+from collections import deque
+from typing import Optional
+
+from agent.tiles import TileTracker
+
+
+class FrameStream:
+    """单个截图流的去重与增量上传状态"""
+
+    def __init__(self, monitor_id: Optional[int], dedup_ring_size: int, tiles: Optional[TileTracker] = None):
+        # mss 显示器编号（活动窗口模式下为 None）
+        self.monitor_id = monitor_id
+        self.recent_hashes = deque(maxlen=dedup_ring_size)
+        self.last_sent_at = 0.0
+        self.tiles = tiles
+        self.lock = asyncio.Lock()
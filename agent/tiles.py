@@ -0,0 +1,99 @@
+"""
+分块增量上传
+
+把每帧按 tile_size 网格切块并计算每块的 CRC32，与上一次上传的帧比较，只上传变化的块和上一帧的文件名，
+服务端在上一帧的画面上贴回变化块得到完整画面（POST /api/upload/delta）。
+
+- 服务端在内存中保留最近拼好的画面，未变化的块逐像素复制，每个块只经过一次有损编码，不会越拼越糊
+- 服务端找不到上一帧（重启后且上一帧只记录了指针）时返回 409，改为完整上传
+- 变化块占比超过 max_ratio、尺寸变化或连续增量帧数达到 keyframe_interval 时完整上传，作为新的关键帧
+
+变化块按行优先排列在一张拼接图中：每行 cols = ceil(sqrt(n)) 块，第 i 块位于
+((i % cols) * tile_size, (i // cols) * tile_size)；帧右侧/底部不足一块的部分按实际尺寸放在格子左上角。
+"""
+import math
+import zlib
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+# 块大小为 16 的倍数时与 JPEG/WebP 宏块对齐，拼接处不会出现块边界
+DEFAULT_TILE_SIZE = 64
+
+
+def tile_boxes(size: Tuple[int, int], tile_size: int) -> List[Tuple[int, int, int, int]]:
+    """按行优先顺序返回每个块的 (x0, y0, x1, y1)"""
+    width, height = size
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in range(0, height, tile_size)
+        for x in range(0, width, tile_size)
+    ]
+
+
+def tile_hashes(img: Image.Image, tile_size: int) -> List[int]:
+    """每个块像素数据的 CRC32（按行优先顺序）"""
+    return [zlib.crc32(img.crop(box).tobytes()) for box in tile_boxes(img.size, tile_size)]
+
+
+def pack_tiles(img: Image.Image, boxes: List[Tuple[int, int, int, int]], tile_size: int) -> Image.Image:
+    """把变化的块拼成一张图（布局见模块说明）"""
+    cols = math.ceil(math.sqrt(len(boxes)))
+    rows = math.ceil(len(boxes) / cols)
+    atlas = Image.new('RGB', (cols * tile_size, rows * tile_size))
+    for i, box in enumerate(boxes):
+        atlas.paste(img.crop(box), ((i % cols) * tile_size, (i // cols) * tile_size))
+    return atlas
+
+
+class TileTracker:
+    """记录上一次上传的帧的块哈希，决定下一帧走增量上传还是完整上传"""
+
+    def __init__(self, tile_size: int = DEFAULT_TILE_SIZE, max_ratio: float = 0.3, keyframe_interval: int = 30):
+        self.tile_size = tile_size
+        self.max_ratio = max_ratio
+        self.keyframe_interval = keyframe_interval
+        # 上一次上传的帧：服务端文件名、尺寸、块哈希；以及距上一个关键帧的增量帧数
+        self.base: Optional[str] = None
+        self.size: Optional[Tuple[int, int]] = None
+        self.hashes: List[int] = []
+        self.deltas = 0
+        self.stats = {"keyframes": 0, "deltas": 0, "tiles": 0}
+
+    def reset(self):
+        """丢弃上一帧（服务端找不到它或上传失败时），下一帧完整上传"""
+        self.base = None
+        self.size = None
+        self.hashes = []
+        self.deltas = 0
+
+    def set_keyframe(self, filename: str, size: Tuple[int, int], hashes: List[int]):
+        self.base = filename
+        self.size = size
+        self.hashes = hashes
+        self.deltas = 0
+        self.stats["keyframes"] += 1
+
+    def changed_boxes(self, size: Tuple[int, int], hashes: List[int]) -> Optional[List[Tuple[int, int, int, int]]]:
+        """
+        相对上一次上传的帧变化的块
+
+        Returns:
+            变化块列表；需要完整上传时返回 None
+        """
+        if self.base is None or size != self.size or len(hashes) != len(self.hashes):
+            return None
+        if self.keyframe_interval > 0 and self.deltas >= self.keyframe_interval:
+            return None
+        boxes = tile_boxes(size, self.tile_size)
+        changed = [box for box, a, b in zip(boxes, hashes, self.hashes) if a != b]
+        if not changed or len(changed) > self.max_ratio * len(boxes):
+            return None
+        return changed
+
+    def record_delta(self, filename: str, hashes: List[int], tile_count: int):
+        self.base = filename
+        self.hashes = hashes
+        self.deltas += 1
+        self.stats["deltas"] += 1
+        self.stats["tiles"] += tile_count
@@ -0,0 +1,138 @@
+"""
+Linux X11 活动窗口
+
+通过 EWMH 属性读取当前活动窗口：
+- 根窗口的 _NET_ACTIVE_WINDOW：活动窗口 ID（没有窗口管理器时退回到输入焦点所在的顶层窗口）
+- _NET_WM_NAME（UTF-8，缺失时用 WM_NAME）：窗口标题
+- WM_CLASS：(实例名, 类名)，类名作为应用名称，如 "firefox"、"Code"
+- 窗口几何：get_geometry 取宽高，translate_coords 换算为根窗口坐标（即 mss 使用的屏幕坐标）
+
+依赖 python-xlib（可选）；未安装、没有 DISPLAY 或 Wayland 会话时返回 None，调用方回退到全屏截图。
+X 连接只在截图线程中创建和使用。
+
+可以在 Xvfb 下验证（无窗口管理器时按输入焦点识别窗口）：
+  Xvfb :99 -screen 0 1920x1080x24 &
+  DISPLAY=:99 xterm -geometry 80x24+100+100 -title demo &
+  DISPLAY=:99 python -m agent.x11
+"""
+import logging
+import os
+import sys
+from typing import NamedTuple, Optional
+
+try:
+    from Xlib import Xatom, display as xdisplay, error as xerror
+except ImportError:  # 非 Linux 或未安装 python-xlib
+    xdisplay = None
+
+logger = logging.getLogger(__name__)
+
+
+class WindowInfo(NamedTuple):
+    """活动窗口信息（坐标为根窗口坐标）"""
+    window_id: int
+    app_name: str
+    title: str
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+def x11_available() -> bool:
+    """当前会话能否使用 X11 后端"""
+    return sys.platform.startswith('linux') and xdisplay is not None and bool(os.environ.get('DISPLAY')) \
+        and os.environ.get('XDG_SESSION_TYPE') != 'wayland'
+
+
+class X11WindowTracker:
+    """读取 X11 活动窗口的标题、类名和几何信息"""
+
+    def __init__(self):
+        self.display = None
+        self.atoms = {}
+
+    def _connect(self):
+        if self.display is None:
+            self.display = xdisplay.Display()
+            for name in ("_NET_ACTIVE_WINDOW", "_NET_WM_NAME", "UTF8_STRING"):
+                self.atoms[name] = self.display.intern_atom(name)
+        return self.display
+
+    def _active_window(self):
+        """_NET_ACTIVE_WINDOW 指向的窗口；没有窗口管理器时取输入焦点所在的顶层窗口"""
+        root = self.display.screen().root
+        prop = root.get_full_property(self.atoms["_NET_ACTIVE_WINDOW"], Xatom.WINDOW)
+        if prop and prop.value and prop.value[0]:
+            return self.display.create_resource_object('window', prop.value[0])
+
+        window = self.display.get_input_focus().focus
+        if not window or isinstance(window, int):  # None / PointerRoot
+            return None
+        # 向上找到根窗口的直接子窗口（顶层窗口）
+        while True:
+            tree = window.query_tree()
+            if not tree.parent or tree.parent.id == root.id:
+                return window
+            window = tree.parent
+
+    def _title(self, window) -> str:
+        prop = window.get_full_property(self.atoms["_NET_WM_NAME"], self.atoms["UTF8_STRING"])
+        if prop and prop.value:
+            value = prop.value
+            return value.decode('utf-8', 'replace') if isinstance(value, bytes) else str(value)
+        name = window.get_wm_name()
+        if isinstance(name, bytes):
+            return name.decode('latin-1')
+        return name or ""
+
+    def _app_name(self, window) -> str:
+        wm_class = window.get_wm_class()
+        if wm_class:
+            # (实例名, 类名)，类名更稳定（如 "Google-chrome"、"Code"）
+            return wm_class[-1] or wm_class[0]
+        return ""
+
+    def active_window(self) -> Optional[WindowInfo]:
+        """当前活动窗口；无法获取时返回 None"""
+        try:
+            self._connect()
+            window = self._active_window()
+            if window is None:
+                return None
+            geometry = window.get_geometry()
+            root = self.display.screen().root
+            origin = root.translate_coords(window, 0, 0)
+            return WindowInfo(
+                window_id=window.id,
+                app_name=self._app_name(window),
+                title=self._title(window),
+                x=origin.x,
+                y=origin.y,
+                width=geometry.width,
+                height=geometry.height
+            )
+        except xerror.XError as e:
+            # 窗口在读取过程中被关闭
+            logger.debug(f"Failed to read X11 active window: {e}")
+            return None
+        except (xerror.DisplayError, xerror.ConnectionClosedError, OSError) as e:
+            # X 连接失败或断开，下次重新连接
+            logger.warning(f"X11 connection error: {e}")
+            self.close()
+            return None
+
+    def close(self):
+        if self.display is not None:
+            try:
+                self.display.close()
+            except Exception:
+                pass
+            self.display = None
+
+
+if __name__ == "__main__":
+    if not x11_available():
+        print("X11 backend unavailable (need Linux, python-xlib and DISPLAY)")
+        sys.exit(1)
+    print(X11WindowTracker().active_window())
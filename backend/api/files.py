@@ -0,0 +1,93 @@
+"""
+截图文件服务
+
+替代 StaticFiles 挂载：依次查找日期分片目录、旧版平铺目录和按天打包的归档，
+归档中的文件通过偏移索引 seek + read 直接返回，无需解包。
+只记录了参考帧指针的相似帧在这里透明地解析为参考帧（或参考帧 + 补丁）。
+AI 分析读取 variant=analysis：优先返回上传时生成的分析图片，不存在时按需生成。
+"""
+import asyncio
+import mimetypes
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse, Response
+from sqlalchemy.orm import Session
+
+from backend.database import get_db
+from backend.models import Screenshot
+from backend.services.image_service import image_service, format_of
+from backend.services.archive_service import THUMBNAIL_PREFIX
+
+files_router = APIRouter()
+
+# 旧版本 Python 的 mimetypes 不认识这两种格式
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+
+
+def _resolve_reference(db: Session, name: str) -> Optional[bytes]:
+    """解析相似帧的参考帧指针"""
+    is_thumbnail = name.startswith(THUMBNAIL_PREFIX)
+    filename = name[len(THUMBNAIL_PREFIX):] if is_thumbnail else name
+    
+    screenshot = db.query(Screenshot).filter(Screenshot.filename == filename).first()
+    if not screenshot or not screenshot.reference_filename:
+        return None
+    
+    if is_thumbnail:
+        return image_service.read_bytes(f"{THUMBNAIL_PREFIX}{screenshot.reference_filename}")
+    if screenshot.diff_box:
+        return image_service.compose_diff(screenshot.reference_filename, filename, screenshot.diff_box)
+    return image_service.read_bytes(screenshot.reference_filename)
+
+
+@files_router.get("/{name:path}")
+async def get_file(
+    name: str,
+    format: Optional[str] = Query(None, description="jpeg：转码为 JPEG（供只支持 JPEG 的 AI 服务使用）"),
+    region: Optional[str] = Query(None, description="changed：只返回增量上传帧中变化的区域"),
+    variant: Optional[str] = Query(None, description="analysis：按像素预算缩放的 AI 分析图片（JPEG）"),
+    db: Session = Depends(get_db)
+):
+    """获取截图或缩略图（/files/<filename>、/files/thumbnails/thumb_<filename>）"""
+    # 只允许文件名或 thumbnails/ 下的文件名，防止路径穿越
+    parts = name.split("/")
+    if ".." in parts or len(parts) > 2 or (len(parts) == 2 and parts[0] != "thumbnails"):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    to_jpeg = format == "jpeg" and media_type != "image/jpeg"
+    
+    changed_region = None
+    if region == "changed":
+        screenshot = db.query(Screenshot).filter(Screenshot.filename == name).first()
+        changed_region = screenshot.changed_region if screenshot else None
+    
+    analysis = variant == "analysis" and len(parts) == 1
+    if analysis and not changed_region:
+        analysis_name = image_service.analysis_name(name)
+        path = image_service.resolve_path(analysis_name)
+        if path:
+            return FileResponse(path, media_type="image/jpeg")
+        data = image_service.read_bytes(analysis_name)
+        if data is not None:
+            return Response(content=data, media_type="image/jpeg")
+    
+    path = image_service.resolve_path(name)
+    if path and not to_jpeg and not changed_region and not analysis:
+        return FileResponse(path, media_type=media_type)
+    
+    data = image_service.read_bytes(name)
+    if data is None:
+        data = _resolve_reference(db, name)
+    if data is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    if changed_region:
+        data = await asyncio.to_thread(image_service.crop_region, data, changed_region, format_of(name))
+    if analysis:
+        data = await asyncio.to_thread(image_service.to_analysis, data)
+        media_type = "image/jpeg"
+    elif to_jpeg:
+        data = await asyncio.to_thread(image_service.to_jpeg, data)
+        media_type = "image/jpeg"
+    return Response(content=data, media_type=media_type, headers={"Cache-Control": "public, max-age=86400"})
@@ -1,13 +1,34 @@
 """手动触发 API - 用于测试和调试"""
-from fastapi import APIRouter, HTTPException, Depends
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Query
+from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 from backend.tasks.processor import screenshot_processor
+from backend.services.vlm_pool import vlm_pool
+from backend.services.ai_scheduler import ai_scheduler
+from backend.tasks.vector_rebuild import vector_rebuilder, public_report, SERVER_REBUILD_WORKERS
+from backend.tasks.retention import retention_manager
+from backend.tasks.archiver import day_archiver
+from backend.tasks.reanalysis import reanalyzer, job_to_dict
 from backend.database import get_db
-from backend.models import Screenshot
+from backend.models import Screenshot, RetentionLog, ReanalysisJob
+
+logger = logging.getLogger(__name__)
 
 trigger_router = APIRouter()
 
 
+class ReanalysisRequest(BaseModel):
+    start_time: datetime
+    end_time: datetime
+    concurrency: Optional[int] = Field(None, ge=1, le=32)
+    rate: Optional[float] = Field(None, ge=0)
+    force: bool = False
+
+
 @trigger_router.post("/trigger-analysis")
 async def trigger_analysis():
     """手动触发截屏分析处理"""
@@ -18,6 +39,88 @@ async def trigger_analysis():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@trigger_router.get("/ai/endpoints")
+async def get_ai_endpoints():
+    """AI 服务端点的健康状态、进行中的请求数、p95 延迟和请求统计"""
+    return {"items": vlm_pool.status(), "scheduler": ai_scheduler.status()}
+
+
+@trigger_router.get("/analysis/backlog")
+async def get_analysis_backlog():
+    """分析队列长度、正在分析的截图数和积压抽样统计"""
+    return screenshot_processor.status()
+
+
+@trigger_router.post("/reanalysis")
+async def create_reanalysis(request: ReanalysisRequest, db: Session = Depends(get_db)):
+    """用当前模型和提示词重新分析时间范围内的截图（后台执行，完成后一次性替换活动记录）"""
+    if request.end_time <= request.start_time:
+        raise HTTPException(status_code=400, detail="end_time must be after start_time")
+    if reanalyzer.running:
+        raise HTTPException(status_code=409, detail=f"Reanalysis job {reanalyzer.job_id} is already running")
+    job = reanalyzer.create(
+        db, request.start_time, request.end_time,
+        concurrency=request.concurrency, rate=request.rate, force=request.force
+    )
+    return job_to_dict(job)
+
+
+@trigger_router.get("/reanalysis")
+async def list_reanalysis_jobs(
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """重新分析任务列表（含进度）"""
+    jobs = db.query(ReanalysisJob).order_by(ReanalysisJob.id.desc()).limit(limit).all()
+    return {"running": reanalyzer.job_id if reanalyzer.running else None, "items": [job_to_dict(j) for j in jobs]}
+
+
+def _get_job(db: Session, job_id: int) -> ReanalysisJob:
+    job = db.query(ReanalysisJob).filter(ReanalysisJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Reanalysis job not found")
+    return job
+
+
+@trigger_router.post("/reanalysis/{job_id}/pause")
+async def pause_reanalysis(job_id: int, db: Session = Depends(get_db)):
+    """暂停运行中的任务（当前批次完成后生效，已暂存的结果保留）"""
+    job = _get_job(db, job_id)
+    if not (reanalyzer.running and reanalyzer.job_id == job_id):
+        raise HTTPException(status_code=409, detail=f"Reanalysis job is {job.state}")
+    reanalyzer.request_stop("paused")
+    return {"success": True, "message": "Reanalysis job will pause after the current batch"}
+
+
+@trigger_router.post("/reanalysis/{job_id}/resume")
+async def resume_reanalysis(job_id: int, db: Session = Depends(get_db)):
+    """从检查点继续暂停或失败的任务"""
+    job = _get_job(db, job_id)
+    if job.state not in ("paused", "failed"):
+        raise HTTPException(status_code=409, detail=f"Reanalysis job is {job.state}")
+    if reanalyzer.running:
+        raise HTTPException(status_code=409, detail=f"Reanalysis job {reanalyzer.job_id} is already running")
+    job.state = "running"
+    job.error = None
+    job.finished_at = None
+    db.commit()
+    reanalyzer.start(job_id)
+    return job_to_dict(job)
+
+
+@trigger_router.post("/reanalysis/{job_id}/cancel")
+async def cancel_reanalysis(job_id: int, db: Session = Depends(get_db)):
+    """取消任务并丢弃暂存的结果（活动记录保持不变）"""
+    job = _get_job(db, job_id)
+    if reanalyzer.running and reanalyzer.job_id == job_id:
+        reanalyzer.request_stop("cancelled")
+        return {"success": True, "message": "Reanalysis job will be cancelled after the current batch"}
+    if job.state not in ("paused", "failed"):
+        raise HTTPException(status_code=409, detail=f"Reanalysis job is {job.state}")
+    reanalyzer.discard(db, job)
+    return {"success": True, "message": "Reanalysis job cancelled"}
+
+
 @trigger_router.post("/retry-failed")
 async def retry_failed_screenshots(db: Session = Depends(get_db)):
     """重试失败的截图分析（重置失败计数）"""
@@ -75,3 +178,98 @@ async def get_failed_screenshots(db: Session = Depends(get_db)):
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@trigger_router.post("/vector-index/rebuild")
+async def rebuild_vector_index(
+    reset: bool = False,
+    workers: int = Query(SERVER_REBUILD_WORKERS, ge=1),
+    batch_size: int = Query(256, ge=1, le=5000)
+):
+    """后台重建向量索引（支持断点续跑，reset=true 时清空后全量重建；workers 为 embedding 进程数）"""
+    if vector_rebuilder.status.get("state") == "running":
+        raise HTTPException(status_code=409, detail="Vector rebuild is already running")
+
+    async def run():
+        try:
+            await asyncio.to_thread(vector_rebuilder.rebuild, reset, workers, batch_size)
+        except Exception as e:
+            logger.error(f"Vector rebuild task failed: {e}")
+
+    vector_rebuilder.status = {"state": "running"}
+    asyncio.create_task(run())
+    return {"success": True, "message": "Vector rebuild started"}
+
+
+@trigger_router.get("/vector-index/status")
+async def get_vector_index_status():
+    """获取向量索引重建进度"""
+    return vector_rebuilder.status
+
+
+@trigger_router.get("/vector-index/consistency")
+async def check_vector_index_consistency():
+    """检查 activities 表与向量库的一致性（双向孤儿数据）"""
+    try:
+        return public_report(await asyncio.to_thread(vector_rebuilder.check_consistency))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@trigger_router.post("/vector-index/repair")
+async def repair_vector_index(
+    workers: int = Query(SERVER_REBUILD_WORKERS, ge=1),
+    batch_size: int = Query(256, ge=1, le=5000)
+):
+    """删除孤儿向量并补齐缺失向量"""
+    if vector_rebuilder.status.get("state") == "running":
+        raise HTTPException(status_code=409, detail="Vector rebuild is already running")
+    # 在进入线程前标记，修复期间再次请求重建或修复时返回 409
+    vector_rebuilder.status = {"state": "running", "task": "repair"}
+    try:
+        return await asyncio.to_thread(vector_rebuilder.repair, workers, batch_size)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@trigger_router.post("/retention/run")
+async def run_retention():
+    """手动执行保留策略（压缩旧原图、清理过期截图）"""
+    if retention_manager.running:
+        raise HTTPException(status_code=409, detail="Retention job is already running")
+    asyncio.create_task(retention_manager.run())
+    return {"success": True, "message": "Retention job started"}
+
+
+@trigger_router.post("/archive/run")
+async def run_archive():
+    """手动打包已关闭日期的截图"""
+    if day_archiver.running:
+        raise HTTPException(status_code=409, detail="Archive job is already running")
+    result = await day_archiver.run()
+    return {"success": True, "result": result}
+
+
+@trigger_router.get("/retention/logs")
+async def get_retention_logs(
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """获取保留策略执行记录"""
+    logs = db.query(RetentionLog).order_by(RetentionLog.started_at.desc()).limit(limit).all()
+    return {
+        "running": retention_manager.running,
+        "total_bytes_reclaimed": sum(l.bytes_reclaimed or 0 for l in logs),
+        "items": [
+            {
+                "id": l.id,
+                "started_at": l.started_at.isoformat(),
+                "finished_at": l.finished_at.isoformat() if l.finished_at else None,
+                "compressed_count": l.compressed_count,
+                "deleted_count": l.deleted_count,
+                "bytes_reclaimed": l.bytes_reclaimed,
+                "error": l.error
+            }
+            for l in logs
+        ]
+    }
@@ -0,0 +1,93 @@
+"""
+列表分页
+
+截屏和活动列表按 (timestamp, id) 倒序做 keyset 分页：游标记录上一页最后一条的 (timestamp, id)，
+下一页从复合索引 (timestamp, id) 上的该位置继续读取，翻到多深的页面都只读 limit 条。
+旧的 skip（OFFSET）分页仍然支持，但需要先扫描跳过的行。
+
+总数（COUNT）需要扫描整个范围，按查询条件缓存 LIST_COUNT_CACHE_SECONDS 秒，
+不需要总数的客户端可以传 total=none 跳过。
+"""
+import base64
+import binascii
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query
+
+from backend.config import settings
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()},{row_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, row_id = raw.rsplit(",", 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_page(query: Query, model, limit: int, cursor: Optional[str] = None,
+                skip: int = 0) -> Tuple[List, Optional[str]]:
+    """
+    按 (timestamp, id) 倒序取一页
+
+    Returns:
+        (本页记录, 下一页游标)，没有更多记录时游标为 None
+    """
+    query = query.order_by(model.timestamp.desc(), model.id.desc())
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(model.timestamp, model.id) < tuple_(timestamp, row_id))
+    elif skip:
+        query = query.offset(skip)
+
+    # 多取一条判断是否还有下一页
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].timestamp, rows[-1].id)
+
+
+class CountCache:
+    """按查询条件缓存列表总数"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.entries: Dict[tuple, Tuple[float, int]] = {}
+
+    def count(self, key: tuple, query: Query, mode: str = "cached") -> Optional[int]:
+        """
+        Args:
+            key: 查询条件（表名和各过滤参数）
+            mode: cached（缓存有效期内复用）/ exact（重新计数并更新缓存）/ none（不计数）
+        """
+        if mode == "none":
+            return None
+        ttl = settings.list_count_cache_seconds
+        now = time.monotonic()
+        if mode == "cached" and ttl > 0:
+            entry = self.entries.get(key)
+            if entry and now - entry[0] < ttl:
+                return entry[1]
+
+        total = query.order_by(None).count()
+        if ttl > 0:
+            if len(self.entries) >= self.max_entries:
+                # 清理过期的条目，仍然超出时丢弃最早写入的
+                self.entries = {k: v for k, v in self.entries.items() if now - v[0] < ttl}
+                while len(self.entries) >= self.max_entries:
+                    del self.entries[next(iter(self.entries))]
+            self.entries[key] = (now, total)
+        return total
+
+
+count_cache = CountCache()
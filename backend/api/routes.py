@@ -1,55 +1,181 @@
-from fastapi import APIRouter, File, UploadFile, Depends, HTTPException, Query
+from fastapi import APIRouter, File, Form, UploadFile, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime, timedelta
 import os
+import re
+import json
 
 from backend.database import get_db
 from backend.models import Screenshot, Activity, Report
 from backend.services.image_service import image_service
 from backend.services.vector_service import vector_service
-from backend.tasks.processor import screenshot_processor
-from backend.utils.timezone import beijing_naive, parse_date_beijing, get_day_range_beijing, format_beijing_time
+from backend.api.pagination import keyset_page, count_cache
+from backend.tasks.processor import screenshot_processor, priority_of, report_generator
+from backend.utils.timezone import (
+    beijing_naive, parse_date_beijing, get_day_range_beijing, format_beijing_time, parse_capture_time,
+    parse_datetime_beijing
+)
 from backend.config import settings
 
 router = APIRouter()
 
+_PHASH_RE = re.compile(r"^[0-9a-f]{16}$")
+# 按需生成报告的最大时间跨度
+MAX_REPORT_RANGE = timedelta(days=31)
+
+
+def _client_phash(value: Optional[str]) -> Optional[str]:
+    """客户端计算的感知哈希（64 位十六进制），格式不对时忽略"""
+    if value and _PHASH_RE.match(value.lower()):
+        return value.lower()
+    return None
+
+
+def _client_text(value, max_length: int) -> Optional[str]:
+    """客户端上报的应用名 / 窗口标题（截断到字段长度，空值记为 None）"""
+    if not isinstance(value, str) or not value.strip():
+        return None
+    return value.strip()[:max_length]
+
+
+class HeartbeatRequest(BaseModel):
+    phash: str
+    app_name: Optional[str] = None
+    window_title: Optional[str] = None
+    monitor_id: Optional[int] = None
+
+
+def _last_in_stream(db: Session, monitor_id: Optional[int], before: Optional[datetime] = None) -> Optional[Screenshot]:
+    """同一显示器的最新一帧（before 不为空时取该时间之前的最近一帧）"""
+    query = db.query(Screenshot).filter(Screenshot.monitor_id == monitor_id)
+    if before:
+        query = query.filter(Screenshot.timestamp <= before)
+    return query.order_by(Screenshot.timestamp.desc()).first()
+
+
+def _chain_reference(db: Session, last_screenshot: Screenshot, phash: str) -> Optional[Screenshot]:
+    """
+    新的相似帧可以指向的参考帧：上一帧所指向的完整帧，且新帧与它本身仍然相似
+    
+    只和上一帧比较时，缓慢变化的画面每一帧都与前一帧相似，指针却一直指向最早的那张图片；
+    与参考帧的差异超过阈值（或参考帧图片已被保留策略删除）时返回 None，新帧完整保存并成为之后相似帧的参考帧。
+    """
+    reference = last_screenshot
+    if last_screenshot.reference_filename:
+        reference = db.query(Screenshot).filter(Screenshot.filename == last_screenshot.reference_filename).first()
+    if not reference or reference.is_purged or not reference.phash or \
+            image_service.calculate_similarity(phash, reference.phash) >= settings.similarity_threshold:
+        return None
+    return reference
+
+
+def _store_screenshot(db: Session, img, phash: str, captured_at: Optional[datetime] = None,
+                      source: Optional[bytes] = None, keyframe: bool = False, monitor_id: Optional[int] = None,
+                      app_name: Optional[str] = None, window_title: Optional[str] = None):
+    """
+    与同一显示器的前一帧比较后保存截图（相似帧只记录参考帧指针，可选附带补丁）
+    
+    Args:
+        captured_at: 客户端截图时间（补传时与该时间之前的最近一帧比较）
+        source: 上传的原始字节（紧凑格式且未缩放时原样保存）
+        keyframe: 客户端增量上传的关键帧，相似时也完整保存（后续增量帧在它上面拼接）
+        monitor_id: 客户端显示器编号，不同显示器的画面互不比较
+        app_name / window_title: 客户端上报的前台应用和窗口标题（分析时用于跳过或提示视觉模型）
+    
+    Returns:
+        (screenshot, is_similar)，尚未提交
+    """
+    is_similar = False
+    last_screenshot = _last_in_stream(db, monitor_id, captured_at)
+    if last_screenshot and last_screenshot.phash:
+        similarity = image_service.calculate_similarity(phash, last_screenshot.phash)
+        is_similar = similarity < settings.similarity_threshold
+    
+    saved = None
+    reference = None
+    if is_similar and not keyframe and settings.similar_frame_storage in ("reference", "diff"):
+        reference = _chain_reference(db, last_screenshot, phash)
+    if reference is not None:
+        saved = image_service.write_reference(
+            img, phash, reference.filename,
+            with_diff=settings.similar_frame_storage == "diff",
+            captured_at=captured_at,
+            monitor_id=monitor_id
+        )
+    if saved is None:
+        saved = image_service.write_screenshot(img, phash, captured_at, source=source, monitor_id=monitor_id)
+    filename, filepath, metadata = saved
+    
+    screenshot = Screenshot(
+        filename=filename,
+        filepath=filepath,
+        thumbnail_path=metadata["thumbnail_path"],
+        width=metadata["width"],
+        height=metadata["height"],
+        file_size=metadata["file_size"],
+        phash=metadata["phash"],
+        is_similar=is_similar,
+        reference_filename=metadata["reference_filename"],
+        diff_box=metadata["diff_box"],
+        monitor_id=monitor_id,
+        app_name=_client_text(app_name, 255),
+        window_title=_client_text(window_title, 512)
+    )
+    if captured_at:
+        screenshot.timestamp = captured_at
+    if not is_similar and settings.analysis_variant_enabled:
+        # 只有非相似帧会被分析
+        image_service.write_analysis_variant(img, filename)
+    db.add(screenshot)
+    # flush 后同一批次的下一帧可以与这一帧比较
+    db.flush()
+    return screenshot, is_similar
+
+
+@router.get("/upload/formats")
+async def get_upload_formats():
+    """服务端接受的上传格式（按体积从小到大），客户端选择自己能编码的第一个"""
+    return {
+        "formats": [fmt.lower() for fmt in image_service.accepted_formats()],
+        "storage_format": image_service.storage_format.lower()
+    }
+
 
 @router.post("/upload")
 async def upload_screenshot(
     file: UploadFile = File(...),
+    phash: Optional[str] = Form(None),
+    captured_at: Optional[str] = Form(None),
+    keyframe: bool = Form(False),
+    monitor_id: Optional[int] = Form(None),
+    app_name: Optional[str] = Form(None),
+    window_title: Optional[str] = Form(None),
     db: Session = Depends(get_db)
 ):
-    """上传截屏"""
+    """
+    上传截屏（客户端可附带已计算的感知哈希和截图时间；keyframe 表示作为增量上传的关键帧）
+    
+    app_name / window_title 为客户端的前台应用和窗口标题，已知的组合分析时不调用视觉模型
+    """
     try:
         # 读取文件内容
         content = await file.read()
         
-        # 保存图片
-        filename, filepath, metadata = image_service.save_screenshot(content, file.filename)
+        # 解码图片；客户端已计算感知哈希时直接使用
+        img = image_service.prepare_screenshot(content)
+        phash = _client_phash(phash) or image_service.compute_phash(img)
         
-        # 检查相似度
-        is_similar = False
-        last_screenshot = db.query(Screenshot).order_by(Screenshot.timestamp.desc()).first()
-        if last_screenshot and last_screenshot.phash:
-            similarity = image_service.calculate_similarity(metadata["phash"], last_screenshot.phash)
-            is_similar = similarity < settings.similarity_threshold
-        
-        # 保存到数据库
-        screenshot = Screenshot(
-            filename=filename,
-            filepath=filepath,
-            thumbnail_path=os.path.join(settings.screenshot_path, "thumbnails", f"thumb_{filename}"),
-            width=metadata["width"],
-            height=metadata["height"],
-            file_size=metadata["file_size"],
-            phash=metadata["phash"],
-            is_similar=is_similar
+        screenshot, is_similar = _store_screenshot(
+            db, img, phash, parse_capture_time(captured_at) if captured_at else None, source=content,
+            keyframe=keyframe, monitor_id=monitor_id, app_name=app_name, window_title=window_title
         )
-        
-        db.add(screenshot)
         db.commit()
         db.refresh(screenshot)
+        if keyframe:
+            image_service.remember_canvas(screenshot.filename, img)
         
         # 如果不是相似图片，立即加入分析队列
         if not is_similar:
@@ -58,23 +184,225 @@ async def upload_screenshot(
         return {
             "success": True,
             "screenshot_id": screenshot.id,
-            "filename": filename,
-            "is_similar": is_similar
+            "filename": screenshot.filename,
+            "is_similar": is_similar,
+            # 完整保存了图片（而不是参考帧指针），客户端可以把它作为增量上传的关键帧
+            "stored_full": screenshot.reference_filename is None,
+            "width": screenshot.width,
+            "height": screenshot.height
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/upload/delta")
+async def upload_screenshot_delta(
+    file: UploadFile = File(...),
+    base_filename: str = Form(...),
+    tiles: str = Form(...),
+    tile_size: int = Form(...),
+    width: int = Form(...),
+    height: int = Form(...),
+    phash: Optional[str] = Form(None),
+    captured_at: Optional[str] = Form(None),
+    monitor_id: Optional[int] = Form(None),
+    app_name: Optional[str] = Form(None),
+    window_title: Optional[str] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """
+    增量上传：只包含相对关键帧变化的块
+    
+    file 为变化块的拼接图，tiles 为 JSON 数组 [[x, y], ...]（各块在整帧中的左上角坐标，
+    按拼接图中的顺序），base_filename 为该客户端上一次上传的截图（完整或增量）。
+    服务端在上一帧的画面上贴回变化块得到完整画面，之后与普通上传一样存储和分析，
+    变化区域记录在 changed_region，AI 可以只分析这一部分。
+    上一帧不存在或尺寸不符时返回 409，客户端应改为完整上传。
+    """
+    try:
+        positions = json.loads(tiles)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid tiles")
+    if not isinstance(positions, list) or not positions or tile_size <= 0 or \
+            not all(isinstance(p, list) and len(p) == 2 and all(isinstance(v, int) for v in p) for p in positions):
+        raise HTTPException(status_code=400, detail="Invalid tiles")
+    if len(positions) > settings.delta_max_tiles:
+        raise HTTPException(status_code=413, detail=f"At most {settings.delta_max_tiles} tiles per frame")
+    
+    if not db.query(Screenshot.id).filter(Screenshot.filename == base_filename).first():
+        raise HTTPException(status_code=409, detail="Base frame not found")
+    
+    try:
+        content = await file.read()
+        atlas = image_service.prepare_tiles(content)
+        applied = image_service.apply_tiles(base_filename, atlas, positions, tile_size, (width, height))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if applied is None:
+        raise HTTPException(status_code=409, detail="Base frame not found or size mismatch")
+    img, box = applied
+    
+    try:
+        phash = _client_phash(phash) or image_service.compute_phash(img)
+        screenshot, is_similar = _store_screenshot(
+            db, img, phash, parse_capture_time(captured_at) if captured_at else None, monitor_id=monitor_id,
+            app_name=app_name, window_title=window_title
+        )
+        screenshot.changed_region = ",".join(map(str, box))
+        db.commit()
+        db.refresh(screenshot)
+        image_service.remember_canvas(screenshot.filename, img)
+        
+        if not is_similar:
+            await screenshot_processor.add_to_queue(screenshot.id)
+        
+        return {
+            "success": True,
+            "screenshot_id": screenshot.id,
+            "filename": screenshot.filename,
+            "is_similar": is_similar,
+            "changed_region": screenshot.changed_region
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/upload/batch")
+async def upload_screenshots_batch(
+    files: List[UploadFile] = File(...),
+    manifest: str = Form(...),
+    db: Session = Depends(get_db)
+):
+    """
+    批量补传截屏（客户端离线期间缓存的截图）
+    
+    manifest 为 JSON 数组，与 files 一一对应：
+    [{"captured_at": "2024-01-01T10:00:00+08:00", "phash": "...", "app_name": "...", "window_title": "...",
+      "monitor_id": 1}, ...]
+    截图按原始截图时间入库，逐张提交；单张图片损坏不影响其余图片。
+    """
+    try:
+        entries = json.loads(manifest)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid manifest")
+    if not isinstance(entries, list) or len(entries) != len(files):
+        raise HTTPException(status_code=400, detail="Manifest does not match files")
+    if not all(isinstance(entry, dict) for entry in entries):
+        raise HTTPException(status_code=400, detail="Invalid manifest")
+    if len(files) > settings.upload_batch_max_files:
+        raise HTTPException(status_code=413, detail=f"At most {settings.upload_batch_max_files} files per batch")
+    
+    # 按截图时间顺序入库，保证相似帧比较的前后关系；结果按请求中的顺序返回
+    items = sorted(
+        ((index, file, entry) for index, (file, entry) in enumerate(zip(files, entries))),
+        key=lambda x: parse_capture_time(x[2].get("captured_at"))
+    )
+    results = [None] * len(files)
+    to_analyze = []
+    for index, file, entry in items:
+        try:
+            content = await file.read()
+            img = image_service.prepare_screenshot(content)
+            phash = _client_phash(entry.get("phash")) or image_service.compute_phash(img)
+            monitor_id = entry.get("monitor_id")
+            screenshot, is_similar = _store_screenshot(
+                db, img, phash, parse_capture_time(entry.get("captured_at")), source=content,
+                monitor_id=monitor_id if isinstance(monitor_id, int) else None,
+                app_name=entry.get("app_name"), window_title=entry.get("window_title")
+            )
+            db.commit()
+            results[index] = {
+                "success": True,
+                "screenshot_id": screenshot.id,
+                "filename": screenshot.filename,
+                "is_similar": is_similar
+            }
+            if not is_similar:
+                to_analyze.append((screenshot.id, priority_of(screenshot.timestamp)))
+        except Exception as e:
+            db.rollback()
+            results[index] = {"success": False, "error": str(e)}
+    
+    # 补传的截图按截图时间决定优先级，较早的不会挤占刚上传的截图
+    for screenshot_id, priority in to_analyze:
+        await screenshot_processor.add_to_queue(screenshot_id, priority)
+    
+    return {
+        "success": True,
+        "accepted": sum(1 for r in results if r["success"]),
+        "items": results
+    }
+
+
+@router.post("/heartbeat")
+async def heartbeat(request: HeartbeatRequest, db: Session = Depends(get_db)):
+    """
+    客户端心跳：屏幕未变化时只发送感知哈希，不上传图片
+    
+    哈希与最新截图相似时记录一条指向参考帧的相似帧，保持时间线连续；
+    否则返回 need_upload，客户端随后上传完整截图。
+    """
+    phash = _client_phash(request.phash)
+    if not phash:
+        raise HTTPException(status_code=400, detail="Invalid phash")
+    
+    last_screenshot = _last_in_stream(db, request.monitor_id)
+    if not last_screenshot or not last_screenshot.phash or \
+            image_service.calculate_similarity(phash, last_screenshot.phash) >= settings.similarity_threshold:
+        return {"success": True, "need_upload": True}
+    # 与参考帧相比已变化较多（缓慢变化的画面）时也需要上传，否则时间线一直显示旧图片
+    reference = _chain_reference(db, last_screenshot, phash)
+    if reference is None:
+        return {"success": True, "need_upload": True}
+    
+    filename, filepath, metadata = image_service.write_pointer(
+        phash, reference.filename, last_screenshot.width, last_screenshot.height, request.monitor_id
+    )
+    screenshot = Screenshot(
+        filename=filename,
+        filepath=filepath,
+        thumbnail_path=metadata["thumbnail_path"],
+        width=metadata["width"],
+        height=metadata["height"],
+        file_size=metadata["file_size"],
+        phash=metadata["phash"],
+        is_similar=True,
+        reference_filename=metadata["reference_filename"],
+        diff_box=metadata["diff_box"],
+        monitor_id=request.monitor_id,
+        app_name=_client_text(request.app_name, 255),
+        window_title=_client_text(request.window_title, 512)
+    )
+    db.add(screenshot)
+    db.commit()
+    db.refresh(screenshot)
+    
+    return {
+        "success": True,
+        "need_upload": False,
+        "screenshot_id": screenshot.id,
+        "filename": filename
+    }
+
+
 @router.get("/screenshots")
 async def get_screenshots(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    cursor: Optional[str] = None,
+    total: str = Query("cached", pattern="^(cached|exact|none)$"),
     db: Session = Depends(get_db)
 ):
-    """获取截屏列表"""
+    """
+    获取截屏列表（按时间倒序）
+
+    翻页时传上一页返回的 next_cursor（keyset 分页，任意深度的页面耗时相同），skip 仍可使用但越往后越慢。
+    total：cached（按查询条件缓存 LIST_COUNT_CACHE_SECONDS 秒）/ exact（重新计数）/ none（不计数）。
+    """
     query = db.query(Screenshot)
     
     if start_date:
@@ -85,11 +413,12 @@ async def get_screenshots(
         end = parse_date_beijing(end_date)
         query = query.filter(Screenshot.timestamp <= end)
     
-    total = query.count()
-    screenshots = query.order_by(Screenshot.timestamp.desc()).offset(skip).limit(limit).all()
+    count = count_cache.count(("screenshots", start_date, end_date), query, total)
+    screenshots, next_cursor = keyset_page(query, Screenshot, limit, cursor, skip)
     
     return {
-        "total": total,
+        "total": count,
+        "next_cursor": next_cursor,
         "items": [
             {
                 "id": s.id,
@@ -97,7 +426,11 @@ async def get_screenshots(
                 "thumbnail_url": f"/files/thumbnails/thumb_{s.filename}",
                 "timestamp": s.timestamp.isoformat(),
                 "is_analyzed": s.is_analyzed,
-                "is_similar": s.is_similar
+                "is_similar": s.is_similar,
+                "is_purged": bool(s.is_purged),
+                "monitor_id": s.monitor_id,
+                "app_name": s.app_name,
+                "window_title": s.window_title
             }
             for s in screenshots
         ]
@@ -111,9 +444,11 @@ async def get_activities(
     activity_type: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    cursor: Optional[str] = None,
+    total: str = Query("cached", pattern="^(cached|exact|none)$"),
     db: Session = Depends(get_db)
 ):
-    """获取活动列表"""
+    """获取活动列表（按时间倒序，分页和 total 参数同 /screenshots）"""
     query = db.query(Activity)
     
     if activity_type:
@@ -127,11 +462,12 @@ async def get_activities(
         end = parse_date_beijing(end_date)
         query = query.filter(Activity.timestamp <= end)
     
-    total = query.count()
-    activities = query.order_by(Activity.timestamp.desc()).offset(skip).limit(limit).all()
+    count = count_cache.count(("activities", activity_type, start_date, end_date), query, total)
+    activities, next_cursor = keyset_page(query, Activity, limit, cursor, skip)
     
     return {
-        "total": total,
+        "total": count,
+        "next_cursor": next_cursor,
         "items": [
             {
                 "id": a.id,
@@ -141,7 +477,10 @@ async def get_activities(
                 "activity_type": a.activity_type,
                 "description": a.description,
                 "application": a.application,
-                "content_summary": a.content_summary
+                "content_summary": a.content_summary,
+                "source": a.source or "vlm",
+                "model_name": a.model_name,
+                "prompt_version": a.prompt_version
             }
             for a in activities
         ]
@@ -278,6 +617,41 @@ async def get_hourly_reports(
     }
 
 
+@router.get("/reports/stream")
+async def stream_report(
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    refresh: bool = False
+):
+    """
+    按需生成任意时间段的报告（Server-Sent Events，默认当前小时整点至今）
+
+    事件依次为 meta（活动数）、token（模型生成的文本片段）、done（完整报告）；
+    已有相同时间段的报告时只发送一个 report 事件（refresh=true 时重新生成），失败时发送 error。
+    """
+    now = beijing_naive()
+    try:
+        start = parse_datetime_beijing(start_time) if start_time else now.replace(minute=0, second=0, microsecond=0)
+        end = parse_datetime_beijing(end_time) if end_time else now
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid start_time or end_time")
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end_time must be after start_time")
+    if end - start > MAX_REPORT_RANGE:
+        raise HTTPException(status_code=400, detail=f"Report range must not exceed {MAX_REPORT_RANGE.days} days")
+
+    async def events():
+        async for event, data in report_generator.stream_report(start, end, refresh):
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # 关闭反向代理缓冲，生成的文本立即到达客户端
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/reports/daily")
 async def get_daily_reports(
     limit: int = Query(7, ge=1, le=30),
@@ -325,15 +699,20 @@ async def get_today_stats(db: Session = Depends(get_db)):
     ).all()
     
     activity_type_counts = {}
+    # 分类来源：vlm 的数量即当天的视觉模型调用次数
+    source_counts = {}
     for a in activities:
         t = a.activity_type or "其他"
         activity_type_counts[t] = activity_type_counts.get(t, 0) + 1
+        source = a.source or "vlm"
+        source_counts[source] = source_counts.get(source, 0) + 1
     
     return {
         "date": start_time.date().isoformat(),
         "screenshot_count": screenshot_count,
         "activity_count": len(activities),
         "activity_distribution": activity_type_counts,
+        "analysis_sources": source_counts,
         "analyzed_count": db.query(Screenshot).filter(
             Screenshot.timestamp >= start_time,
             Screenshot.timestamp < end_time,
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+AI 分析图片基准：原图 vs 按像素预算缩放、按 patch 对齐的分析图片
+
+截图写入临时存储，通过文件服务按 ai_image_path 读取（与 AI 服务访问的路径一致），
+交给模拟的 Qwen-VL：按模型端 smart_resize 计算视觉 token 数，延迟按
+  固定开销（解码输出） + 每视觉 token 开销（视觉编码 + 预填充）
+估算。两个系数可用真实模型的实测值替换。
+
+运行方式:
+  python -m backend.benchmarks.analysis_variant --count 6
+  python -m backend.benchmarks.analysis_variant --images a.png b.png --ms-per-token 0.8
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# 在导入配置之前把存储指向临时目录
+_tmp = tempfile.mkdtemp(prefix="deskmemo_bench_")
+os.environ["STORAGE_PATH"] = _tmp
+os.environ["SCREENSHOT_PATH"] = os.path.join(_tmp, "screenshots")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'bench.db')}"
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from backend.api.files import files_router  # noqa: E402
+from backend.config import settings  # noqa: E402
+from backend.database import init_db  # noqa: E402
+from backend.services.image_service import image_service, patch_aligned_size  # noqa: E402
+
+# Qwen-VL 处理器的默认像素上限（不做客户端缩放时模型端只按它约束）
+MODEL_MAX_PIXELS = 12845056
+
+
+class MockVLM:
+    """模拟 Qwen-VL：解码图片，按模型端预处理计算视觉 token 数并估算延迟"""
+
+    def __init__(self, ms_per_token: float, fixed_ms: float, patch_size: int = 28):
+        self.ms_per_token = ms_per_token
+        self.fixed_ms = fixed_ms
+        self.patch_size = patch_size
+
+    def analyze(self, data: bytes) -> dict:
+        img = Image.open(BytesIO(data)).convert('RGB')
+        w, h = patch_aligned_size(img.width, img.height, self.patch_size, MODEL_MAX_PIXELS)
+        resampled = (w, h) != img.size
+        if resampled:
+            img = img.resize((w, h), Image.Resampling.BICUBIC)
+        tokens = (w // self.patch_size) * (h // self.patch_size)
+        return {
+            "tokens": tokens,
+            "resampled": resampled,
+            "latency_ms": self.fixed_ms + self.ms_per_token * tokens
+        }
+
+
+def synthetic_screen(width: int, height: int, seed: int) -> Image.Image:
+    """整屏的编辑器/网页画面：标题栏、侧边栏和多行文字"""
+    rng = random.Random(seed)
+    img = Image.new('RGB', (width, height), (250, 250, 250))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, width, 32), fill=(52, 58, 70))
+    draw.rectangle((0, 32, 240, height), fill=(236, 238, 242))
+    for y in range(48, height - 20, 20):
+        x = 260 + rng.choice((0, 0, 24, 48))
+        line_end = rng.uniform(0.4, 0.95) * width
+        while x < line_end:
+            word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz_()") for _ in range(rng.randint(2, 10)))
+            draw.text((x, y), word, fill=tuple(rng.randint(0, 120) for _ in range(3)))
+            x += len(word) * 6 + 6
+    return img
+
+
+def window_on_desktop(width: int, height: int, seed: int) -> Image.Image:
+    """纯色桌面中间的一个窗口（裁剪空白边缘的场景）"""
+    img = Image.new('RGB', (width, height), (30, 60, 90))
+    window = synthetic_screen(width * 3 // 5, height * 3 // 5, seed)
+    img.paste(window, (width // 5, height // 5))
+    return img
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI 分析图片基准")
+    parser.add_argument("--images", nargs="*", help="真实截图文件（默认使用合成画面）")
+    parser.add_argument("--count", type=int, default=4, help="每种合成画面的数量")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--budgets", default="1280,768,512", help="视觉 token 预算（逗号分隔）")
+    parser.add_argument("--ms-per-token", type=float, default=0.6, help="模拟模型每视觉 token 的开销（毫秒）")
+    parser.add_argument("--fixed-ms", type=float, default=900, help="模拟模型的固定开销（输出解码，毫秒）")
+    args = parser.parse_args()
+
+    if args.images:
+        frames = [(os.path.basename(path), Image.open(path).convert('RGB')) for path in args.images]
+    else:
+        frames = [(f"screen{i}", synthetic_screen(args.width, args.height, i)) for i in range(args.count)]
+        frames += [(f"window{i}", window_on_desktop(args.width, args.height, i)) for i in range(args.count)]
+
+    init_db()
+    app = FastAPI()
+    app.include_router(files_router, prefix="/files")
+    client = TestClient(app)
+    vlm = MockVLM(args.ms_per_token, args.fixed_ms, settings.analysis_patch_size)
+    patch_area = settings.analysis_patch_size ** 2
+
+    configs = [("original", False, 0, False)]
+    for budget in (int(b) for b in args.budgets.split(",") if b.strip()):
+        configs.append((f"{budget} tokens", True, budget * patch_area, False))
+        configs.append((f"{budget} tokens + crop", True, budget * patch_area, True))
+
+    print(f"{len(frames)} frames, mock VLM: {args.fixed_ms:.0f} ms + {args.ms_per_token} ms/token\n")
+    # variant ms：上传时生成分析图片的额外耗时；KB：AI 服务下载的图片大小；resampled：模型端是否还要再缩放一次
+    print(f"{'config':<22}{'frame':>8}{'variant ms':>12}{'KB':>8}{'tokens':>9}{'resampled':>11}{'latency ms':>12}")
+    baseline = {}
+    for label, enabled, max_pixels, crop in configs:
+        settings.analysis_variant_enabled = enabled
+        settings.analysis_max_pixels = max_pixels
+        settings.analysis_crop_content = crop
+        for kind in sorted({name.rstrip("0123456789") for name, _ in frames}):
+            group = [img for name, img in frames if name.rstrip("0123456789") == kind]
+            variant_ms = size = tokens = latency = resampled = 0
+            for img in group:
+                filename, _, _ = image_service.write_screenshot(img, image_service.compute_phash(img))
+                if enabled:
+                    started = time.perf_counter()
+                    image_service.write_analysis_variant(img, filename)
+                    variant_ms += (time.perf_counter() - started) * 1000
+
+                data = client.get(f"/files/{image_service.ai_image_path(filename)}").content
+                result = vlm.analyze(data)
+                size += len(data)
+                tokens += result["tokens"]
+                latency += result["latency_ms"]
+                resampled += result["resampled"]
+            n = len(group)
+            baseline.setdefault(kind, latency / n)
+            change = latency / n / baseline[kind] - 1
+            print(f"{label:<22}{kind:>8}{variant_ms / n:>12.1f}{size / n / 1024:>8.1f}{tokens / n:>9.0f}"
+                  f"{resampled:>8}/{n:<2}{latency / n:>10.0f}" + (f" ({change:+.0%})" if enabled else ""))
+    shutil.rmtree(_tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
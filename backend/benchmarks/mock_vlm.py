@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+模拟的 OpenAI 兼容视觉模型服务（提示词评估和 CI 用）
+
+- 视觉 token 数按 Qwen-VL 的 smart_resize 计算，文本 token 粗略估算（中文每字一个，其余约 4 字符一个）
+- 延迟 = 固定开销 + 每输入 token 开销 + 每输出 token 开销，再乘以 time_scale（CI 中缩短等待）
+- 活动类型按提示词中的“前台应用”关键词判断，提示词要求 JSON 时返回 JSON，否则返回一段文字（解析失败）
+- malformed_rate 比例的回复被截断（按图片内容决定，结果可复现）
+
+运行方式:
+  python -m backend.benchmarks.mock_vlm --port 8090
+  # 然后: AI_API_URL=http://localhost:8090/v1/chat/completions
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import re
+import sys
+from io import BytesIO
+from typing import Dict, Tuple
+
+import httpx
+from fastapi import FastAPI, Request
+from PIL import Image
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.services.image_service import patch_aligned_size  # noqa: E402
+
+# Qwen-VL 处理器的默认像素上限
+MODEL_MAX_PIXELS = 12845056
+PATCH_SIZE = 28
+# 无法读取图片时按 1080p 截图计算
+DEFAULT_IMAGE_SIZE = (1920, 1080)
+
+# 前台应用关键词 -> 活动类型
+APP_KEYWORDS = [
+    (re.compile(r"code|pycharm|terminal|idea|vim|终端", re.IGNORECASE), "工作"),
+    (re.compile(r"coursera|udemy|课程|anki", re.IGNORECASE), "学习"),
+    (re.compile(r"acrobat|kindle|pdf|reader|阅读", re.IGNORECASE), "阅读"),
+    (re.compile(r"bilibili|youtube|netflix|steam|spotify", re.IGNORECASE), "娱乐"),
+]
+
+_CJK_RE = re.compile(r"[一-鿿]")
+_APP_RE = re.compile(r"前台应用：([^，\n]+)")
+
+
+def estimate_text_tokens(text: str) -> int:
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class MockVLMServer:
+    """模拟模型的参数和统计"""
+
+    def __init__(self, fixed_ms: float = 300, ms_per_input_token: float = 0.5, ms_per_output_token: float = 20,
+                 time_scale: float = 1.0, malformed_rate: float = 0.0):
+        self.fixed_ms = fixed_ms
+        self.ms_per_input_token = ms_per_input_token
+        self.ms_per_output_token = ms_per_output_token
+        self.time_scale = time_scale
+        self.malformed_rate = malformed_rate
+        self.requests = 0
+
+    async def image_size(self, url: str) -> Tuple[Tuple[int, int], bytes]:
+        data = b""
+        try:
+            if url.startswith("data:"):
+                data = base64.b64decode(url.split(",", 1)[1])
+            else:
+                async with httpx.AsyncClient(timeout=30.0) as client:
+                    data = (await client.get(url)).content
+            return Image.open(BytesIO(data)).size, data
+        except Exception:
+            return DEFAULT_IMAGE_SIZE, data
+
+    async def complete(self, payload: Dict) -> Dict:
+        self.requests += 1
+        text, image_url = "", None
+        for message in payload.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, str):
+                text += content
+                continue
+            for part in content or []:
+                if part.get("type") == "text":
+                    text += part.get("text", "")
+                elif part.get("type") == "image_url":
+                    image_url = part.get("image_url", {}).get("url")
+
+        image_tokens, digest = 0, b""
+        if image_url:
+            (width, height), data = await self.image_size(image_url)
+            w, h = patch_aligned_size(width, height, PATCH_SIZE, MODEL_MAX_PIXELS)
+            image_tokens = (w // PATCH_SIZE) * (h // PATCH_SIZE)
+            digest = hashlib.md5(data).digest()
+
+        content = self.answer(text, digest)
+        max_tokens = payload.get("max_tokens") or 0
+        completion_tokens = estimate_text_tokens(content)
+        if max_tokens and completion_tokens > max_tokens:
+            content = content[:max_tokens * 2]
+            completion_tokens = max_tokens
+        prompt_tokens = estimate_text_tokens(text) + image_tokens
+
+        latency_ms = (self.fixed_ms + self.ms_per_input_token * prompt_tokens +
+                      self.ms_per_output_token * completion_tokens)
+        if self.time_scale > 0:
+            await asyncio.sleep(latency_ms * self.time_scale / 1000)
+
+        return {
+            "id": f"mock-{self.requests}",
+            "object": "chat.completion",
+            "model": payload.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+    def answer(self, prompt: str, digest: bytes) -> str:
+        match = _APP_RE.search(prompt)
+        application = match.group(1).strip() if match else "未知"
+        activity_type = next((t for pattern, t in APP_KEYWORDS if pattern.search(application)), "其他")
+        description = f"用户正在使用 {application}"
+        if "JSON" not in prompt.upper():
+            return f"活动类型：{activity_type}。{description}。"
+
+        content = json.dumps({
+            "activity_type": activity_type,
+            "application": application,
+            "description": description,
+            "content_summary": application
+        }, ensure_ascii=False, indent=2)
+        if digest and digest[0] / 256 < self.malformed_rate:
+            # 模拟输出被截断
+            content = content[:len(content) // 2]
+        return f"```json\n{content}\n```"
+
+
+def create_app(server: MockVLMServer) -> FastAPI:
+    app = FastAPI(title="Mock VLM")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        return await server.complete(await request.json())
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model"}]}
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="模拟的 OpenAI 兼容视觉模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--fixed-ms", type=float, default=300, help="每个请求的固定开销（毫秒）")
+    parser.add_argument("--ms-per-input-token", type=float, default=0.5)
+    parser.add_argument("--ms-per-output-token", type=float, default=20)
+    parser.add_argument("--time-scale", type=float, default=1.0, help="实际等待时间 = 模拟延迟 × 该系数")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="截断回复的比例")
+    args = parser.parse_args()
+
+    server = MockVLMServer(args.fixed_ms, args.ms_per_input_token, args.ms_per_output_token,
+                           args.time_scale, args.malformed_rate)
+    uvicorn.run(create_app(server), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+截图分析提示词 / 模型评估
+
+用带标注的截图集依次测试每个提示词，按与服务端相同的请求结构（AIService.build_analysis_payload）
+和解析逻辑（parse_analysis）统计：
+- 延迟 p50 / p95
+- 平均输入（提示词 + 图片）/ 输出 token 数（取自响应的 usage）
+- JSON 解析成功率（服务端解析失败时会把活动记为“其他”）
+- 活动类型与标注一致的比例
+
+截图集目录包含 labels.json：
+  [{"file": "a.png", "activity_type": "工作", "app_name": "Code", "window_title": "main.py"}, ...]
+app_name / window_title 可选，存在时与服务端一样作为参考信息附加到提示词（--no-hint 关闭）。
+提示词文件为 JSON 对象 {"名称": "提示词", ...}，当前的 ANALYSIS_PROMPT 默认一并参与比较。
+图片默认按 AI 分析图片的设置缩放（与服务端一致），以 data URL 发送。
+
+运行方式:
+  # CI：进程内的模拟模型 + 合成截图
+  python -m backend.benchmarks.prompt_eval --mock --synthetic 20 --min-parse-rate 0.9
+  # 真实模型
+  python -m backend.benchmarks.prompt_eval --dataset eval_set/ --prompts prompts.json \\
+      --endpoint http://10.0.0.1:8080/v1/chat/completions --model Qwen3-VL-2B-Instruct
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import sys
+import time
+from io import BytesIO
+from typing import Dict, List, Optional
+
+import httpx
+from PIL import Image, ImageDraw
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.config import settings  # noqa: E402
+from backend.services.ai_service import ai_service, parse_analysis, ANALYSIS_PROMPT, ANALYSIS_PROMPT_VERSION  # noqa: E402
+from backend.services.classifier import activity_classifier  # noqa: E402
+from backend.services.image_service import image_service, encode_image  # noqa: E402
+
+MOCK_ENDPOINT = "http://mock-vlm/v1/chat/completions"
+
+# 合成截图：(前台应用, 窗口标题, 标注的活动类型, 背景色)
+SYNTHETIC_APPS = [
+    ("Code", "processor.py - DeskMemo", "工作", (30, 30, 30)),
+    ("bilibili", "视频播放", "娱乐", (250, 240, 245)),
+    ("Adobe Acrobat", "paper.pdf", "阅读", (240, 240, 240)),
+    ("Coursera", "Machine Learning - Week 3", "学习", (245, 250, 255)),
+    ("Finder", "Downloads", "其他", (236, 236, 236)),
+]
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """最近秩百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def load_dataset(path: str) -> List[Dict]:
+    with open(os.path.join(path, "labels.json"), encoding="utf-8") as f:
+        entries = json.load(f)
+    samples = []
+    for entry in entries:
+        with open(os.path.join(path, entry["file"]), "rb") as f:
+            samples.append({**entry, "data": f.read()})
+    return samples
+
+
+def synthetic_dataset(count: int, width: int = 1920, height: int = 1080) -> List[Dict]:
+    """带标题栏和文字行的合成截图，应用和标注循环取 SYNTHETIC_APPS"""
+    samples = []
+    for i in range(count):
+        app_name, window_title, activity_type, background = SYNTHETIC_APPS[i % len(SYNTHETIC_APPS)]
+        img = Image.new("RGB", (width, height), background)
+        draw = ImageDraw.Draw(img)
+        draw.rectangle((0, 0, width, 32), fill=(52, 58, 70))
+        draw.text((12, 10), f"{app_name} - {window_title}", fill=(255, 255, 255))
+        for y in range(60, height - 40, 24):
+            draw.text((40 + (i * 7 + y) % 120, y), f"line {y} of sample {i}", fill=(128, 128, 128))
+        buffer = BytesIO()
+        img.save(buffer, "PNG")
+        samples.append({
+            "file": f"synthetic_{i}.png",
+            "activity_type": activity_type,
+            "app_name": app_name,
+            "window_title": window_title,
+            "data": buffer.getvalue()
+        })
+    return samples
+
+
+def image_data_url(data: bytes, original: bool) -> str:
+    if original:
+        img = Image.open(BytesIO(data)).convert("RGB")
+        data = encode_image(img, "JPEG", settings.screenshot_quality)
+    else:
+        data = image_service.to_analysis(data)
+    return "data:image/jpeg;base64," + base64.b64encode(data).decode()
+
+
+async def evaluate_prompt(client: httpx.AsyncClient, endpoint: str, prompt: str, samples: List[Dict],
+                          concurrency: int, use_hint: bool, timeout: float) -> Dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    records = []
+
+    async def run(sample: Dict):
+        hint = activity_classifier.hint(sample.get("app_name"), sample.get("window_title")) if use_hint else None
+        payload = ai_service.build_analysis_payload(sample["url"], hint, prompt)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post(endpoint, json=payload, timeout=timeout)
+                latency = (time.perf_counter() - started) * 1000
+                response.raise_for_status()
+                body = response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                records.append({"file": sample["file"], "error": str(e) or type(e).__name__})
+                return
+        content = body.get("choices", [{}])[0].get("message", {}).get("content", "")
+        usage = body.get("usage") or {}
+        parsed = parse_analysis(content)
+        predicted = parsed.get("activity_type") if parsed else None
+        records.append({
+            "file": sample["file"],
+            "latency_ms": latency,
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "parsed": parsed is not None and bool(predicted),
+            "label": sample["activity_type"],
+            "predicted": predicted
+        })
+
+    await asyncio.gather(*(run(sample) for sample in samples))
+    return summarize(records)
+
+
+def summarize(records: List[Dict]) -> Dict:
+    ok = [r for r in records if "error" not in r]
+    latencies = [r["latency_ms"] for r in ok]
+
+    def mean(key):
+        values = [r[key] for r in ok if r[key] is not None]
+        return sum(values) / len(values) if values else None
+
+    return {
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "prompt_tokens": mean("prompt_tokens"),
+        "completion_tokens": mean("completion_tokens"),
+        "parse_rate": sum(r["parsed"] for r in ok) / len(ok) if ok else 0.0,
+        "agreement": sum(r["predicted"] == r["label"] for r in ok) / len(ok) if ok else 0.0,
+        "mismatches": [
+            {"file": r["file"], "label": r["label"], "predicted": r["predicted"]}
+            for r in ok if r["predicted"] != r["label"]
+        ][:20],
+        "error_samples": [r["error"] for r in records if "error" in r][:5]
+    }
+
+
+def _fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+async def run_eval(args) -> Dict[str, Dict]:
+    samples = load_dataset(args.dataset) if args.dataset else synthetic_dataset(args.synthetic)
+    for sample in samples:
+        sample["url"] = image_data_url(sample["data"], args.original)
+    samples = samples * args.repeat
+
+    prompts = {f"current (v{ANALYSIS_PROMPT_VERSION})": ANALYSIS_PROMPT} if not args.no_current else {}
+    if args.prompts:
+        with open(args.prompts, encoding="utf-8") as f:
+            prompts.update(json.load(f))
+    if not prompts:
+        raise SystemExit("No prompts to evaluate")
+
+    if args.model:
+        ai_service.model_name = args.model
+    if args.max_tokens:
+        ai_service.max_tokens = args.max_tokens
+
+    if args.mock:
+        from backend.benchmarks.mock_vlm import MockVLMServer, create_app
+        mock = MockVLMServer(time_scale=args.mock_time_scale, malformed_rate=args.mock_malformed_rate)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(mock)))
+        endpoint = MOCK_ENDPOINT
+    else:
+        client = httpx.AsyncClient()
+        endpoint = args.endpoint or settings.ai_api_url
+
+    print(f"{len(samples)} requests per prompt, endpoint: {'mock' if args.mock else endpoint}, "
+          f"model: {ai_service.model_name}, concurrency: {args.concurrency}\n")
+    print(f"{'prompt':<24}{'p50 ms':>9}{'p95 ms':>9}{'in tok':>9}{'out tok':>9}{'parse':>8}{'agree':>8}{'errors':>8}")
+    results = {}
+    async with client:
+        for name, prompt in prompts.items():
+            result = await evaluate_prompt(client, endpoint, prompt, samples, args.concurrency,
+                                           not args.no_hint, args.timeout)
+            results[name] = result
+            print(f"{name:<24}{_fmt(result['p50_ms'], '>9.0f')}{_fmt(result['p95_ms'], '>9.0f')}"
+                  f"{_fmt(result['prompt_tokens'], '>9.0f')}{_fmt(result['completion_tokens'], '>9.0f')}"
+                  f"{result['parse_rate']:>8.0%}{result['agreement']:>8.0%}{result['errors']:>8}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="截图分析提示词 / 模型评估")
+    parser.add_argument("--dataset", help="带 labels.json 的截图目录")
+    parser.add_argument("--synthetic", type=int, default=10, help="未指定 --dataset 时生成的合成截图数")
+    parser.add_argument("--prompts", help="提示词 JSON 文件 {名称: 提示词}")
+    parser.add_argument("--no-current", action="store_true", help="不评估当前的 ANALYSIS_PROMPT")
+    parser.add_argument("--endpoint", help="OpenAI 兼容的 chat/completions 地址（默认 AI_API_URL）")
+    parser.add_argument("--model", help="模型名称（默认 AI_MODEL_NAME）")
+    parser.add_argument("--max-tokens", type=int, help="最大输出 token 数（默认 AI_MAX_TOKENS）")
+    parser.add_argument("--mock", action="store_true", help="使用进程内的模拟模型（backend.benchmarks.mock_vlm）")
+    parser.add_argument("--mock-time-scale", type=float, default=0.01, help="模拟模型的等待时间系数")
+    parser.add_argument("--mock-malformed-rate", type=float, default=0.0, help="模拟模型截断回复的比例")
+    parser.add_argument("--concurrency", type=int, default=1, help="同时发出的请求数（1 时延迟最准确）")
+    parser.add_argument("--repeat", type=int, default=1, help="每张截图重复的次数")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--original", action="store_true", help="发送原图（默认发送 AI 分析图片）")
+    parser.add_argument("--no-hint", action="store_true", help="不附加应用名和窗口标题")
+    parser.add_argument("--output", help="把结果写入 JSON 文件")
+    parser.add_argument("--min-parse-rate", type=float, help="任一提示词的解析成功率低于该值时以非零状态退出")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_eval(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.min_parse_rate is not None:
+        failing = [name for name, r in results.items() if r["errors"] or r["parse_rate"] < args.min_parse_rate]
+        if failing:
+            print(f"\nParse rate below {args.min_parse_rate:.0%} or request errors: {', '.join(failing)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
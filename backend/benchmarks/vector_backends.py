@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+向量后端基准测试：NumPy 内存映射索引 vs ChromaDB
+
+使用随机向量（跳过 embedding 模型），比较写入耗时、冷启动耗时、
+查询延迟、磁盘占用和常驻内存。
+
+运行方式:
+  python -m backend.benchmarks.vector_backends --count 100000 --dim 384
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.services.vector_index import NumpyVectorIndex, to_epoch
+
+
+def rss_mb() -> float:
+    """当前进程常驻内存（MB，仅 Linux）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return float("nan")
+
+
+def dir_size_mb(path: str) -> float:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total / 1024 / 1024
+
+
+def make_data(count: int, dim: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    base = datetime(2025, 1, 1)
+    timestamps = [base + timedelta(minutes=i) for i in range(count)]
+    ids = [f"activity_{i}" for i in range(count)]
+    queries = rng.standard_normal((50, dim)).astype(np.float32)
+    return ids, vectors, timestamps, queries
+
+
+def percentile_ms(samples, p):
+    return float(np.percentile(samples, p) * 1000)
+
+
+def bench_numpy(path, ids, vectors, timestamps, queries, dtype, batch):
+    result = {"backend": f"numpy-{dtype}"}
+    rss_before = rss_mb()
+
+    t0 = time.perf_counter()
+    index = NumpyVectorIndex(path, dtype=dtype)
+    for i in range(0, len(ids), batch):
+        index.upsert(ids[i:i + batch], vectors[i:i + batch], timestamps[i:i + batch])
+    result["build_s"] = time.perf_counter() - t0
+    del index
+
+    t0 = time.perf_counter()
+    index = NumpyVectorIndex(path, dtype=dtype)
+    result["open_s"] = time.perf_counter() - t0
+
+    latencies = []
+    for q in queries:
+        t0 = time.perf_counter()
+        index.search(q, k=10)
+        latencies.append(time.perf_counter() - t0)
+    result["p50_ms"] = percentile_ms(latencies, 50)
+    result["p95_ms"] = percentile_ms(latencies, 95)
+
+    # 带时间范围预过滤（取中间 10% 的时间窗口）
+    start = timestamps[len(timestamps) * 45 // 100]
+    end = timestamps[len(timestamps) * 55 // 100]
+    latencies = []
+    for q in queries:
+        t0 = time.perf_counter()
+        index.search(q, k=10, start_time=start, end_time=end)
+        latencies.append(time.perf_counter() - t0)
+    result["filtered_p50_ms"] = percentile_ms(latencies, 50)
+
+    result["disk_mb"] = dir_size_mb(path)
+    result["rss_delta_mb"] = rss_mb() - rss_before
+    return result
+
+
+def bench_chroma(path, ids, vectors, timestamps, queries, batch):
+    try:
+        import chromadb
+        from chromadb.config import Settings as ChromaSettings
+    except ImportError:
+        print("chromadb 未安装，跳过 Chroma 基准")
+        return None
+
+    result = {"backend": "chroma"}
+    rss_before = rss_mb()
+
+    t0 = time.perf_counter()
+    client = chromadb.PersistentClient(path=path, settings=ChromaSettings(anonymized_telemetry=False))
+    collection = client.get_or_create_collection(name="activities", metadata={"hnsw:space": "cosine"})
+    for i in range(0, len(ids), batch):
+        collection.add(
+            ids=ids[i:i + batch],
+            embeddings=vectors[i:i + batch].tolist(),
+            metadatas=[{"ts": to_epoch(ts)} for ts in timestamps[i:i + batch]]
+        )
+    result["build_s"] = time.perf_counter() - t0
+    del collection, client
+
+    t0 = time.perf_counter()
+    client = chromadb.PersistentClient(path=path, settings=ChromaSettings(anonymized_telemetry=False))
+    collection = client.get_or_create_collection(name="activities", metadata={"hnsw:space": "cosine"})
+    collection.query(query_embeddings=[queries[0].tolist()], n_results=10)
+    result["open_s"] = time.perf_counter() - t0
+
+    latencies = []
+    for q in queries:
+        t0 = time.perf_counter()
+        collection.query(query_embeddings=[q.tolist()], n_results=10)
+        latencies.append(time.perf_counter() - t0)
+    result["p50_ms"] = percentile_ms(latencies, 50)
+    result["p95_ms"] = percentile_ms(latencies, 95)
+
+    start = to_epoch(timestamps[len(timestamps) * 45 // 100])
+    end = to_epoch(timestamps[len(timestamps) * 55 // 100])
+    where = {"$and": [{"ts": {"$gte": start}}, {"ts": {"$lt": end}}]}
+    latencies = []
+    for q in queries:
+        t0 = time.perf_counter()
+        collection.query(query_embeddings=[q.tolist()], n_results=10, where=where)
+        latencies.append(time.perf_counter() - t0)
+    result["filtered_p50_ms"] = percentile_ms(latencies, 50)
+
+    result["disk_mb"] = dir_size_mb(path)
+    result["rss_delta_mb"] = rss_mb() - rss_before
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量后端基准测试")
+    parser.add_argument("--count", type=int, default=50000, help="向量数量")
+    parser.add_argument("--dim", type=int, default=384, help="向量维度（all-MiniLM-L6-v2 为 384）")
+    parser.add_argument("--batch", type=int, default=1000, help="写入批大小")
+    parser.add_argument("--skip-chroma", action="store_true", help="跳过 Chroma 基准")
+    args = parser.parse_args()
+
+    ids, vectors, timestamps, queries = make_data(args.count, args.dim)
+    workdir = tempfile.mkdtemp(prefix="deskmemo_vecbench_")
+
+    results = []
+    try:
+        for dtype in ("float16", "int8"):
+            results.append(bench_numpy(
+                os.path.join(workdir, dtype), ids, vectors, timestamps, queries, dtype, args.batch
+            ))
+        if not args.skip_chroma:
+            chroma = bench_chroma(os.path.join(workdir, "chroma"), ids, vectors, timestamps, queries, args.batch)
+            if chroma:
+                results.append(chroma)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n向量数: {args.count}, 维度: {args.dim}")
+    columns = ["backend", "build_s", "open_s", "p50_ms", "p95_ms", "filtered_p50_ms", "disk_mb", "rss_delta_mb"]
+    print("  ".join(f"{c:>16}" for c in columns))
+    for r in results:
+        print("  ".join(
+            f"{r[c]:>16}" if isinstance(r[c], str) else f"{r[c]:>16.3f}" for c in columns
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,26 @@ class ServerSettings(BaseSettings):
     ai_model_name: str = "Qwen3-VL-2B-Instruct"
     ai_max_tokens: int = 500
     ai_image_server: str = "http://localhost:8000/files"  # AI 访问图片的 URL
+    ai_api_urls: str = ""  # 多个推理服务 "url|权重,url|权重"（为空时只使用 ai_api_url）
+    ai_health_interval: float = 15.0  # 主动健康检查间隔（秒，0 表示关闭）
+    ai_unhealthy_after: int = 3  # 连续失败该次数后暂停向端点分发
+    ai_hedge_enabled: bool = False  # 截图分析超过端点 p95 延迟时向另一个端点再发一份
+    ai_hedge_min_delay: float = 2.0  # 对冲前至少等待的秒数
+    analysis_workers: int = 0  # 并发分析的截图数（0 表示各端点并发上限之和）
+    ai_endpoint_concurrency: int = 2  # 每个端点同时处理的请求上限（可在 ai_api_urls 中按端点设置）
+    ai_endpoint_rate: float = 0  # 每个端点每秒最多发出的请求数（令牌桶，0 表示不限速）
+    ai_endpoint_burst: int = 4  # 令牌桶容量（允许的突发请求数）
+    ai_fresh_window: int = 300  # 截图上传后该秒数内按“新截图”优先分析，更早的按积压处理
+    ai_priority_aging: float = 60.0  # 排队每满该秒数相当于提升一个优先级（0 表示严格优先级）
+    backlog_threshold: int = 500  # 积压的待分析截图超过该数量时抽样分析（0 表示全部分析）
+    backlog_sample_minutes: int = 5  # 抽样时同一应用每该分钟数只分析一张，其余用相邻的分析结果补全
+    reanalysis_concurrency: int = 2  # 重新分析任务默认同时分析的截图数
+    reanalysis_rate: float = 1.0  # 重新分析任务默认每秒最多发出的请求数（0 表示不限速）
+    reanalysis_batch_size: int = 50  # 重新分析每批截图数（每批提交一次检查点）
+    report_hourly_items: int = 15  # 小时报告提示词中最多的活动条数（相近活动聚类合并）
+    report_daily_items: int = 40  # 日报提示词中最多的活动条数
+    report_cluster_similarity: float = 0.85  # 活动向量与组中心的余弦相似度不低于该值时并入同一组
+    report_max_activity_minutes: float = 5.0  # 单条活动最多计入的时长（到下一条活动的间隔超过时视为离开）
     
     # Storage (使用绝对路径)
     storage_path: str = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage")
@@ -22,16 +42,52 @@ class ServerSettings(BaseSettings):
     
     # Vector Database
     chroma_path: str = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage", "chroma_data")
+    vector_backend: str = "chroma"  # chroma / numpy
+    vector_index_path: str = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage", "vector_index")
+    vector_index_dtype: str = "float16"  # float16 / int8（仅 numpy 后端）
+    embedding_model: str = "all-MiniLM-L6-v2"  # 与 Chroma 默认 embedding 一致（仅 numpy 后端）
     
     # Image Processing
     screenshot_quality: int = 85
     screenshot_max_width: int = 1920
     screenshot_max_height: int = 1080
     similarity_threshold: int = 10
+    storage_format: str = "webp"  # jpeg / webp / avif（服务端编码截图使用的格式，AI 分析时按需转 JPEG）
+    upload_formats: str = "avif,webp,jpeg"  # 接受客户端上传的格式（通过 GET /api/upload/formats 协商）
+    similar_frame_storage: str = "reference"  # full / reference / diff（相似帧的存储方式）
+    similar_diff_max_area: float = 0.25  # diff 模式下补丁面积上限（占整帧比例），超过则存完整图片
+    upload_batch_max_files: int = 100  # 批量补传接口单次最多文件数
+    delta_max_tiles: int = 2048  # 增量上传单帧最多块数
+    analysis_crop_changed: bool = False  # AI 只分析增量帧中变化的区域（上下文更少，但图片更小）
+    analysis_crop_max_area: float = 0.5  # 变化区域超过整帧该比例时仍分析整帧
+    analysis_variant_enabled: bool = True  # 上传时生成按像素预算缩放的分析图片，AI 读取它而不是原图
+    analysis_max_pixels: int = 1003520  # 分析图片的像素预算（1280 个 28×28 视觉 token）
+    analysis_patch_size: int = 28  # 模型的 patch 大小（Qwen-VL 为 28），分析图片宽高按它对齐
+    analysis_crop_content: bool = False  # 分析图片裁掉纯色空白边缘
+    
+    # Metadata Classification（按客户端上报的应用名和窗口标题分类，跳过视觉模型）
+    classification_enabled: bool = True
+    classification_rules_path: str = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage", "classification_rules.json")
+    classification_min_samples: int = 3  # 模型连续给出相同分类的次数达到该值后直接复用
+    classification_verify_interval: int = 20  # 每命中 N 次仍交给模型复核一次（0 表示不复核）
+    classification_cache_size: int = 5000  # 学习缓存的 (应用, 标题模式) 数量
+    analysis_metadata_hint: bool = True  # 调用模型时把应用名和窗口标题附加到提示词
+    
+    # Archive（已关闭日期按天打包）
+    archive_enabled: bool = True
     
     # Retention
     retain_original_days: int = 7
     retain_compressed_days: int = 30
+    retention_enabled: bool = True
+    retention_compress_quality: int = 60
+    retention_workers: int = 2  # 并行压缩线程数
+    retention_batch_size: int = 100
+    retention_max_mb_per_second: float = 20.0  # 磁盘读写限速（0 表示不限速），避免影响上传
+    retention_delete_records: bool = False  # 过期截图连同活动记录、向量和截图记录一并删除（默认只删除图片）
+    
+    # API
+    list_count_cache_seconds: int = 60  # 截屏 / 活动列表总数按查询条件缓存的秒数（0 表示每次重新计数）
     
     # Authentication
     auth_password: Optional[str] = None
@@ -4,7 +4,6 @@ os.environ["ANONYMIZED_TELEMETRY"] = "False"
 
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from contextlib import asynccontextmanager
 import logging
@@ -14,7 +13,12 @@ from backend.database import init_db
 from backend.api import routes
 from backend.api.manual_trigger import trigger_router
 from backend.api.auth import auth_router, verify_token
+from backend.api.files import files_router
+from backend.services.vlm_pool import vlm_pool
 from backend.tasks.processor import screenshot_processor, report_generator
+from backend.tasks.retention import retention_manager
+from backend.tasks.archiver import day_archiver
+from backend.tasks.reanalysis import reanalyzer
 
 # 配置日志
 logging.basicConfig(
@@ -44,10 +48,16 @@ async def lifespan(app: FastAPI):
     os.makedirs(settings.storage_path, exist_ok=True)
     os.makedirs(settings.screenshot_path, exist_ok=True)
     
+    # AI 服务端点（多个端点时启动主动健康检查）
+    await vlm_pool.start()
+    
     # 启动截屏处理器（异步队列模式）
     await screenshot_processor.start()
     logger.info("Screenshot processor started")
     
+    # 继续上次未完成的重新分析任务
+    reanalyzer.resume_interrupted()
+    
     # 启动定时任务（仅保留报告生成）
     # 每小时生成一次小时报告（在每小时的第5分钟）
     scheduler.add_job(
@@ -66,14 +76,34 @@ async def lifespan(app: FastAPI):
         id='daily_report'
     )
     
+    # 每天凌晨0点30分打包已关闭日期的截图
+    scheduler.add_job(
+        day_archiver.run,
+        'cron',
+        hour=0,
+        minute=30,
+        id='archive'
+    )
+    
+    # 每天凌晨3点30分执行保留策略（压缩旧原图、清理过期截图）
+    scheduler.add_job(
+        retention_manager.run,
+        'cron',
+        hour=3,
+        minute=30,
+        id='retention'
+    )
+    
     scheduler.start()
     logger.info("Scheduler started")
     
     yield
     
     # 关闭时
+    await reanalyzer.stop()
     await screenshot_processor.stop()
     logger.info("Screenshot processor stopped")
+    await vlm_pool.stop()
     scheduler.shutdown()
     logger.info("Scheduler stopped")
 
@@ -95,9 +125,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 静态文件服务
-if os.path.exists(settings.screenshot_path):
-    app.mount("/files", StaticFiles(directory=settings.screenshot_path), name="files")
+# 截图文件服务（日期分片目录 + 按天打包归档）
+app.include_router(files_router, prefix="/files", tags=["files"])
 
 # 注册路由
 app.include_router(auth_router, prefix="/api/auth", tags=["auth"])
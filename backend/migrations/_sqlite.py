@@ -0,0 +1,83 @@
+"""
+SQLite 迁移辅助函数
+
+新增字段的迁移脚本共用：解析数据库路径、按需添加缺失字段。
+"""
+import sqlite3
+import os
+import sys
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.config import settings
+
+
+def resolve_db_path():
+    """从配置中提取数据库路径（不存在时返回 None）"""
+    db_url = settings.database_url
+    if db_url.startswith('sqlite:///'):
+        db_path = db_url.replace('sqlite:///', '')
+    else:
+        print(f"错误: 不支持的数据库类型: {db_url}")
+        return None
+    
+    # 使数据库路径绝对化
+    if not os.path.isabs(db_path):
+        # 相对路径，相对于项目根目录
+        project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        db_path = os.path.join(project_root, db_path)
+    
+    if not os.path.exists(db_path):
+        print(f"错误: 数据库文件不存在: {db_path}")
+        return None
+    
+    return db_path
+
+
+def add_columns(table: str, columns: list, indexes: list = None) -> bool:
+    """
+    为表添加缺失的字段和索引
+    
+    Args:
+        table: 表名
+        columns: [(字段名, 类型定义)]，如 [("is_compressed", "BOOLEAN DEFAULT 0")]
+        indexes: [(索引名, 字段列表)]，如 [("ix_screenshots_ts_id", "timestamp, id")]
+    """
+    db_path = resolve_db_path()
+    if not db_path:
+        return False
+    
+    print(f"数据库路径: {db_path}")
+    
+    try:
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        
+        # 检查字段是否已存在
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = [col[1] for col in cursor.fetchall()]
+        
+        for name, ddl in columns:
+            if name in existing:
+                print(f"字段 '{table}.{name}' 已存在，跳过迁移")
+            else:
+                print(f"添加字段 '{table}.{name}'...")
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+                print(f"✓ 字段 '{table}.{name}' 添加成功")
+        
+        for index_name, index_columns in indexes or []:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({index_columns})")
+            print(f"✓ 索引 '{index_name}' 已就绪")
+        
+        conn.commit()
+        conn.close()
+        
+        print("\n迁移完成！")
+        return True
+        
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+数据库迁移：添加增量上传变化区域字段
+
+运行方式:
+  python backend/migrations/add_delta_fields.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _sqlite import add_columns
+
+
+def migrate():
+    """执行迁移"""
+    return add_columns("screenshots", [
+        ("changed_region", "VARCHAR(64)"),
+    ])
+
+
+if __name__ == "__main__":
+    success = migrate()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+数据库迁移：添加客户端元数据字段（应用名、窗口标题）和活动分类来源
+
+运行方式:
+  python backend/migrations/add_metadata_fields.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _sqlite import add_columns
+
+
+def migrate():
+    """执行迁移"""
+    return add_columns("screenshots", [
+        ("app_name", "VARCHAR(255)"),
+        ("window_title", "VARCHAR(512)"),
+    ]) and add_columns("activities", [
+        ("source", "VARCHAR(20) DEFAULT 'vlm'"),
+    ])
+
+
+if __name__ == "__main__":
+    success = migrate()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+数据库迁移：添加显示器编号字段（多显示器截图按显示器分别判断相似帧）
+
+运行方式:
+  python backend/migrations/add_monitor_fields.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _sqlite import add_columns
+
+
+def migrate():
+    """执行迁移"""
+    return add_columns("screenshots", [
+        ("monitor_id", "INTEGER"),
+    ], indexes=[
+        ("ix_screenshots_monitor_id", "monitor_id"),
+    ])
+
+
+if __name__ == "__main__":
+    success = migrate()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+数据库迁移：添加 (timestamp, id) 复合索引（截屏和活动列表的 keyset 分页）
+
+运行方式:
+  python backend/migrations/add_pagination_indexes.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _sqlite import add_columns
+
+
+def migrate():
+    """执行迁移"""
+    return add_columns("screenshots", [], indexes=[
+        ("ix_screenshots_ts_id", "timestamp, id"),
+    ]) and add_columns("activities", [], indexes=[
+        ("ix_activities_ts_id", "timestamp, id"),
+        ("ix_activities_type_ts_id", "activity_type, timestamp, id"),
+    ])
+
+
+if __name__ == "__main__":
+    success = migrate()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+数据库迁移：添加相似帧参考存储字段
+
+运行方式:
+  python backend/migrations/add_reference_fields.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _sqlite import add_columns
+
+
+def migrate():
+    """执行迁移"""
+    return add_columns("screenshots", [
+        ("reference_filename", "VARCHAR(255)"),
+        ("diff_box", "VARCHAR(64)"),
+    ], indexes=[
+        ("ix_screenshots_reference_filename", "reference_filename"),
+    ])
+
+
+if __name__ == "__main__":
+    success = migrate()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+数据库迁移：添加分级保留字段（已压缩、图片已删除）
+
+运行方式:
+  python backend/migrations/add_retention_fields.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _sqlite import add_columns
+
+
+def migrate():
+    """执行迁移（retention_logs 表由 init_db 自动创建）"""
+    return add_columns("screenshots", [
+        ("is_compressed", "BOOLEAN DEFAULT 0"),
+        ("is_purged", "BOOLEAN DEFAULT 0"),
+    ])
+
+
+if __name__ == "__main__":
+    success = migrate()
+    sys.exit(0 if success else 1)
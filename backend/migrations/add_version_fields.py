@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+数据库迁移：添加活动记录的模型和提示词版本字段
+
+已有的活动版本未知（为空），重新分析时视为旧版本。
+
+运行方式:
+  python backend/migrations/add_version_fields.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _sqlite import add_columns
+
+
+def migrate():
+    """执行迁移（reanalysis_jobs、activity_revisions 表由 init_db 自动创建）"""
+    return add_columns("activities", [
+        ("model_name", "VARCHAR(100)"),
+        ("prompt_version", "VARCHAR(20)"),
+    ])
+
+
+if __name__ == "__main__":
+    success = migrate()
+    sys.exit(0 if success else 1)
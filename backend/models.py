@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Float, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Text, Float, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 from backend.utils.timezone import beijing_naive
@@ -9,6 +9,9 @@ Base = declarative_base()
 class Screenshot(Base):
     """截屏记录模型"""
     __tablename__ = "screenshots"
+    __table_args__ = (
+        Index("ix_screenshots_ts_id", "timestamp", "id"),  # 时间轴 keyset 分页
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String(255), unique=True, nullable=False)
@@ -20,7 +23,15 @@ class Screenshot(Base):
     file_size = Column(Integer)
     phash = Column(String(64), index=True)  # 感知哈希值
     is_similar = Column(Boolean, default=False)  # 是否与前一张相似
+    reference_filename = Column(String(255), nullable=True, index=True)  # 相似帧引用的参考帧（未单独存储图片）
+    diff_box = Column(String(64), nullable=True)  # 相似帧补丁在参考帧中的位置 "x0,y0,x1,y1"
+    changed_region = Column(String(64), nullable=True)  # 增量上传帧相对上一帧变化的区域 "x0,y0,x1,y1"
+    monitor_id = Column(Integer, nullable=True, index=True)  # 客户端显示器编号（每个显示器单独判断相似帧）
+    app_name = Column(String(255), nullable=True)  # 客户端上报的前台应用
+    window_title = Column(String(512), nullable=True)  # 客户端上报的窗口标题
     is_analyzed = Column(Boolean, default=False, index=True)  # 是否已分析
+    is_compressed = Column(Boolean, default=False)  # 是否已被保留策略压缩
+    is_purged = Column(Boolean, default=False)  # 图片已被保留策略删除（记录和活动保留）
     analysis_failed_count = Column(Integer, default=0)  # 分析失败次数
     last_analysis_error = Column(Text, nullable=True)  # 最后一次错误信息
     created_at = Column(DateTime, default=beijing_naive)
@@ -29,6 +40,10 @@ class Screenshot(Base):
 class Activity(Base):
     """活动解析结果模型"""
     __tablename__ = "activities"
+    __table_args__ = (
+        Index("ix_activities_ts_id", "timestamp", "id"),  # 活动列表 keyset 分页
+        Index("ix_activities_type_ts_id", "activity_type", "timestamp", "id"),  # 按类型筛选的活动列表
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     screenshot_id = Column(Integer, index=True)
@@ -40,6 +55,9 @@ class Activity(Base):
     description = Column(Text)  # 活动描述
     application = Column(String(255))  # 应用程序
     content_summary = Column(Text)  # 内容摘要
+    source = Column(String(20), default="vlm")  # 分类来源：vlm（视觉模型）/ rule（规则）/ cache（学习缓存）/ fill（积压抽样时用相邻结果补全）
+    model_name = Column(String(100), nullable=True)  # 生成该结果的视觉模型（规则、缓存分类为空）
+    prompt_version = Column(String(20), nullable=True)  # 分析提示词版本
     
     # OCR 文本
     ocr_text = Column(Text, nullable=True)
@@ -55,7 +73,7 @@ class Report(Base):
     __tablename__ = "reports"
     
     id = Column(Integer, primary_key=True, index=True)
-    report_type = Column(String(20), index=True)  # hourly/daily
+    report_type = Column(String(20), index=True)  # hourly/daily/custom（按需生成的任意时间段）
     start_time = Column(DateTime, index=True)
     end_time = Column(DateTime, index=True)
     
@@ -72,3 +90,60 @@ class Report(Base):
     other_minutes = Column(Integer, default=0)
     
     created_at = Column(DateTime, default=beijing_naive)
+
+
+class RetentionLog(Base):
+    """保留策略执行记录"""
+    __tablename__ = "retention_logs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    started_at = Column(DateTime, index=True)
+    finished_at = Column(DateTime, nullable=True)
+    
+    compressed_count = Column(Integer, default=0)  # 重新压缩的原图数量
+    deleted_count = Column(Integer, default=0)  # 过期删除的截图数量
+    bytes_reclaimed = Column(Integer, default=0)  # 回收的磁盘空间（字节）
+    error = Column(Text, nullable=True)
+
+
+class ReanalysisJob(Base):
+    """重新分析任务（更换模型或提示词后重新处理历史截图）"""
+    __tablename__ = "reanalysis_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    start_time = Column(DateTime)  # 截图时间范围
+    end_time = Column(DateTime)
+    model_name = Column(String(100))  # 目标模型和提示词版本
+    prompt_version = Column(String(20))
+    force = Column(Boolean, default=False)  # 已是目标版本的活动也重新分析
+    concurrency = Column(Integer)  # 同时分析的截图数
+    rate = Column(Float)  # 每秒最多发出的分析请求数（0 表示不限速）
+    
+    state = Column(String(20), default="running", index=True)  # running/paused/completed/cancelled/failed
+    last_screenshot_id = Column(Integer, default=0)  # 检查点：已处理到的截图 id
+    processed = Column(Integer, default=0)  # 已处理的截图数（含跳过）
+    staged = Column(Integer, default=0)  # 已暂存的新结果数
+    failed = Column(Integer, default=0)  # 分析失败的截图数（保留原结果）
+    swapped = Column(Integer, default=0)  # 切换时替换的活动数
+    error = Column(Text, nullable=True)
+    
+    created_at = Column(DateTime, default=beijing_naive)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class ActivityRevision(Base):
+    """重新分析暂存的新结果，任务完成后在一个事务中替换 activities"""
+    __tablename__ = "activity_revisions"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, index=True)
+    screenshot_id = Column(Integer, index=True)
+    
+    activity_type = Column(String(100))
+    description = Column(Text)
+    application = Column(String(255))
+    content_summary = Column(Text)
+    model_name = Column(String(100))
+    prompt_version = Column(String(20))
+    
+    created_at = Column(DateTime, default=beijing_naive)
@@ -0,0 +1,193 @@
+"""
+报告生成前的活动压缩
+
+一小时有几百条、一天有几千条活动，直接交给模型会超出上下文，只取前几条又会漏掉大部分时间。
+这里用向量库中已存储的活动向量把描述相近的活动聚成一组：
+- 每条活动的时长为到下一条活动的间隔（不超过 REPORT_MAX_ACTIVITY_MINUTES）
+- 按时间顺序贪心聚类（与组中心的余弦相似度不低于 REPORT_CLUSTER_SIMILARITY 时并入），
+  组数超过上限时合并中心最接近的两组（中心按时长加权）
+- 每组取最接近中心的一条作为代表，附上时间范围、总时长和条数
+
+没有向量的活动（向量库缺失）并入时间上最近的同一 (活动类型, 应用) 活动所在的组，找不到时单独分组。
+"""
+import logging
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityCluster:
+    __slots__ = ("members", "centroid", "weight")
+
+    def __init__(self):
+        self.members: List[int] = []
+        self.centroid: Optional[np.ndarray] = None
+        self.weight = 0.0  # 总时长（分钟）
+
+    def add(self, index: int, vector: Optional[np.ndarray], minutes: float):
+        self.members.append(index)
+        if vector is not None:
+            total = self.centroid * self.weight if self.centroid is not None else 0.0
+            self.centroid = (total + vector * minutes) / (self.weight + minutes)
+        self.weight += minutes
+
+    def merge(self, other: "ActivityCluster"):
+        self.centroid = (self.centroid * self.weight + other.centroid * other.weight) / (self.weight + other.weight)
+        self.members += other.members
+        self.weight += other.weight
+
+
+def activity_minutes(activities: list) -> List[float]:
+    """每条活动的时长（分钟）：到下一条活动的间隔，最后一条取前面各条的中位数"""
+    cap = settings.report_max_activity_minutes
+    minutes = [
+        min((b.timestamp - a.timestamp).total_seconds() / 60, cap)
+        for a, b in zip(activities, activities[1:])
+    ]
+    minutes.append(float(np.median(minutes)) if minutes else min(1.0, cap))
+    # 同一时刻的多条记录（多显示器）至少计一点时长，代表选择时不被忽略
+    return [max(m, 0.1) for m in minutes]
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+def cluster_activities(activities: list, vectors: Dict[int, np.ndarray], minutes: List[float],
+                       max_clusters: int, similarity: float) -> List[ActivityCluster]:
+    clusters: List[ActivityCluster] = []
+    missing: List[int] = []
+    # 各组归一化中心（按需扩容），每条活动只做一次矩阵向量乘
+    centroids: Optional[np.ndarray] = None
+    for i, activity in enumerate(activities):
+        vector = vectors.get(i)
+        if vector is None:
+            missing.append(i)
+            continue
+        j = -1
+        if clusters:
+            sims = centroids[:len(clusters)] @ vector
+            j = int(np.argmax(sims))
+            if sims[j] < similarity:
+                j = -1
+        if j < 0:
+            if centroids is None:
+                centroids = np.zeros((64, vector.shape[0]), dtype=np.float32)
+            elif len(clusters) == len(centroids):
+                centroids = np.concatenate([centroids, np.zeros_like(centroids)])
+            j = len(clusters)
+            clusters.append(ActivityCluster())
+        clusters[j].add(i, vector, minutes[i])
+        centroids[j] = _normalize(clusters[j].centroid)
+
+    # 组数超过上限：合并中心最接近的两组
+    budget = max(max_clusters, 1)
+    if len(clusters) > budget:
+        centroids = np.stack([_normalize(c.centroid) for c in clusters])
+        sims = centroids @ centroids.T
+        np.fill_diagonal(sims, -np.inf)
+        alive = list(range(len(clusters)))
+        while len(alive) > budget:
+            sub = sims[np.ix_(alive, alive)]
+            a, b = np.unravel_index(int(np.argmax(sub)), sub.shape)
+            keep, drop = alive[a], alive[b]
+            clusters[keep].merge(clusters[drop])
+            alive.remove(drop)
+            merged = _normalize(clusters[keep].centroid)
+            row = centroids @ merged
+            centroids[keep] = merged
+            sims[keep, :] = row
+            sims[:, keep] = row
+            sims[keep, keep] = -np.inf
+        clusters = [clusters[i] for i in alive]
+
+    # 没有向量的活动
+    def key_of(i):
+        return activities[i].activity_type or "其他", activities[i].application or "未知"
+
+    owners: Dict[tuple, List[tuple]] = {}
+    for cluster in clusters:
+        for i in cluster.members:
+            owners.setdefault(key_of(i), []).append((i, cluster))
+    for entries in owners.values():
+        entries.sort(key=lambda entry: entry[0])
+    positions = {key: [i for i, _ in entries] for key, entries in owners.items()}
+    keyed: Dict[tuple, ActivityCluster] = {}
+    for i in missing:
+        key = key_of(i)
+        if key in owners:
+            pos = bisect_left(positions[key], i)
+            _, nearest = min(owners[key][max(pos - 1, 0):pos + 1], key=lambda entry: abs(entry[0] - i))
+            nearest.members.append(i)
+            nearest.weight += minutes[i]
+        else:
+            keyed.setdefault(key_of(i), ActivityCluster()).add(i, None, minutes[i])
+
+    return clusters + list(keyed.values())
+
+
+def _representative(cluster: ActivityCluster, vectors: Dict[int, np.ndarray], minutes: List[float]) -> int:
+    if cluster.centroid is None:
+        # 没有向量：取时长最长的一条
+        return max(cluster.members, key=lambda i: minutes[i])
+    centroid = _normalize(cluster.centroid)
+    return max((i for i in cluster.members if i in vectors), key=lambda i: float(vectors[i] @ centroid))
+
+
+def build_digest(activities: list, max_items: int) -> List[Dict]:
+    """
+    把时间段内的活动压缩为不超过 max_items 条代表活动
+
+    Args:
+        activities: 活动记录（按时间排序）
+        max_items: 最多输出的条数
+
+    Returns:
+        按开始时间排序的 [{"start", "end", "minutes", "count", "activity"}]
+    """
+    if not activities:
+        return []
+    activities = sorted(activities, key=lambda a: a.timestamp)
+    minutes = activity_minutes(activities)
+
+    from backend.services.vector_service import vector_service
+
+    ids = [a.vector_id or f"activity_{a.screenshot_id}" for a in activities]
+    stored = vector_service.get_embeddings(ids)
+    vectors = {i: _normalize(np.asarray(stored[vid], dtype=np.float32)) for i, vid in enumerate(ids) if vid in stored}
+    if len(vectors) < len(activities):
+        logger.info(f"Report digest: {len(activities) - len(vectors)} of {len(activities)} activities have no vector")
+
+    clusters = cluster_activities(activities, vectors, minutes, max_items, settings.report_cluster_similarity)
+    # 没有向量的分组也可能超过上限：只保留时长最长的几组
+    clusters = sorted(clusters, key=lambda c: c.weight, reverse=True)[:max_items]
+
+    items = []
+    for cluster in clusters:
+        members = sorted(cluster.members)
+        items.append({
+            "start": activities[members[0]].timestamp,
+            "end": activities[members[-1]].timestamp,
+            "minutes": cluster.weight,
+            "count": len(members),
+            "activity": activities[_representative(cluster, vectors, minutes)]
+        })
+    return sorted(items, key=lambda item: item["start"])
+
+
+def format_digest(items: List[Dict]) -> str:
+    """报告提示词中的活动列表"""
+    lines = []
+    for item in items:
+        activity = item["activity"]
+        span = item["start"].strftime('%H:%M')
+        if item["end"].strftime('%H:%M') != span:
+            span += f"-{item['end'].strftime('%H:%M')}"
+        label = f"[{activity.activity_type or '其他'}] " + (f"{activity.application}：" if activity.application else "")
+        lines.append(f"- {span}（约 {max(round(item['minutes']), 1)} 分钟，{item['count']} 条）{label}{activity.description}")
+    return "\n".join(lines)
@@ -0,0 +1,147 @@
+"""
+AI 请求调度
+
+截图分析和报告生成共用推理服务，所有请求在这里排队，按优先级分配端点容量（见 vlm_pool）：
+- INTERACTIVE：用户正在等待的请求（按需生成的流式报告）
+- FRESH：刚上传的截图（AI_FRESH_WINDOW 秒内），时间线和搜索尽快可见
+- REPORT：小时报告和日报
+- BACKLOG：积压的截图（服务重启、推理服务故障恢复后的补分析）
+- REANALYSIS：更换模型或提示词后重新分析历史截图
+
+同一优先级先到先得；等待时间每过 AI_PRIORITY_AGING 秒相当于提升一级，低优先级请求不会一直得不到服务。
+端点达到并发上限或令牌用完时请求在这里等待，容量释放或令牌补充后按优先级分配。
+"""
+import asyncio
+import itertools
+import time
+from enum import IntEnum
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from backend.config import settings
+from backend.services.vlm_pool import Endpoint, VLMPool, vlm_pool
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    FRESH = 1
+    REPORT = 2
+    BACKLOG = 3
+    REANALYSIS = 4
+
+
+def aged_rank(priority: Priority, enqueued: float) -> float:
+    """
+    固定的排序键，与按等待时间提升优先级的顺序一致（越小越先处理）
+
+    priority - (now - enqueued) / aging 中 now 对所有请求相同，按 priority * aging + enqueued 排序结果不变，
+    可以直接用于 asyncio.PriorityQueue。AI_PRIORITY_AGING 为 0 时只按优先级排序。
+    """
+    aging = settings.ai_priority_aging
+    return priority * aging + enqueued if aging > 0 else float(priority)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "enqueued", "future")
+
+    def __init__(self, priority: Priority, seq: int, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.future = future
+
+    def rank(self, now: float):
+        aging = settings.ai_priority_aging
+        boost = (now - self.enqueued) / aging if aging > 0 else 0.0
+        return self.priority - boost, self.seq
+
+
+class AIScheduler:
+    """按优先级把推理服务的容量分配给等待中的请求"""
+
+    def __init__(self, pool: VLMPool):
+        self.pool = pool
+        self.waiters: List[_Waiter] = []
+        self.seq = itertools.count()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.stats = {p.name.lower(): {"granted": 0, "wait_total": 0.0, "wait_max": 0.0} for p in Priority}
+        pool.listeners.append(self._dispatch)
+
+    async def post(self, payload: Dict, priority: Priority, timeout: float = 120.0, hedge: bool = False) -> httpx.Response:
+        """排队等待端点容量后发送请求"""
+        endpoint = await self._acquire(priority)
+        return await self.pool.post(payload, timeout=timeout, hedge=hedge, endpoint=endpoint)
+
+    async def stream(self, payload: Dict, priority: Priority, timeout: float = 120.0) -> AsyncIterator[str]:
+        """排队等待端点容量后发送流式请求，逐段返回生成的文本"""
+        endpoint = await self._acquire(priority)
+        async for delta in self.pool.stream(payload, timeout=timeout, endpoint=endpoint):
+            yield delta
+
+    async def _acquire(self, priority: Priority) -> Endpoint:
+        waiter = _Waiter(priority, next(self.seq), asyncio.get_running_loop().create_future())
+        self.waiters.append(waiter)
+        self._dispatch()
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已分配但调用方被取消：归还预留的容量
+                waiter.future.result().reserved -= 1
+                self._dispatch()
+            elif waiter in self.waiters:
+                self.waiters.remove(waiter)
+            raise
+
+    def _dispatch(self):
+        """把空余容量按优先级分配给等待中的请求"""
+        now = time.monotonic()
+        while self.waiters:
+            endpoint = self.pool.pick(require_capacity=True)
+            if endpoint is None:
+                break
+            waiter = min(self.waiters, key=lambda w: w.rank(now))
+            self.waiters.remove(waiter)
+            if waiter.future.done():
+                continue
+            endpoint.bucket.take()
+            endpoint.reserved += 1
+            waiter.future.set_result(endpoint)
+
+            wait = now - waiter.enqueued
+            stats = self.stats[waiter.priority.name.lower()]
+            stats["granted"] += 1
+            stats["wait_total"] += wait
+            stats["wait_max"] = max(stats["wait_max"], wait)
+
+        if self.waiters and self.timer is None:
+            # 只缺令牌时在下一个令牌补充后再分配
+            waits = [e.bucket.wait_time() for e in self.pool.endpoints
+                     if e.outstanding + e.reserved < e.max_concurrency]
+            delay = min(waits) if waits else 0.0
+            if delay > 0:
+                self.timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self.timer = None
+        self._dispatch()
+
+    def status(self) -> Dict:
+        waiting = {p.name.lower(): 0 for p in Priority}
+        for waiter in self.waiters:
+            waiting[waiter.priority.name.lower()] += 1
+        return {
+            "waiting": waiting,
+            "classes": {
+                name: {
+                    "granted": s["granted"],
+                    "avg_wait_seconds": round(s["wait_total"] / s["granted"], 3) if s["granted"] else None,
+                    "max_wait_seconds": round(s["wait_max"], 3)
+                }
+                for name, s in self.stats.items()
+            }
+        }
+
+
+ai_scheduler = AIScheduler(vlm_pool)
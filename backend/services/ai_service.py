@@ -1,115 +1,145 @@
-import httpx
 import asyncio
-from typing import Optional, Dict
+import json
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional, Dict, Tuple
 from backend.config import settings
+from backend.services.ai_scheduler import ai_scheduler, Priority
+from backend.services.activity_digest import build_digest, format_digest
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 截图分析提示词（修改后递增 ANALYSIS_PROMPT_VERSION，历史截图可通过重新分析任务更新）
+ANALYSIS_PROMPT = """请分析这张桌面截图，提供以下信息：
+1. 活动类型,取值包括工作、学习、娱乐、阅读、其他，每条记录只取其一。
+2. 正在使用的主要应用程序或网站
+3. 当前活动的简短描述（1-2句话）
+4. 内容摘要（重点内容、关键词）
+
+请以JSON格式返回，格式如下：
+{
+    "activity_type": "工作",
+    "application": "应用名称",
+    "description": "活动描述",
+    "content_summary": "内容摘要"
+}"""
+ANALYSIS_PROMPT_VERSION = "1"
+
+
+def parse_analysis(content: str) -> Optional[Dict]:
+    """从模型回复中提取 JSON 分析结果（无法解析时返回 None）"""
+    # 提取 JSON 部分
+    if "```json" in content:
+        json_str = content.split("```json")[1].split("```")[0].strip()
+    elif "{" in content and "}" in content:
+        start = content.index("{")
+        end = content.rindex("}") + 1
+        json_str = content[start:end]
+    else:
+        json_str = content
+    try:
+        parsed = json.loads(json_str)
+    except json.JSONDecodeError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
 
 class AIService:
     """AI 解析服务"""
     
     def __init__(self):
-        self.api_url = settings.ai_api_url
         self.model_name = settings.ai_model_name
         self.max_tokens = settings.ai_max_tokens
         self.image_server = settings.ai_image_server
     
-    async def analyze_screenshot(self, image_url: str) -> Optional[Dict]:
+    @property
+    def analysis_version(self) -> Tuple[str, str]:
+        """
+        当前截图分析结果的版本：(模型名称, 提示词版本)
+
+        ANALYSIS_METADATA_HINT 也会改变发给模型的提示词，关闭时版本带 +nohint 后缀
+        （默认开启，已有的结果都是带参考信息生成的，版本号保持不变），切换后重新分析任务能识别旧结果。
+        """
+        prompt_version = ANALYSIS_PROMPT_VERSION if settings.analysis_metadata_hint else f"{ANALYSIS_PROMPT_VERSION}+nohint"
+        return self.model_name, prompt_version
+    
+    async def analyze_screenshot(self, image_url: str, hint: Optional[str] = None,
+                                 priority: Priority = Priority.FRESH) -> Optional[Dict]:
         """
         使用 AI 分析截屏内容
         
         Args:
             image_url: 图片的 URL 地址
+            hint: 客户端上报的前台应用和窗口标题（附加到提示词，帮助识别应用）
+            priority: 调度优先级（刚上传的截图 FRESH，积压的截图 BACKLOG，重新分析 REANALYSIS）
             
         Returns:
             解析结果字典
         """
-        prompt = """请分析这张桌面截图，提供以下信息：
-1. 活动类型,取值包括工作、学习、娱乐、阅读、其他，每条记录只取其一。
-2. 正在使用的主要应用程序或网站
-3. 当前活动的简短描述（1-2句话）
-4. 内容摘要（重点内容、关键词）
-
-请以JSON格式返回，格式如下：
-{
-    "activity_type": "工作",
-    "application": "应用名称",
-    "description": "活动描述",
-    "content_summary": "内容摘要"
-}"""
-        
         try:
-            # 增加超时时间到 120 秒（视觉模型处理图片需要更长时间）
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    self.api_url,
-                    json={
-                        "model": self.model_name,
-                        "messages": [
-                            {
-                                "role": "user",
-                                "content": [
-                                    {"type": "text", "text": prompt},
-                                    {
-                                        "type": "image_url",
-                                        "image_url": {"url": image_url}
-                                    }
-                                ]
-                            }
-                        ],
-                        "max_tokens": self.max_tokens
+            # 超时 120 秒（视觉模型处理图片需要更长时间）；按优先级排队，多个端点时按负载分发，慢请求可对冲到另一个端点
+            response = await ai_scheduler.post(
+                self.build_analysis_payload(image_url, hint),
+                priority,
+                timeout=120.0,
+                hedge=True
+            )
+            
+            if response.status_code == 200:
+                result = response.json()
+                content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+                
+                parsed = parse_analysis(content)
+                if parsed is None:
+                    # 如果无法解析，使用默认结构
+                    logger.warning(f"Failed to parse AI response as JSON: {content}")
+                    return {
+                        "activity_type": "其他",
+                        "application": "未知",
+                        "description": content[:200],
+                        "content_summary": content[:500]
                     }
-                )
+                return parsed
+            else:
+                logger.error(f"AI API error: {response.status_code} - {response.text}")
+                return None
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-                    
-                    # 尝试解析 JSON 响应
-                    import json
-                    try:
-                        # 提取 JSON 部分
-                        if "```json" in content:
-                            json_str = content.split("```json")[1].split("```")[0].strip()
-                        elif "{" in content and "}" in content:
-                            start = content.index("{")
-                            end = content.rindex("}") + 1
-                            json_str = content[start:end]
-                        else:
-                            json_str = content
-                        
-                        parsed = json.loads(json_str)
-                        return parsed
-                    except json.JSONDecodeError:
-                        # 如果无法解析，使用默认结构
-                        logger.warning(f"Failed to parse AI response as JSON: {content}")
-                        return {
-                            "activity_type": "其他",
-                            "application": "未知",
-                            "description": content[:200],
-                            "content_summary": content[:500]
-                        }
-                else:
-                    logger.error(f"AI API error: {response.status_code} - {response.text}")
-                    return None
-                    
         except Exception as e:
             logger.error(f"Error calling AI API: {str(e)}", exc_info=True)
             return None
     
+    def build_analysis_payload(self, image_url: str, hint: Optional[str] = None,
+                               prompt: str = ANALYSIS_PROMPT) -> Dict:
+        """截图分析的请求体（评估工具用同一结构比较不同的提示词）"""
+        if hint:
+            prompt += f"\n\n参考信息（来自客户端，可能不准确，以截图内容为准）：{hint}"
+        return {
+            "model": self.model_name,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": image_url}
+                        }
+                    ]
+                }
+            ],
+            "max_tokens": self.max_tokens
+        }
+    
     async def generate_hourly_report(self, activities: list) -> str:
         """生成小时报告"""
         if not activities:
             return "本小时无活动记录"
         
-        activities_text = "\n".join([
-            f"- {a.timestamp.strftime('%H:%M')}: {a.description}"
-            for a in activities[:10]  # 最多取10条
-        ])
+        # 相近的活动按向量聚类合并，覆盖整个小时而提示词长度有上限
+        digest = await asyncio.to_thread(build_digest, activities, settings.report_hourly_items)
+        activities_text = format_digest(digest)
         
-        prompt = f"""基于以下活动记录，生成一份简洁的小时工作总结：
+        prompt = f"""基于以下活动记录（相近的活动已合并，括号内为时长和记录条数），生成一份简洁的小时工作总结：
 
 {activities_text}
 
@@ -121,22 +151,21 @@ class AIService:
 限制在200字以内。"""
         
         try:
-            # 增加超时时间到 120 秒（视觉模型处理图片需要更长时间）
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    self.api_url,
-                    json={
-                        "model": self.model_name,
-                        "messages": [
-                            {"role": "user", "content": prompt}
-                        ],
-                        "max_tokens": 300
-                    }
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return result.get("choices", [{}])[0].get("message", {}).get("content", "生成失败")
+            response = await ai_scheduler.post(
+                {
+                    "model": self.model_name,
+                    "messages": [
+                        {"role": "user", "content": prompt}
+                    ],
+                    "max_tokens": 300
+                },
+                Priority.REPORT,
+                timeout=120.0
+            )
+            
+            if response.status_code == 200:
+                result = response.json()
+                return result.get("choices", [{}])[0].get("message", {}).get("content", "生成失败")
                     
         except Exception as e:
             logger.error(f"Error generating hourly report: {str(e)}")
@@ -159,18 +188,15 @@ class AIService:
         for t, count in sorted(type_counts.items(), key=lambda x: x[1], reverse=True):
             summary += f"- {t}: {count} 次\n"
         
-        # 取一些关键活动
-        key_activities = activities[::max(1, len(activities)//10)][:10]
-        activities_text = "\n".join([
-            f"- {a.timestamp.strftime('%H:%M')}: {a.description}"
-            for a in key_activities
-        ])
+        # 全天的活动按向量聚类合并为代表活动
+        digest = await asyncio.to_thread(build_digest, activities, settings.report_daily_items)
+        activities_text = format_digest(digest)
         
         prompt = f"""基于以下活动统计和关键活动，生成一份日报：
 
 {summary}
 
-关键活动：
+关键活动（相近的活动已合并，括号内为时长和记录条数）：
 {activities_text}
 
 请总结：
@@ -181,27 +207,68 @@ class AIService:
 限制在400字以内。"""
         
         try:
-            # 增加超时时间到 120 秒（视觉模型处理图片需要更长时间）
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    self.api_url,
-                    json={
-                        "model": self.model_name,
-                        "messages": [
-                            {"role": "user", "content": prompt}
-                        ],
-                        "max_tokens": 600
-                    }
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return result.get("choices", [{}])[0].get("message", {}).get("content", summary)
+            response = await ai_scheduler.post(
+                {
+                    "model": self.model_name,
+                    "messages": [
+                        {"role": "user", "content": prompt}
+                    ],
+                    "max_tokens": 600
+                },
+                Priority.REPORT,
+                timeout=120.0
+            )
+            
+            if response.status_code == 200:
+                result = response.json()
+                return result.get("choices", [{}])[0].get("message", {}).get("content", summary)
                     
         except Exception as e:
             logger.error(f"Error generating daily report: {str(e)}")
             
         return summary
 
+    
+    async def stream_report(self, activities: list, start_time: datetime, end_time: datetime) -> AsyncIterator[str]:
+        """按需生成任意时间段的报告，逐段返回模型生成的文本（用户在等待，以最高优先级排队）"""
+        type_counts = {}
+        for a in activities:
+            t = a.activity_type or "其他"
+            type_counts[t] = type_counts.get(t, 0) + 1
+        summary = f"共记录 {len(activities)} 次活动，活动分布：" + "，".join(
+            f"{t} {count} 次" for t, count in sorted(type_counts.items(), key=lambda x: x[1], reverse=True)
+        )
+        
+        max_items = settings.report_hourly_items if end_time - start_time <= timedelta(hours=2) else settings.report_daily_items
+        digest = await asyncio.to_thread(build_digest, activities, max_items)
+        
+        prompt = f"""基于以下活动统计和活动记录（相近的活动已合并，括号内为时长和记录条数），\
+总结 {start_time.strftime('%m-%d %H:%M')} 至 {end_time.strftime('%m-%d %H:%M')} 的活动：
+
+{summary}
+
+活动记录：
+{format_digest(digest)}
+
+请总结：
+1. 主要活动内容
+2. 时间分配情况
+3. 效率评价或建议
+
+限制在300字以内。"""
+        
+        async for delta in ai_scheduler.stream(
+            {
+                "model": self.model_name,
+                "messages": [
+                    {"role": "user", "content": prompt}
+                ],
+                "max_tokens": 500
+            },
+            Priority.INTERACTIVE,
+            timeout=120.0
+        ):
+            yield delta
+
 
 ai_service = AIService()
@@ -0,0 +1,299 @@
+"""
+按天打包的截图归档
+
+存储布局：
+  screenshots/YYYY/MM/DD/<filename>                   当天上传的原图
+  screenshots/YYYY/MM/DD/thumbnails/thumb_<filename>  缩略图
+  screenshots/archives/YYYYMMDD.<n>.pack              已关闭日期的打包文件（原图与缩略图顺序拼接）
+  screenshots/archives/YYYYMMDD.idx                   偏移索引 {"pack": 文件名, "entries": {name: [offset, length]}}
+
+重写打包文件时生成新版本号的 pack，再原子替换索引，读者不会读到新旧混杂的数据。
+
+文件服务通过索引 seek + read 直接读取单个文件，无需解包。
+"""
+import os
+import json
+import re
+import threading
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_PREFIX = "thumbnails/thumb_"
+_DAY_RE = re.compile(r"^(\d{4})(\d{2})(\d{2})_")
+# 缓存的索引数量（天）
+INDEX_CACHE_SIZE = 32
+
+
+def day_of(name: str) -> Optional[str]:
+    """从文件名（或 thumbnails/thumb_ 前缀的缩略图名）解析日期 YYYYMMDD"""
+    base = name[len(THUMBNAIL_PREFIX):] if name.startswith(THUMBNAIL_PREFIX) else name
+    match = _DAY_RE.match(base)
+    return "".join(match.groups()) if match else None
+
+
+def shard_dir(day: str) -> str:
+    """日期分片目录"""
+    return os.path.join(settings.screenshot_path, day[:4], day[4:6], day[6:8])
+
+
+def loose_paths(name: str) -> List[str]:
+    """文件可能所在的散列路径（日期分片目录优先，其次是旧版平铺目录）"""
+    paths = []
+    day = day_of(name)
+    if day:
+        paths.append(os.path.join(shard_dir(day), name))
+    paths.append(os.path.join(settings.screenshot_path, name))
+    return paths
+
+
+class ArchiveService:
+    """按天打包归档服务"""
+
+    def __init__(self):
+        self.archive_dir = os.path.join(settings.screenshot_path, "archives")
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self._index_cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 同一时间只允许一个任务重写打包文件
+        self._write_lock = threading.RLock()
+
+    def index_path(self, day: str) -> str:
+        return os.path.join(self.archive_dir, f"{day}.idx")
+
+    def is_packed(self, day: str) -> bool:
+        return os.path.exists(self.index_path(day))
+
+    def packed_days(self) -> List[str]:
+        return sorted(f[:-4] for f in os.listdir(self.archive_dir) if f.endswith(".idx"))
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+
+    def load_index(self, day: str) -> Dict:
+        """读取索引 {"pack": 文件名, "entries": {...}}（带 LRU 缓存）"""
+        with self._lock:
+            if day in self._index_cache:
+                self._index_cache.move_to_end(day)
+                return self._index_cache[day]
+
+        index = {"pack": None, "entries": {}}
+        if self.is_packed(day):
+            with open(self.index_path(day), "r", encoding="utf-8") as f:
+                index = json.load(f)
+
+        with self._lock:
+            self._index_cache[day] = index
+            while len(self._index_cache) > INDEX_CACHE_SIZE:
+                self._index_cache.popitem(last=False)
+        return index
+
+    def _invalidate(self, day: str):
+        with self._lock:
+            self._index_cache.pop(day, None)
+
+    def entry_size(self, name: str) -> int:
+        day = day_of(name)
+        if not day:
+            return 0
+        entry = self.load_index(day)["entries"].get(name)
+        return entry[1] if entry else 0
+
+    def has(self, name: str) -> bool:
+        day = day_of(name)
+        return bool(day) and name in self.load_index(day)["entries"]
+
+    def read(self, name: str) -> Optional[bytes]:
+        """从打包文件中读取单个文件（seek + read，不解包）"""
+        day = day_of(name)
+        if not day:
+            return None
+        for _ in range(2):
+            index = self.load_index(day)
+            entry = index["entries"].get(name)
+            if not entry:
+                return None
+            offset, length = entry
+            try:
+                with open(os.path.join(self.archive_dir, index["pack"]), "rb") as f:
+                    f.seek(offset)
+                    return f.read(length)
+            except FileNotFoundError:
+                # 打包文件刚被重写，刷新索引后重试
+                self._invalidate(day)
+        return None
+
+    def iter_entries(self, day: str) -> Iterable[Tuple[str, bytes]]:
+        """顺序读取某天打包文件中的全部条目"""
+        index = self.load_index(day)
+        if not index["entries"]:
+            return
+        with open(os.path.join(self.archive_dir, index["pack"]), "rb") as f:
+            for name, (offset, length) in sorted(index["entries"].items(), key=lambda x: x[1][0]):
+                f.seek(offset)
+                yield name, f.read(length)
+
+    def pack_size(self, day: str) -> int:
+        index = self.load_index(day)
+        if not index["pack"]:
+            return 0
+        return os.path.getsize(os.path.join(self.archive_dir, index["pack"]))
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def _write_pack(self, day: str, entries: Iterable[Tuple[str, bytes]]) -> int:
+        """
+        写入新版本的打包文件，再原子替换索引，最后删除旧版本
+
+        Returns:
+            打包文件大小；没有条目时删除该天的归档并返回 0
+        """
+        old_pack = self.load_index(day)["pack"]
+        version = int(old_pack.split(".")[1]) + 1 if old_pack else 1
+        pack_name = f"{day}.{version}.pack"
+        pack_path = os.path.join(self.archive_dir, pack_name)
+
+        entry_index = {}
+        with open(pack_path, "wb") as f:
+            for name, data in entries:
+                entry_index[name] = [f.tell(), len(data)]
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if not entry_index:
+            os.remove(pack_path)
+            self.delete_day(day)
+            return 0
+
+        index_tmp = self.index_path(day) + ".tmp"
+        with open(index_tmp, "w", encoding="utf-8") as f:
+            json.dump({"pack": pack_name, "entries": entry_index}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(index_tmp, self.index_path(day))
+        self._invalidate(day)
+
+        if old_pack and old_pack != pack_name:
+            old_path = os.path.join(self.archive_dir, old_pack)
+            if os.path.exists(old_path):
+                os.remove(old_path)
+        return os.path.getsize(pack_path)
+
+    def _loose_files(self, day: str) -> Dict[str, str]:
+        """某天尚未打包的散列文件 {name: path}"""
+        files = {}
+        directory = shard_dir(day)
+        if os.path.isdir(directory):
+            for entry in os.scandir(directory):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    files[entry.name] = entry.path
+            thumb_dir = os.path.join(directory, "thumbnails")
+            if os.path.isdir(thumb_dir):
+                for entry in os.scandir(thumb_dir):
+                    if entry.is_file() and not entry.name.endswith(".tmp"):
+                        files[f"thumbnails/{entry.name}"] = entry.path
+        return files
+
+    def legacy_days(self) -> Dict[str, Dict[str, str]]:
+        """旧版平铺目录中的文件，按日期分组"""
+        grouped: Dict[str, Dict[str, str]] = {}
+        for base, prefix in ((settings.screenshot_path, ""), (os.path.join(settings.screenshot_path, "thumbnails"), "thumbnails/")):
+            if not os.path.isdir(base):
+                continue
+            for entry in os.scandir(base):
+                if not entry.is_file():
+                    continue
+                name = prefix + entry.name
+                day = day_of(name)
+                if day:
+                    grouped.setdefault(day, {})[name] = entry.path
+        return grouped
+
+    def pack_day(self, day: str, extra_files: Optional[Dict[str, str]] = None) -> Tuple[int, int]:
+        """
+        将某天的散列文件打包（已有打包文件时合并）
+
+        Returns:
+            (打包的文件数, 打包前散列文件总大小)
+        """
+        with self._write_lock:
+            return self._pack_day(day, extra_files)
+
+    def _pack_day(self, day: str, extra_files: Optional[Dict[str, str]]) -> Tuple[int, int]:
+        loose = self._loose_files(day)
+        loose.update(extra_files or {})
+        if not loose:
+            return 0, 0
+
+        loose_bytes = sum(os.path.getsize(p) for p in loose.values())
+
+        def entries():
+            for name, data in self.iter_entries(day):
+                if name not in loose:
+                    yield name, data
+            for name in sorted(loose):
+                with open(loose[name], "rb") as f:
+                    yield name, f.read()
+
+        self._write_pack(day, entries())
+
+        # 索引落盘后再删除散列文件；目录只在为空时删除（打包期间可能有迟到的上传）
+        for path in loose.values():
+            os.remove(path)
+        directory = shard_dir(day)
+        for path in (os.path.join(directory, "thumbnails"), directory,
+                     os.path.dirname(directory), os.path.dirname(os.path.dirname(directory))):
+            try:
+                os.rmdir(path)
+            except OSError:
+                break
+
+        logger.info(f"Packed {len(loose)} files for {day} ({loose_bytes / 1024 / 1024:.1f} MB)")
+        return len(loose), loose_bytes
+
+    def rewrite_day(self, day: str, transform: Callable[[str, bytes], Optional[bytes]]) -> int:
+        """
+        重写某天的打包文件
+
+        Args:
+            transform: (name, data) -> 新数据；返回 None 表示删除该条目
+
+        Returns:
+            节省的字节数
+        """
+        with self._write_lock:
+            if not self.is_packed(day):
+                return 0
+            before = self.pack_size(day)
+
+            def entries():
+                for name, data in self.iter_entries(day):
+                    new_data = transform(name, data)
+                    if new_data is not None:
+                        yield name, new_data
+
+            after = self._write_pack(day, entries())
+            return before - after
+
+    def delete_day(self, day: str) -> int:
+        """删除某天的归档，返回释放的字节数"""
+        with self._write_lock:
+            pack = self.load_index(day)["pack"]
+            freed = self.pack_size(day)
+            self._invalidate(day)
+            if os.path.exists(self.index_path(day)):
+                os.remove(self.index_path(day))
+            if pack and os.path.exists(os.path.join(self.archive_dir, pack)):
+                os.remove(os.path.join(self.archive_dir, pack))
+            return freed
+
+
+archive_service = ArchiveService()
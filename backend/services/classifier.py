@@ -0,0 +1,196 @@
+"""
+基于客户端元数据的活动分类
+
+Agent 上传截图时附带前台应用名称和窗口标题，已知的 (应用, 标题) 直接生成活动记录，不调用视觉模型：
+- 规则：CLASSIFICATION_RULES_PATH 指向的 JSON 数组，按顺序用正则匹配应用名（app）和窗口标题（title），
+  命中的第一条给出活动类型、应用名称和描述模板，例如
+  [{"app": "^(Code|PyCharm)", "title": "\\.py", "activity_type": "工作", "application": "VS Code",
+    "description": "编写代码：{title}"}]
+- 学习缓存：视觉模型对同一 (应用, 归一化标题) 连续 CLASSIFICATION_MIN_SAMPLES 次给出相同的活动类型时，
+  之后的截图直接复用该分类；每 CLASSIFICATION_VERIFY_INTERVAL 次命中仍交给模型复核一次，结果不一致时重新学习
+
+没有窗口标题的截图（全屏模式）不参与学习，应用粒度太粗；未命中时元数据作为提示附加到分析提示词中。
+"""
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from backend.config import settings
+from backend.models import Activity, Screenshot
+
+logger = logging.getLogger(__name__)
+
+# Agent 在全屏模式下上报的占位应用名，不代表真实的前台应用
+GENERIC_APP_NAMES = {"", "desktop", "unknown", "未知"}
+# 归一化后标题的最大长度
+MAX_TITLE_LENGTH = 200
+
+_DIGITS_RE = re.compile(r"\d+")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_app(app_name: Optional[str]) -> str:
+    app = (app_name or "").strip()
+    return "" if app.lower() in GENERIC_APP_NAMES else app
+
+
+def title_pattern(window_title: Optional[str]) -> str:
+    """
+    窗口标题归一化为缓存键：数字替换为 #（未读数、行号、时间等），合并空白，忽略大小写
+
+    例如 "(3) Inbox - Gmail" 与 "(12) Inbox - Gmail" 得到同一个键
+    """
+    title = _DIGITS_RE.sub("#", (window_title or "").strip().lower())
+    return _SPACES_RE.sub(" ", title)[:MAX_TITLE_LENGTH]
+
+
+class ActivityClassifier:
+    """按规则和学习缓存为带元数据的截图分类"""
+
+    def __init__(self):
+        self.rules: List[Dict] = []
+        # (应用, 标题模式) -> {"activity_type", "application", "streak", "hits"}
+        self.cache: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+        self.stats = {"rule": 0, "cache": 0, "vlm": 0}
+        self.load_rules()
+
+    def load_rules(self, path: str = None) -> int:
+        """加载规则文件（不存在或格式错误时不使用规则）"""
+        path = path or settings.classification_rules_path
+        self.rules = []
+        if not path or not os.path.exists(path):
+            return 0
+        try:
+            with open(path, encoding="utf-8") as f:
+                entries = json.load(f)
+            for entry in entries:
+                if not entry.get("activity_type"):
+                    continue
+                self.rules.append({
+                    "app": re.compile(entry.get("app") or "", re.IGNORECASE),
+                    "title": re.compile(entry.get("title") or "", re.IGNORECASE),
+                    "activity_type": entry["activity_type"],
+                    "application": entry.get("application"),
+                    "description": entry.get("description")
+                })
+        except (OSError, ValueError, TypeError, AttributeError, re.error) as e:
+            logger.error(f"Failed to load classification rules from {path}: {e}")
+            self.rules = []
+        logger.info(f"Loaded {len(self.rules)} classification rules")
+        return len(self.rules)
+
+    def _match_rule(self, app: str, title: str) -> Optional[Dict]:
+        for rule in self.rules:
+            if rule["app"].search(app) and rule["title"].search(title):
+                return rule
+        return None
+
+    def classify(self, app_name: Optional[str], window_title: Optional[str]) -> Optional[Tuple[Dict, str]]:
+        """
+        不调用视觉模型的分类
+
+        Returns:
+            (与 AI 分析结果相同结构的字典, 来源 "rule" / "cache")；需要调用视觉模型时返回 None
+        """
+        if not settings.classification_enabled:
+            return None
+        app = normalize_app(app_name)
+        title = (window_title or "").strip()
+        if not app:
+            return None
+
+        rule = self._match_rule(app, title)
+        if rule:
+            application = rule["application"] or app
+            template = rule["description"] or "使用 {application}：{title}"
+            result = self._result(rule["activity_type"], application, title, template)
+            self.stats["rule"] += 1
+            return result, "rule"
+
+        key = (app, title_pattern(title))
+        entry = self.cache.get(key) if title else None
+        if entry is None or entry["streak"] < settings.classification_min_samples:
+            return None
+        entry["hits"] += 1
+        self.cache.move_to_end(key)
+        if settings.classification_verify_interval > 0 and entry["hits"] % settings.classification_verify_interval == 0:
+            # 定期复核：交给视觉模型，结果通过 learn() 更新缓存
+            return None
+        self.stats["cache"] += 1
+        return self._result(entry["activity_type"], entry["application"], title), "cache"
+
+    @staticmethod
+    def _result(activity_type: str, application: str, title: str, template: str = None) -> Dict:
+        if template is None:
+            template = "使用 {application}：{title}" if title else "使用 {application}"
+        try:
+            description = template.format(application=application, title=title)
+        except (KeyError, IndexError, ValueError):
+            description = template
+        return {
+            "activity_type": activity_type,
+            "application": application,
+            "description": description,
+            "content_summary": title
+        }
+
+    def learn(self, app_name: Optional[str], window_title: Optional[str], result: Dict):
+        """记录一次视觉模型的分析结果"""
+        self.stats["vlm"] += 1
+        app = normalize_app(app_name)
+        title = (window_title or "").strip()
+        if not app or not title or not result.get("activity_type"):
+            return
+        key = (app, title_pattern(title))
+        activity_type = result["activity_type"]
+        application = result.get("application") or app
+        entry = self.cache.get(key)
+        if entry and entry["activity_type"] == activity_type:
+            # 模型对应用名称的写法不稳定（"VS Code" / "Visual Studio Code"），只比较活动类型，应用名取最新一次
+            entry["streak"] += 1
+            entry["application"] = application
+        else:
+            if entry and entry["streak"] >= settings.classification_min_samples:
+                logger.info(f"Classification changed for {key}: {entry['activity_type']} -> {activity_type}")
+            self.cache[key] = {"activity_type": activity_type, "application": application, "streak": 1, "hits": 0}
+        self.cache.move_to_end(key)
+        while len(self.cache) > settings.classification_cache_size:
+            self.cache.popitem(last=False)
+
+    def warm_up(self, db: Session) -> int:
+        """用最近的视觉模型分析结果重建学习缓存（服务重启后不必重新学习）"""
+        rows = db.query(
+            Screenshot.app_name, Screenshot.window_title, Activity.activity_type, Activity.application
+        ).join(Activity, Activity.screenshot_id == Screenshot.id).filter(
+            Screenshot.window_title.isnot(None),
+            (Activity.source == "vlm") | (Activity.source.is_(None))
+        ).order_by(Activity.timestamp.desc()).limit(settings.classification_cache_size * 2).all()
+
+        for app_name, window_title, activity_type, application in reversed(rows):
+            self.learn(app_name, window_title, {"activity_type": activity_type, "application": application})
+        self.stats["vlm"] = 0
+        if rows:
+            logger.info(f"Classification cache warmed up from {len(rows)} activities ({len(self.cache)} keys)")
+        return len(rows)
+
+    @staticmethod
+    def hint(app_name: Optional[str], window_title: Optional[str]) -> Optional[str]:
+        """附加到视觉模型提示词的元数据"""
+        if not settings.analysis_metadata_hint:
+            return None
+        app = normalize_app(app_name)
+        title = (window_title or "").strip()[:MAX_TITLE_LENGTH]
+        parts = []
+        if app:
+            parts.append(f"前台应用：{app}")
+        if title:
+            parts.append(f"窗口标题：{title}")
+        return "，".join(parts) or None
+
+
+activity_classifier = ActivityClassifier()
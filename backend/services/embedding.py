@@ -0,0 +1,61 @@
+"""
+文本向量化
+
+向量服务与索引重建共用。不依赖 vector_service 单例，
+因此可以在子进程中单独加载（并行重建时每个 worker 各持有一份模型）。
+"""
+from typing import Callable, List
+
+import numpy as np
+
+from backend.config import settings
+
+
+def load_embedder(backend: str = None) -> Callable[[List[str]], np.ndarray]:
+    """
+    加载与向量后端匹配的 embedding 函数
+
+    Returns:
+        texts -> (n, dim) float32 归一化矩阵
+    """
+    backend = (backend or settings.vector_backend).lower()
+
+    if backend == "chroma":
+        # 与 collection 默认 embedding 保持一致，保证查询和写入在同一向量空间
+        from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+        fn = DefaultEmbeddingFunction()
+
+        def embed(texts: List[str]) -> np.ndarray:
+            vectors = np.asarray(fn(texts), dtype=np.float32)
+            return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return embed
+
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(settings.embedding_model)
+
+    def embed(texts: List[str]) -> np.ndarray:
+        return model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+    return embed
+
+
+def build_activity_text(activity) -> str:
+    """构建高质量的嵌入文本（增强语义信息）"""
+    text_parts = []
+    if activity.activity_type:
+        text_parts.append(f"活动类型：{activity.activity_type}")
+    if activity.application:
+        text_parts.append(f"应用程序：{activity.application}")
+    if activity.description:
+        text_parts.append(f"描述：{activity.description}")
+    if activity.content_summary:
+        text_parts.append(f"内容：{activity.content_summary}")
+    return " ".join(text_parts)
+
+
+def build_activity_metadata(activity) -> dict:
+    """向量库中保存的活动元数据"""
+    return {
+        "activity_id": activity.screenshot_id,
+        "timestamp": activity.timestamp.isoformat(),
+        "activity_type": activity.activity_type
+    }
@@ -1,33 +1,103 @@
+import math
 import os
 import shutil
+from collections import OrderedDict
 from datetime import datetime
-from PIL import Image
+from PIL import Image, ImageChops, features
 import imagehash
+import numpy as np
+from io import BytesIO
 from typing import Optional, Tuple
 from backend.config import settings
+from backend.services.archive_service import archive_service, day_of, shard_dir, loose_paths
+
+
+# 内存中保留的增量上传画面数量（每个截图流一张）
+CANVAS_CACHE_SIZE = 8
+
+# 支持的存储/上传格式及扩展名（按体积从小到大排列）
+IMAGE_FORMATS = {"AVIF": ".avif", "WEBP": ".webp", "JPEG": ".jpg"}
+_EXTENSION_FORMATS = {ext: fmt for fmt, ext in IMAGE_FORMATS.items()}
+
+
+def supported_formats() -> list:
+    """当前 Pillow 能编码的格式（按体积从小到大）"""
+    return [fmt for fmt in IMAGE_FORMATS if fmt == "JPEG" or features.check(fmt.lower())]
+
+
+def format_of(filename: str) -> str:
+    """按扩展名判断图片格式（未知扩展名按 JPEG 处理）"""
+    return _EXTENSION_FORMATS.get(os.path.splitext(filename)[1].lower(), "JPEG")
+
+
+def patch_aligned_size(width: int, height: int, patch_size: int, max_pixels: int) -> Tuple[int, int]:
+    """
+    宽高均为 patch_size 整数倍、面积不超过 max_pixels 的尺寸（保持宽高比）
+
+    与 Qwen-VL 预处理的 smart_resize 一致：每个 patch_size × patch_size 的块对应一个视觉 token，
+    尺寸已对齐时模型端不会再重采样一次（两次缩放会让小字更模糊）
+    """
+    w = max(patch_size, round(width / patch_size) * patch_size)
+    h = max(patch_size, round(height / patch_size) * patch_size)
+    if max_pixels > 0 and w * h > max_pixels:
+        beta = math.sqrt(width * height / max_pixels)
+        w = max(patch_size, math.floor(width / beta / patch_size) * patch_size)
+        h = max(patch_size, math.floor(height / beta / patch_size) * patch_size)
+    return w, h
+
+
+def content_box(img: Image.Image, tolerance: int = 12) -> Optional[Tuple[int, int, int, int]]:
+    """与左上角背景色明显不同的像素的外接矩形（纯色桌面、黑边等空白区域之外的内容）"""
+    background = Image.new('RGB', img.size, img.getpixel((0, 0)))
+    mask = ImageChops.difference(img, background).convert('L').point(lambda v: 255 if v > tolerance else 0)
+    return mask.getbbox()
+
+
+def encode_image(img: Image.Image, fmt: str, quality: int) -> bytes:
+    """按格式编码图片"""
+    buffer = BytesIO()
+    if fmt == "WEBP":
+        img.save(buffer, format="WEBP", quality=quality, method=4)
+    elif fmt == "AVIF":
+        img.save(buffer, format="AVIF", quality=quality, speed=8)
+    else:
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
 
 
 class ImageService:
     """图片处理服务"""
     
     def __init__(self):
+        # 存储格式：配置的格式当前 Pillow 不支持时回退到 JPEG
+        fmt = settings.storage_format.upper()
+        fmt = "JPEG" if fmt == "JPG" else fmt
+        self.storage_format = fmt if fmt in supported_formats() else "JPEG"
         os.makedirs(settings.screenshot_path, exist_ok=True)
         os.makedirs(os.path.join(settings.screenshot_path, "thumbnails"), exist_ok=True)
+        # 最近一次使用的参考帧 (filename, Image)
+        self._reference_cache = (None, None)
+        # 增量上传最近拼好的画面 filename -> Image（未变化的块从这里逐像素复制，不经过有损存储）
+        self._canvases: OrderedDict = OrderedDict()
     
     def save_screenshot(self, file_content: bytes, original_filename: str) -> Tuple[str, str, dict]:
         """
-        保存截屏并生成缩略图
+        保存截屏并生成缩略图（按日期分片目录存放）
         
         Returns:
             (filename, filepath, metadata)
         """
-        # 生成唯一文件名（统一使用 JPEG 格式，兼容 AI 服务）
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        filename = f"{timestamp}.jpg"
-        filepath = os.path.join(settings.screenshot_path, filename)
-        
+        img = self.prepare_screenshot(file_content)
+        return self.write_screenshot(img, self.compute_phash(img), source=file_content)
+    
+    def accepted_formats(self) -> list:
+        """客户端可以上传的格式（配置允许且服务端 Pillow 能解码，按体积从小到大）"""
+        allowed = {f.strip().upper() for f in settings.upload_formats.split(",") if f.strip()}
+        return [fmt for fmt in supported_formats() if fmt in allowed or fmt == "JPEG"]
+    
+    def prepare_screenshot(self, file_content: bytes) -> Image.Image:
+        """解码上传的图片，转换为 RGB 并按配置缩放（不写盘）"""
         # 打开图片（可能是 WebP 或 JPEG）
-        from io import BytesIO
         img = Image.open(BytesIO(file_content))
         
         # 转换 RGBA 到 RGB
@@ -40,56 +110,374 @@ class ImageService:
         elif img.mode != 'RGB':
             img = img.convert('RGB')
         
-        width, height = img.size
-        
         # 调整大小
-        if width > settings.screenshot_max_width or height > settings.screenshot_max_height:
+        if img.width > settings.screenshot_max_width or img.height > settings.screenshot_max_height:
             img.thumbnail((settings.screenshot_max_width, settings.screenshot_max_height), Image.Resampling.LANCZOS)
-            width, height = img.size
         
-        # 保存为 JPEG（兼容 AI 服务）
-        img.save(filepath, format='JPEG', quality=settings.screenshot_quality, optimize=True)
+        return img
+    
+    def prepare_tiles(self, file_content: bytes) -> Image.Image:
+        """解码增量上传的变化块拼接图（不缩放）"""
+        try:
+            img = Image.open(BytesIO(file_content))
+            img.load()
+        except Exception as e:
+            raise ValueError(f"Invalid tile image: {e}")
+        return img.convert('RGB') if img.mode != 'RGB' else img
+    
+    def compute_phash(self, img: Image.Image) -> str:
+        """计算感知哈希"""
+        return str(imagehash.phash(img))
+    
+    def _new_filename(self, captured_at: Optional[datetime] = None, ext: str = ".jpg",
+                      monitor_id: Optional[int] = None) -> Tuple[str, str]:
+        """
+        生成唯一文件名及其日期分片目录；补传的截图按截图时间命名，扩展名与存储格式一致
+        
+        多显示器同一时刻的截图截图时间相同，文件名附带显示器编号（_m<编号>）区分
+        """
+        timestamp = (captured_at or datetime.now()).strftime("%Y%m%d_%H%M%S_%f")
+        suffix = f"_m{monitor_id}" if monitor_id is not None else ""
+        filename = f"{timestamp}{suffix}{ext}"
+        directory = shard_dir(day_of(filename))
+        os.makedirs(os.path.join(directory, "thumbnails"), exist_ok=True)
+        return filename, directory
+    
+    def write_screenshot(self, img: Image.Image, phash: str, captured_at: Optional[datetime] = None,
+                         source: Optional[bytes] = None, monitor_id: Optional[int] = None) -> Tuple[str, str, dict]:
+        """
+        写入完整截图和缩略图
+        
+        客户端上传的已是紧凑格式（WebP/AVIF）且未被缩放时原样保存，避免二次有损编码；
+        否则按存储格式编码。AI 分析需要 JPEG 时由文件服务按需转码（见 ai_image_path）。
+        """
+        data = None
+        fmt = self.storage_format
+        if source is not None:
+            with Image.open(BytesIO(source)) as original:
+                if original.format in ("WEBP", "AVIF") and original.format in self.accepted_formats() \
+                        and original.size == img.size:
+                    data, fmt = source, original.format
+        if data is None:
+            data = encode_image(img, fmt, settings.screenshot_quality)
+        
+        filename, directory = self._new_filename(captured_at, IMAGE_FORMATS[fmt], monitor_id)
+        filepath = os.path.join(directory, filename)
+        with open(filepath, "wb") as f:
+            f.write(data)
         
         # 生成缩略图
         thumbnail_path = self.create_thumbnail(img, filename)
         
-        # 计算感知哈希
-        phash = str(imagehash.phash(img))
+        metadata = {
+            "width": img.width,
+            "height": img.height,
+            "file_size": os.path.getsize(filepath),
+            "phash": phash,
+            "thumbnail_path": thumbnail_path,
+            "reference_filename": None,
+            "diff_box": None
+        }
+        
+        return filename, filepath, metadata
+    
+    def write_reference(self, img: Image.Image, phash: str, reference_filename: str, with_diff: bool,
+                        captured_at: Optional[datetime] = None,
+                        monitor_id: Optional[int] = None) -> Optional[Tuple[str, str, dict]]:
+        """
+        相似帧只记录参考帧指针（可选附带变化区域的小补丁），不写完整图片和缩略图
+        
+        Returns:
+            (filename, filepath, metadata)；变化区域过大无法用补丁表示时返回 None
+        """
+        diff_box = None
+        patch = None
+        if with_diff:
+            reference = self._load_reference(reference_filename)
+            if reference is None or reference.size != img.size:
+                return None
+            # 参考帧是有损编码过的图片，新帧按同样的格式和参数编码后再比较，
+            # 未变化的区域编码结果一致，差异只来自真实变化
+            encoded = encode_image(img, format_of(reference_filename), settings.screenshot_quality)
+            diff_box = self.changed_box(reference, Image.open(BytesIO(encoded)).convert('RGB'))
+            if diff_box:
+                x0, y0, x1, y1 = diff_box
+                if (x1 - x0) * (y1 - y0) > settings.similar_diff_max_area * img.width * img.height:
+                    return None
+                patch = img.crop(diff_box)
         
-        # 获取文件大小
-        file_size = os.path.getsize(filepath)
+        filename, directory = self._new_filename(captured_at, os.path.splitext(reference_filename)[1], monitor_id)
+        filepath = os.path.join(directory, filename)
+        file_size = 0
+        if patch is not None:
+            patch_path = os.path.join(directory, self.diff_name(filename))
+            patch.save(patch_path, format='JPEG', quality=settings.screenshot_quality, optimize=True)
+            file_size = os.path.getsize(patch_path)
         
         metadata = {
-            "width": width,
-            "height": height,
+            "width": img.width,
+            "height": img.height,
             "file_size": file_size,
-            "phash": phash
+            "phash": phash,
+            "thumbnail_path": None,
+            "reference_filename": reference_filename,
+            "diff_box": ",".join(map(str, diff_box)) if patch is not None else None
         }
         
         return filename, filepath, metadata
     
+    def write_pointer(self, phash: str, reference_filename: str, width: int, height: int,
+                      monitor_id: Optional[int] = None) -> Tuple[str, str, dict]:
+        """客户端心跳（屏幕未变化、未上传图片）：只生成文件名并记录参考帧指针"""
+        filename, directory = self._new_filename(ext=os.path.splitext(reference_filename)[1], monitor_id=monitor_id)
+        metadata = {
+            "width": width,
+            "height": height,
+            "file_size": 0,
+            "phash": phash,
+            "thumbnail_path": None,
+            "reference_filename": reference_filename,
+            "diff_box": None
+        }
+        return filename, os.path.join(directory, filename), metadata
+    
+    def _load_reference(self, reference_filename: str) -> Optional[Image.Image]:
+        """读取并缓存参考帧（连续相似帧共用同一参考帧，避免重复解码）"""
+        cached_name, cached_img = self._reference_cache
+        if cached_name == reference_filename:
+            return cached_img
+        data = self.read_bytes(reference_filename)
+        if data is None:
+            return None
+        img = Image.open(BytesIO(data)).convert('RGB')
+        self._reference_cache = (reference_filename, img)
+        return img
+    
+    def changed_box(self, reference: Image.Image, img: Image.Image, tile: int = 16, threshold: float = 2.0) -> Optional[Tuple[int, int, int, int]]:
+        """
+        变化区域的外接矩形
+        
+        按 tile×tile 分块（与 JPEG 宏块对齐）比较平均差异，忽略零星的压缩噪声
+        """
+        diff = np.asarray(ImageChops.difference(reference, img).convert('L'), dtype=np.float32)
+        h, w = diff.shape
+        rows, cols = -(-h // tile), -(-w // tile)
+        padded = np.zeros((rows * tile, cols * tile), dtype=np.float32)
+        padded[:h, :w] = diff
+        changed = padded.reshape(rows, tile, cols, tile).mean(axis=(1, 3)) > threshold
+        if not changed.any():
+            return None
+        ys, xs = np.nonzero(changed)
+        return (
+            int(xs.min()) * tile,
+            int(ys.min()) * tile,
+            min(w, (int(xs.max()) + 1) * tile),
+            min(h, (int(ys.max()) + 1) * tile)
+        )
+    
+    def apply_tiles(self, reference_filename: str, atlas: Image.Image, positions: list,
+                    tile_size: int, size: Tuple[int, int]) -> Optional[Tuple[Image.Image, Tuple[int, int, int, int]]]:
+        """
+        在上一帧的画面上贴回增量上传的变化块
+        
+        上一帧优先取内存中保留的画面，不在内存中（如服务重启后）时解码完整存储的文件。
+        变化块按行优先排列在拼接图中：每行 ceil(sqrt(n)) 块，每格 tile_size × tile_size，
+        帧右侧/底部不足一块的部分按实际尺寸放在格子左上角（与 agent/tiles.py 一致）。
+        
+        Returns:
+            (完整画面, 变化区域外接矩形)；上一帧不存在或尺寸不符时返回 None
+        
+        Raises:
+            ValueError: 块位置或拼接图尺寸不合法
+        """
+        reference = self._canvases.get(reference_filename)
+        if reference is None:
+            data = self.read_bytes(reference_filename)
+            reference = Image.open(BytesIO(data)).convert('RGB') if data is not None else None
+        if reference is None or reference.size != tuple(size):
+            return None
+        width, height = reference.size
+        cols = math.ceil(math.sqrt(len(positions)))
+        rows = math.ceil(len(positions) / cols)
+        if atlas.width < cols * tile_size or atlas.height < rows * tile_size:
+            raise ValueError("Tile atlas is smaller than its layout")
+        
+        img = reference.copy()
+        x0, y0, x1, y1 = width, height, 0, 0
+        for i, (x, y) in enumerate(positions):
+            if x % tile_size or y % tile_size or not (0 <= x < width and 0 <= y < height):
+                raise ValueError(f"Invalid tile position: {x},{y}")
+            w, h = min(tile_size, width - x), min(tile_size, height - y)
+            ax, ay = (i % cols) * tile_size, (i // cols) * tile_size
+            img.paste(atlas.crop((ax, ay, ax + w, ay + h)), (x, y))
+            x0, y0, x1, y1 = min(x0, x), min(y0, y), max(x1, x + w), max(y1, y + h)
+        return img, (x0, y0, x1, y1)
+    
+    def remember_canvas(self, filename: str, img: Image.Image):
+        """保留增量上传的最新画面，下一个增量帧在它上面拼接"""
+        self._canvases[filename] = img
+        self._canvases.move_to_end(filename)
+        while len(self._canvases) > CANVAS_CACHE_SIZE:
+            self._canvases.popitem(last=False)
+    
+    def crop_region(self, data: bytes, region: str, fmt: str) -> bytes:
+        """裁剪出 "x0,y0,x1,y1" 区域（AI 只分析增量帧中变化的部分）"""
+        img = Image.open(BytesIO(data)).convert('RGB')
+        return encode_image(img.crop(tuple(map(int, region.split(",")))), fmt, settings.screenshot_quality)
+    
+    def analysis_variant(self, img: Image.Image) -> Image.Image:
+        """
+        AI 分析用的图片：可选裁掉空白边缘，再缩放到像素预算内且按 patch 对齐的尺寸
+
+        视觉 token 数与像素面积成正比，缩放后模型预填充更快；裁剪让预算集中在有内容的区域
+        """
+        if settings.analysis_crop_content:
+            box = content_box(img)
+            if box:
+                x0, y0, x1, y1 = box
+                # 空白不足一成时保留整帧（裁剪会丢掉窗口位置等上下文）
+                if (x1 - x0) * (y1 - y0) < 0.9 * img.width * img.height:
+                    img = img.crop(box)
+        size = patch_aligned_size(img.width, img.height, settings.analysis_patch_size, settings.analysis_max_pixels)
+        return img if size == img.size else img.resize(size, Image.Resampling.LANCZOS)
+
+    def analysis_name(self, filename: str) -> str:
+        """AI 分析图片的文件名（与截图同目录，分析完成后删除）"""
+        return f"{os.path.splitext(filename)[0]}.ai.jpg"
+
+    def write_analysis_variant(self, img: Image.Image, filename: str) -> str:
+        """上传时生成 AI 分析图片（JPEG，兼容只支持 JPEG/PNG 的 AI 服务）"""
+        path = os.path.join(shard_dir(day_of(filename)), self.analysis_name(filename))
+        with open(path, "wb") as f:
+            f.write(encode_image(self.analysis_variant(img), "JPEG", settings.screenshot_quality))
+        return path
+
+    def discard_analysis_variant(self, filename: str):
+        """分析完成后删除 AI 分析图片（之后需要时由文件服务按需生成）"""
+        path = self.resolve_path(self.analysis_name(filename))
+        if path:
+            os.remove(path)
+
+    def to_analysis(self, data: bytes) -> bytes:
+        """按需生成 AI 分析图片（上传时未生成或已删除）"""
+        img = Image.open(BytesIO(data)).convert('RGB')
+        return encode_image(self.analysis_variant(img), "JPEG", settings.screenshot_quality)
+
+    def diff_name(self, filename: str) -> str:
+        """相似帧补丁文件名（保留日期前缀以便分片和打包）"""
+        return f"{os.path.splitext(filename)[0]}.diff.jpg"
+    
+    def compose_diff(self, reference_filename: str, filename: str, diff_box: str) -> Optional[bytes]:
+        """参考帧 + 补丁还原相似帧"""
+        reference = self.read_bytes(reference_filename)
+        patch = self.read_bytes(self.diff_name(filename))
+        if reference is None or patch is None:
+            return reference
+        img = Image.open(BytesIO(reference)).convert('RGB')
+        x0, y0, _, _ = map(int, diff_box.split(","))
+        img.paste(Image.open(BytesIO(patch)), (x0, y0))
+        return encode_image(img, format_of(filename), settings.screenshot_quality)
+    
     def create_thumbnail(self, img: Image.Image, filename: str) -> str:
-        """创建缩略图（使用 JPEG 格式保持兼容性）"""
+        """创建缩略图（格式与原图扩展名一致，文件服务按扩展名返回类型）"""
         thumbnail = img.copy()
         thumbnail.thumbnail((300, 200), Image.Resampling.LANCZOS)
         
-        # 缩略图使用 JPEG（兼容性更好）
         thumbnail_filename = f"thumb_{filename}"
-        thumbnail_path = os.path.join(settings.screenshot_path, "thumbnails", thumbnail_filename)
-        thumbnail.save(thumbnail_path, format='JPEG', quality=70, optimize=True)
+        thumbnail_path = os.path.join(shard_dir(day_of(filename)), "thumbnails", thumbnail_filename)
+        with open(thumbnail_path, "wb") as f:
+            f.write(encode_image(thumbnail, format_of(filename), 70))
         
         return thumbnail_path
     
+    def resolve_path(self, name: str) -> Optional[str]:
+        """
+        查找未打包文件的实际路径
+        
+        Args:
+            name: 文件名，缩略图使用 thumbnails/thumb_<filename>
+        """
+        for path in loose_paths(name):
+            if os.path.isfile(path):
+                return path
+        return None
+    
+    def read_bytes(self, name: str) -> Optional[bytes]:
+        """读取文件内容（散列文件或按天打包的归档）"""
+        path = self.resolve_path(name)
+        if path:
+            with open(path, "rb") as f:
+                return f.read()
+        return archive_service.read(name)
+    
+    def exists(self, name: str) -> bool:
+        return self.resolve_path(name) is not None or archive_service.has(name)
+    
+    def stored_size(self, name: str) -> int:
+        """文件占用的字节数（散列或归档）"""
+        path = self.resolve_path(name)
+        if path:
+            return os.path.getsize(path)
+        return archive_service.entry_size(name)
+    
+    def ai_image_path(self, filename: str, region: Optional[str] = None) -> str:
+        """
+        AI 服务读取截图的相对路径
+        
+        启用分析图片时读取按像素预算缩放的 JPEG（variant=analysis），否则读取原图（非 JPEG 按需转码）
+        
+        Args:
+            region: "changed" 时只返回增量帧中变化的区域
+        """
+        if settings.analysis_variant_enabled:
+            params = ["variant=analysis"]
+        else:
+            params = [] if format_of(filename) == "JPEG" else ["format=jpeg"]
+        if region:
+            params.append(f"region={region}")
+        return f"{filename}?{'&'.join(params)}" if params else filename
+    
+    def to_jpeg(self, data: bytes) -> bytes:
+        """转码为 JPEG（兼容只支持 JPEG/PNG 的 AI 服务）"""
+        img = Image.open(BytesIO(data))
+        if img.format == "JPEG":
+            return data
+        return encode_image(img.convert('RGB'), "JPEG", settings.screenshot_quality)
+    
     def calculate_similarity(self, hash1: str, hash2: str) -> int:
         """计算两个感知哈希的差异度"""
         h1 = imagehash.hex_to_hash(hash1)
         h2 = imagehash.hex_to_hash(hash2)
-        return h1 - h2
+        return int(h1 - h2)
+    
+    def compress_image(self, filepath: str, quality: int = 60) -> int:
+        """
+        压缩图片（用于长期存储）
+        
+        先写临时文件再原子替换，避免文件服务读到写了一半的图片
+        
+        Returns:
+            压缩后的文件大小
+        """
+        with open(filepath, "rb") as f:
+            data = f.read()
+        compressed = self.compress_bytes(data, quality)
+        
+        # 重新编码反而变大时保留原图
+        if len(compressed) < len(data):
+            tmp_path = f"{filepath}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(compressed)
+            os.replace(tmp_path, filepath)
+        return os.path.getsize(filepath)
     
-    def compress_image(self, filepath: str, quality: int = 60) -> None:
-        """压缩图片（用于长期存储）"""
-        img = Image.open(filepath)
-        img.save(filepath, quality=quality, optimize=True)
+    def compress_bytes(self, data: bytes, quality: int = 60) -> bytes:
+        """重新压缩图片数据（变大时返回原数据）"""
+        img = Image.open(BytesIO(data))
+        buffer = BytesIO()
+        img.save(buffer, format=img.format or 'JPEG', quality=quality, optimize=True)
+        compressed = buffer.getvalue()
+        return compressed if len(compressed) < len(data) else data
     
     def delete_image(self, filepath: str, thumbnail_path: Optional[str] = None) -> None:
         """删除图片文件"""
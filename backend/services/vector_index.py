@@ -0,0 +1,345 @@
+"""
+进程内 NumPy 向量索引
+
+单用户部署下替代 ChromaDB 的轻量后端：
+- 向量以 float16 或 int8（逐行量化）存放在内存映射文件中，按需分页加载
+- 精确 top-k 检索（向量化点积 + argpartition），无 HNSW 构建开销
+- 支持按时间范围预过滤
+- 删除采用墓碑标记，启动时仅读取一个很小的 header 文件
+"""
+import os
+import json
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# 每次扫描的行数（控制 float32 临时矩阵的内存峰值）
+SEARCH_CHUNK_ROWS = 65536
+# 初始容量（行），之后按倍数扩容
+INITIAL_CAPACITY = 1024
+# ID 最大长度（字节）
+ID_BYTES = 64
+
+
+def to_epoch(dt: Optional[datetime]) -> int:
+    """将 naive 北京时间转换为整数秒（仅用于比较，不做时区换算）"""
+    if dt is None:
+        return 0
+    if isinstance(dt, str):
+        dt = datetime.fromisoformat(dt)
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None)
+    return int(dt.replace(tzinfo=timezone.utc).timestamp())
+
+
+class NumpyVectorIndex:
+    """基于内存映射矩阵的精确向量索引"""
+
+    def __init__(self, path: str, dim: Optional[int] = None, dtype: str = "float16"):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+
+        self.path = path
+        self.dtype = dtype
+        self.dim = dim
+        self.count = 0
+        self.capacity = 0
+        self._lock = threading.Lock()
+
+        self._vectors = None
+        self._scales = None
+        self._ids = None
+        self._timestamps = None
+        self._alive = None
+        self._doc_offsets = None
+
+        os.makedirs(path, exist_ok=True)
+        header = self._read_header()
+        if header:
+            self.dim = header["dim"]
+            self.dtype = header["dtype"]
+            self.count = header["count"]
+            self._open_arrays("r+")
+
+    # ------------------------------------------------------------------
+    # 文件布局
+    # ------------------------------------------------------------------
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read_header(self) -> Optional[Dict]:
+        header_path = self._file("header.json")
+        if not os.path.exists(header_path):
+            return None
+        with open(header_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_header(self):
+        """原子写入 header（先写临时文件再替换），count 只在数据落盘后更新"""
+        header_path = self._file("header.json")
+        tmp_path = header_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype, "count": self.count}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, header_path)
+
+    def _array_specs(self) -> Dict[str, tuple]:
+        specs = {
+            "vectors.npy": (np.int8 if self.dtype == "int8" else np.float16, (self.dim,)),
+            "ids.npy": (f"S{ID_BYTES}", ()),
+            "timestamps.npy": (np.int64, ()),
+            "alive.npy": (np.bool_, ()),
+            "doc_offsets.npy": (np.int64, ()),
+        }
+        if self.dtype == "int8":
+            specs["scales.npy"] = (np.float32, ())
+        return specs
+
+    def _open_arrays(self, mode: str, capacity: Optional[int] = None):
+        """打开（或创建）所有内存映射数组"""
+        arrays = {}
+        for name, (dtype, tail) in self._array_specs().items():
+            if mode == "w+":
+                arrays[name] = np.lib.format.open_memmap(
+                    self._file(name), mode="w+", dtype=dtype, shape=(capacity,) + tail
+                )
+            else:
+                arrays[name] = np.load(self._file(name), mmap_mode=mode)
+
+        self._vectors = arrays["vectors.npy"]
+        self._ids = arrays["ids.npy"]
+        self._timestamps = arrays["timestamps.npy"]
+        self._alive = arrays["alive.npy"]
+        self._doc_offsets = arrays["doc_offsets.npy"]
+        self._scales = arrays.get("scales.npy")
+        self.capacity = self._vectors.shape[0]
+
+    def _grow(self, needed: int):
+        """容量不足时按倍数扩容（复制到新文件后原子替换）"""
+        if self.capacity == 0:
+            self._open_arrays("w+", max(INITIAL_CAPACITY, needed))
+            return
+        if needed <= self.capacity:
+            return
+
+        new_capacity = self.capacity
+        while new_capacity < needed:
+            new_capacity *= 2
+
+        for name, (dtype, tail) in self._array_specs().items():
+            old = np.load(self._file(name), mmap_mode="r")
+            tmp_path = self._file(name + ".tmp")
+            new = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(new_capacity,) + tail)
+            new[:self.count] = old[:self.count]
+            new.flush()
+            del new, old
+            os.replace(tmp_path, self._file(name))
+
+        self._open_arrays("r+")
+
+    def _flush(self):
+        for arr in (self._vectors, self._scales, self._ids, self._timestamps, self._alive, self._doc_offsets):
+            if arr is not None:
+                arr.flush()
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def _quantize(self, vectors: np.ndarray):
+        """归一化并转换为存储类型，int8 模式返回逐行缩放因子"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales = np.maximum(scales, 1e-12).astype(np.float32)
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales
+        return vectors.astype(np.float16), None
+
+    def _find_rows(self, ids: Sequence[str]) -> Dict[str, int]:
+        """查找 ID 对应的存活行号（向量化比较）"""
+        if self.count == 0 or not ids:
+            return {}
+        encoded = np.array([i.encode("utf-8") for i in ids], dtype=f"S{ID_BYTES}")
+        stored = self._ids[:self.count]
+        rows = np.nonzero(np.isin(stored, encoded) & self._alive[:self.count])[0]
+        return {stored[r].decode("utf-8"): int(r) for r in rows}
+
+    def _append_documents(self, documents: Sequence[str], metadatas: Sequence[Dict]) -> List[int]:
+        offsets = []
+        with open(self._file("documents.jsonl"), "ab") as f:
+            for doc, meta in zip(documents, metadatas):
+                offsets.append(f.tell())
+                line = json.dumps({"document": doc, "metadata": meta}, ensure_ascii=False)
+                f.write(line.encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return offsets
+
+    def upsert(
+        self,
+        ids: Sequence[str],
+        vectors: np.ndarray,
+        timestamps: Sequence[Optional[datetime]],
+        documents: Optional[Sequence[str]] = None,
+        metadatas: Optional[Sequence[Dict]] = None,
+    ) -> int:
+        """
+        批量写入向量（已存在的 ID 会先标记删除再追加）
+
+        Returns:
+            写入的行数
+        """
+        if len(ids) == 0:
+            return 0
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[0] != len(ids):
+            raise ValueError("vectors must be a 2D array with one row per id")
+
+        documents = documents or [""] * len(ids)
+        metadatas = metadatas or [{}] * len(ids)
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Vector dim mismatch: expected {self.dim}, got {vectors.shape[1]}")
+
+            for row in self._find_rows(ids).values():
+                self._alive[row] = False
+
+            start = self.count
+            end = start + len(ids)
+            self._grow(end)
+
+            quantized, scales = self._quantize(vectors)
+            self._vectors[start:end] = quantized
+            if scales is not None:
+                self._scales[start:end] = scales
+            self._ids[start:end] = [i.encode("utf-8") for i in ids]
+            self._timestamps[start:end] = [to_epoch(ts) for ts in timestamps]
+            self._doc_offsets[start:end] = self._append_documents(documents, metadatas)
+            self._alive[start:end] = True
+            self._flush()
+
+            # 数据落盘后再提交 count，崩溃时最多丢失未提交的尾部行
+            self.count = end
+            self._write_header()
+            return len(ids)
+
+    def delete(self, ids: Sequence[str]) -> int:
+        """删除向量（墓碑标记）"""
+        with self._lock:
+            rows = self._find_rows(ids)
+            for row in rows.values():
+                self._alive[row] = False
+            if rows:
+                self._alive.flush()
+            return len(rows)
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        if self.count == 0:
+            return 0
+        return int(np.count_nonzero(self._alive[:self.count]))
+
+    def list_ids(self) -> List[str]:
+        """所有存活的 ID"""
+        if self.count == 0:
+            return []
+        stored = self._ids[:self.count][self._alive[:self.count]]
+        return [i.decode("utf-8") for i in stored]
+
+    def get_vectors(self, ids: Sequence[str]) -> Dict[str, np.ndarray]:
+        """按 ID 取回（反量化后的）归一化向量"""
+        rows = self._find_rows(ids)
+        return {doc_id: self._dequantize(row, row + 1)[0] for doc_id, row in rows.items()}
+
+    def _dequantize(self, start: int, end: int) -> np.ndarray:
+        block = self._vectors[start:end].astype(np.float32)
+        if self.dtype == "int8":
+            block *= self._scales[start:end, None]
+        return block
+
+    def _read_document(self, row: int) -> Dict:
+        with open(self._file("documents.jsonl"), "rb") as f:
+            f.seek(int(self._doc_offsets[row]))
+            return json.loads(f.readline().decode("utf-8"))
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int = 10,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+    ) -> List[Dict]:
+        """
+        精确 top-k 检索
+
+        Args:
+            query: 查询向量
+            k: 返回数量
+            start_time: 时间下界（含）
+            end_time: 时间上界（不含）
+
+        Returns:
+            [{"id", "distance", "metadata", "document"}]，distance 为余弦距离（1 - cos）
+        """
+        if self.count == 0 or k <= 0:
+            return []
+
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        start_epoch = to_epoch(start_time) if start_time else None
+        end_epoch = to_epoch(end_time) if end_time else None
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+
+        for chunk_start in range(0, self.count, SEARCH_CHUNK_ROWS):
+            chunk_end = min(chunk_start + SEARCH_CHUNK_ROWS, self.count)
+            mask = np.asarray(self._alive[chunk_start:chunk_end])
+            if start_epoch is not None or end_epoch is not None:
+                ts = self._timestamps[chunk_start:chunk_end]
+                if start_epoch is not None:
+                    mask = mask & (ts >= start_epoch)
+                if end_epoch is not None:
+                    mask = mask & (ts < end_epoch)
+            rows = np.nonzero(mask)[0]
+            if rows.size == 0:
+                continue
+
+            # 全部命中时直接使用切片，避免花式索引的额外复制
+            selector = slice(None) if rows.size == chunk_end - chunk_start else rows
+            block = self._vectors[chunk_start:chunk_end][selector].astype(np.float32)
+            scores = block @ query
+            if self.dtype == "int8":
+                scores *= self._scales[chunk_start:chunk_end][selector]
+
+            best_rows = np.concatenate([best_rows, rows + chunk_start])
+            best_scores = np.concatenate([best_scores, scores])
+            if best_scores.size > k:
+                top = np.argpartition(-best_scores, k - 1)[:k]
+                best_rows, best_scores = best_rows[top], best_scores[top]
+
+        order = np.argsort(-best_scores)
+        items = []
+        for idx in order:
+            row = int(best_rows[idx])
+            doc = self._read_document(row)
+            items.append({
+                "id": self._ids[row].decode("utf-8"),
+                "distance": float(1.0 - best_scores[idx]),
+                "metadata": doc.get("metadata", {}),
+                "document": doc.get("document", ""),
+            })
+        return items
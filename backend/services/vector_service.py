@@ -2,21 +2,28 @@ import os
 # 必须在导入 chromadb 之前设置
 os.environ['ANONYMIZED_TELEMETRY'] = 'False'
 
-import chromadb
-from chromadb.config import Settings as ChromaSettings
+import shutil
+from datetime import datetime
 from typing import List, Dict, Optional
+
+import numpy as np
 from backend.config import settings
+from backend.services.vector_index import NumpyVectorIndex, to_epoch
+from backend.services.embedding import load_embedder
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-class VectorService:
-    """向量存储和检索服务"""
-    
+class ChromaVectorStore:
+    """ChromaDB 后端（HNSW + SQLite 元数据）"""
+
     def __init__(self):
+        import chromadb
+        from chromadb.config import Settings as ChromaSettings
+
         os.makedirs(settings.chroma_path, exist_ok=True)
-        
+
         # 完全禁用 telemetry
         self.client = chromadb.PersistentClient(
             path=settings.chroma_path,
@@ -25,7 +32,7 @@ class VectorService:
                 allow_reset=True
             )
         )
-        
+
         # 使用默认 embedding（轻量级，内存占用小）
         # 对于 CPU 服务器，这是最佳选择
         # 如果需要更好的中文支持，可以考虑部署独立的 embedding 服务
@@ -33,52 +40,226 @@ class VectorService:
             name="activities",
             metadata={"hnsw:space": "cosine"}
         )
-    
+
+    @staticmethod
+    def _with_ts(metadata: Dict) -> Dict:
+        # 数值时间戳用于时间范围过滤（Chroma 的 $gte/$lt 只支持数值）
+        metadata = dict(metadata)
+        if metadata.get("timestamp"):
+            metadata["ts"] = to_epoch(metadata["timestamp"])
+        return metadata
+
+    def add(self, activity_id: str, text: str, metadata: Dict):
+        self.collection.add(
+            ids=[activity_id],
+            documents=[text],
+            metadatas=[self._with_ts(metadata)]
+        )
+
+    def add_many(self, ids: List[str], texts: List[str], metadatas: List[Dict]):
+        self.collection.upsert(
+            ids=list(ids),
+            documents=list(texts),
+            metadatas=[self._with_ts(m) for m in metadatas]
+        )
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: List[Dict]):
+        self.collection.upsert(
+            ids=list(ids),
+            embeddings=[list(map(float, v)) for v in embeddings],
+            documents=list(documents),
+            metadatas=[self._with_ts(m) for m in metadatas]
+        )
+
+    def list_ids(self, page_size: int = 10000) -> List[str]:
+        ids = []
+        offset = 0
+        while True:
+            page = self.collection.get(include=[], limit=page_size, offset=offset)
+            ids.extend(page["ids"])
+            if len(page["ids"]) < page_size:
+                return ids
+            offset += page_size
+
+    def reset(self):
+        self.client.delete_collection("activities")
+        self.collection = self.client.get_or_create_collection(
+            name="activities",
+            metadata={"hnsw:space": "cosine"}
+        )
+
+    def search(self, query: str, limit: int, start_time: Optional[datetime], end_time: Optional[datetime]) -> List[Dict]:
+        conditions = []
+        if start_time:
+            conditions.append({"ts": {"$gte": to_epoch(start_time)}})
+        if end_time:
+            conditions.append({"ts": {"$lt": to_epoch(end_time)}})
+        where = None
+        if len(conditions) == 1:
+            where = conditions[0]
+        elif conditions:
+            where = {"$and": conditions}
+
+        results = self.collection.query(
+            query_texts=[query],
+            n_results=limit,
+            where=where
+        )
+
+        # 格式化结果
+        items = []
+        if results and results.get("ids") and len(results["ids"]) > 0:
+            for i, doc_id in enumerate(results["ids"][0]):
+                items.append({
+                    "id": doc_id,
+                    "distance": results["distances"][0][i] if "distances" in results else 0,
+                    "metadata": results["metadatas"][0][i] if "metadatas" in results else {},
+                    "document": results["documents"][0][i] if "documents" in results else ""
+                })
+        return items
+
+    def delete(self, activity_id: str):
+        self.collection.delete(ids=[activity_id])
+
+    def get_embeddings(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        result = self.collection.get(ids=list(ids), include=["embeddings"])
+        return {
+            doc_id: np.asarray(vector, dtype=np.float32)
+            for doc_id, vector in zip(result["ids"], result["embeddings"])
+        }
+
+
+class NumpyVectorStore:
+    """进程内 NumPy 后端（内存映射 float16/int8 矩阵 + 精确检索）"""
+
+    def __init__(self):
+        self.index = NumpyVectorIndex(settings.vector_index_path, dtype=settings.vector_index_dtype)
+        self._embed = None
+
+    def embed(self, texts: List[str]):
+        """文本向量化（模型延迟加载，保证启动速度）"""
+        if self._embed is None:
+            self._embed = load_embedder("numpy")
+        return self._embed(texts)
+
+    def add(self, activity_id: str, text: str, metadata: Dict):
+        self.index.upsert(
+            [activity_id],
+            self.embed([text]),
+            [metadata.get("timestamp")],
+            documents=[text],
+            metadatas=[metadata]
+        )
+
+    def add_many(self, ids: List[str], texts: List[str], metadatas: List[Dict]):
+        self.upsert(ids, self.embed(texts), texts, metadatas)
+
+    def search(self, query: str, limit: int, start_time: Optional[datetime], end_time: Optional[datetime]) -> List[Dict]:
+        return self.index.search(self.embed([query])[0], k=limit, start_time=start_time, end_time=end_time)
+
+    def delete(self, activity_id: str):
+        self.index.delete([activity_id])
+
+    def get_embeddings(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        return self.index.get_vectors(ids)
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: List[Dict]):
+        self.index.upsert(
+            ids,
+            embeddings,
+            [m.get("timestamp") for m in metadatas],
+            documents=documents,
+            metadatas=metadatas
+        )
+
+    def list_ids(self) -> List[str]:
+        return self.index.list_ids()
+
+    def reset(self):
+        shutil.rmtree(settings.vector_index_path, ignore_errors=True)
+        self.index = NumpyVectorIndex(settings.vector_index_path, dtype=settings.vector_index_dtype)
+
+
+VECTOR_BACKENDS = {
+    "chroma": ChromaVectorStore,
+    "numpy": NumpyVectorStore,
+}
+
+
+class VectorService:
+    """向量存储和检索服务"""
+
+    def __init__(self):
+        backend = settings.vector_backend.lower()
+        if backend not in VECTOR_BACKENDS:
+            raise ValueError(f"Unknown vector backend: {settings.vector_backend}")
+        self.backend_name = backend
+        self.store = VECTOR_BACKENDS[backend]()
+        logger.info(f"Vector backend: {backend}")
+
     def add_activity(self, activity_id: str, text: str, metadata: Dict) -> bool:
         """添加活动到向量数据库"""
         try:
-            self.collection.add(
-                ids=[activity_id],
-                documents=[text],
-                metadatas=[metadata]
-            )
+            self.store.add(activity_id, text, metadata)
             return True
         except Exception as e:
             logger.error(f"Error adding to vector DB: {str(e)}")
             return False
-    
-    def search_similar(self, query: str, limit: int = 10) -> List[Dict]:
-        """语义搜索"""
+
+    def add_activities(self, ids: List[str], texts: List[str], metadatas: List[Dict]) -> bool:
+        """批量添加活动（一次计算全部 embedding，耗时较长，在线程中调用）"""
+        if not ids:
+            return True
         try:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=limit
-            )
-            
-            # 格式化结果
-            items = []
-            if results and results.get("ids") and len(results["ids"]) > 0:
-                for i, doc_id in enumerate(results["ids"][0]):
-                    items.append({
-                        "id": doc_id,
-                        "distance": results["distances"][0][i] if "distances" in results else 0,
-                        "metadata": results["metadatas"][0][i] if "metadatas" in results else {},
-                        "document": results["documents"][0][i] if "documents" in results else ""
-                    })
-            
-            return items
+            self.store.add_many(ids, texts, metadatas)
+            return True
+        except Exception as e:
+            logger.error(f"Error adding {len(ids)} activities to vector DB: {str(e)}")
+            return False
+
+    def search_similar(
+        self,
+        query: str,
+        limit: int = 10,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None
+    ) -> List[Dict]:
+        """语义搜索（可选时间范围预过滤）"""
+        try:
+            return self.store.search(query, limit, start_time, end_time)
         except Exception as e:
             logger.error(f"Error searching vector DB: {str(e)}")
             return []
-    
+
     def delete_activity(self, activity_id: str) -> bool:
         """删除活动"""
         try:
-            self.collection.delete(ids=[activity_id])
+            self.store.delete(activity_id)
             return True
         except Exception as e:
             logger.error(f"Error deleting from vector DB: {str(e)}")
             return False
 
+    def upsert_embeddings(self, ids: List[str], embeddings, documents: List[str], metadatas: List[Dict]):
+        """批量写入已计算好的向量（用于索引重建，异常向上抛出）"""
+        self.store.upsert(ids, embeddings, documents, metadatas)
+
+    def get_embeddings(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """按 ID 取回已存储的向量（不存在的 ID 不返回，出错时返回空字典）"""
+        try:
+            return self.store.get_embeddings(ids)
+        except Exception as e:
+            logger.error(f"Error reading embeddings from vector DB: {str(e)}")
+            return {}
+
+    def list_ids(self) -> List[str]:
+        """向量库中的全部 ID"""
+        return self.store.list_ids()
+
+    def reset(self):
+        """清空向量库（更换 embedding 模型后重建前调用）"""
+        self.store.reset()
+        logger.warning(f"Vector store reset ({self.backend_name})")
+
 
 vector_service = VectorService()
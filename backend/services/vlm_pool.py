@@ -0,0 +1,391 @@
+"""
+多端点 AI 服务负载均衡
+
+AI_API_URLS 配置多个 OpenAI 兼容的推理服务（"url|权重|并发上限"，逗号分隔；为空时只使用 AI_API_URL）：
+- 分发：在健康端点中选择 (进行中的请求数 + 1) / 权重 最小的端点（least outstanding requests）
+- 容量：每个端点有并发上限（AI_ENDPOINT_CONCURRENCY）和令牌桶限速（AI_ENDPOINT_RATE / AI_ENDPOINT_BURST），
+  排队和优先级由 ai_scheduler 负责；重试和对冲只在端点有空余容量时发出，不排队
+- 被动健康检查：连续 AI_UNHEALTHY_AFTER 次连接失败或 5xx 后标记为不健康，不再分发；
+  单次失败时换一个健康端点重试一次
+- 主动健康检查：每 AI_HEALTH_INTERVAL 秒请求各端点的 /models（与 chat/completions 同一前缀），
+  恢复响应后重新启用；所有端点都不健康时仍按负载分发，不让请求直接失败
+- 对冲请求（AI_HEDGE_ENABLED）：请求在端点近期延迟的 p95 内没有返回时，向另一个端点再发一份，
+  先成功的结果生效，另一份取消；只用于截图分析，报告生成的输出长，不做对冲
+- 流式请求（stream）：按生成顺序逐段返回文本，已输出的内容无法撤回，因此不重试也不对冲
+
+所有请求共用一个长连接客户端。
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+import httpx
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 每个端点保留的最近延迟样本数
+LATENCY_WINDOW = 200
+# 计算 p95 至少需要的样本数
+MIN_LATENCY_SAMPLES = 20
+# 样本不足时的对冲等待时间（秒）
+DEFAULT_HEDGE_DELAY = 30.0
+
+
+def parse_endpoints(value: str, default_url: str) -> List[tuple]:
+    """解析 "url|权重|并发上限,..."（权重默认 1，并发上限默认 AI_ENDPOINT_CONCURRENCY）"""
+    endpoints = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, *options = [part.strip() for part in item.split("|")]
+        weight, concurrency = 1.0, settings.ai_endpoint_concurrency
+        try:
+            if options and options[0]:
+                weight = max(float(options[0]), 0.01)
+            if len(options) > 1 and options[1]:
+                concurrency = max(int(options[1]), 1)
+        except ValueError:
+            logger.warning(f"Invalid AI endpoint options, using defaults: {item}")
+        endpoints.append((url, weight, concurrency))
+    return endpoints or [(default_url, 1.0, settings.ai_endpoint_concurrency)]
+
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个请求，允许 burst 个突发（rate 为 0 表示不限速）"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill()
+        return self.tokens >= 1
+
+    def take(self) -> bool:
+        if not self.available():
+            return False
+        if self.rate > 0:
+            self.tokens -= 1
+        return True
+
+    def wait_time(self) -> float:
+        """距离下一个令牌的秒数"""
+        if self.available():
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Endpoint:
+    """一个推理服务端点的负载、容量和健康状态"""
+
+    def __init__(self, url: str, weight: float = 1.0, max_concurrency: int = 2):
+        self.url = url
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(settings.ai_endpoint_rate, settings.ai_endpoint_burst)
+        self.health_url = url.rsplit("/chat/completions", 1)[0] + "/models"
+        self.outstanding = 0
+        self.reserved = 0  # 调度器已分配、尚未发出的请求
+        self.healthy = True
+        self.failures = 0  # 连续失败次数
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.stats = {"requests": 0, "errors": 0, "hedged": 0}
+
+    def load(self) -> float:
+        return (self.outstanding + self.reserved + 1) / self.weight
+
+    def has_capacity(self) -> bool:
+        return self.outstanding + self.reserved < self.max_concurrency and self.bucket.available()
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def record(self, ok: bool, latency: Optional[float] = None):
+        if ok:
+            self.failures = 0
+            if latency is not None:
+                self.latencies.append(latency)
+            if not self.healthy:
+                logger.info(f"AI endpoint recovered: {self.url}")
+            self.healthy = True
+        else:
+            self.failures += 1
+            self.stats["errors"] += 1
+            if self.healthy and self.failures >= settings.ai_unhealthy_after:
+                logger.warning(f"AI endpoint marked unhealthy after {self.failures} failures: {self.url}")
+                self.healthy = False
+
+    def status(self) -> Dict:
+        p95 = self.p95()
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "max_concurrency": self.max_concurrency,
+            "p95_seconds": round(p95, 2) if p95 is not None else None,
+            **self.stats
+        }
+
+
+class VLMPool:
+    """按负载和健康状态把请求分发到多个推理服务"""
+
+    def __init__(self):
+        self.endpoints = [Endpoint(*spec) for spec in parse_endpoints(settings.ai_api_urls, settings.ai_api_url)]
+        self.client: Optional[httpx.AsyncClient] = None
+        self.health_task: Optional[asyncio.Task] = None
+        # 请求结束（释放容量）时的回调，调度器在这里分配下一个请求
+        self.listeners: List[Callable[[], None]] = []
+
+    def get_client(self) -> httpx.AsyncClient:
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(timeout=120.0)
+        return self.client
+
+    async def start(self):
+        """启动主动健康检查（只有一个端点时不需要）"""
+        if len(self.endpoints) > 1 and settings.ai_health_interval > 0 and self.health_task is None:
+            self.health_task = asyncio.create_task(self._health_loop())
+        logger.info("AI endpoints: " + ", ".join(
+            f"{e.url} (weight {e.weight:g}, concurrency {e.max_concurrency})" for e in self.endpoints
+        ))
+
+    async def stop(self):
+        if self.health_task:
+            self.health_task.cancel()
+            try:
+                await self.health_task
+            except asyncio.CancelledError:
+                pass
+            self.health_task = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(settings.ai_health_interval)
+            await asyncio.gather(*(self.check(endpoint) for endpoint in self.endpoints))
+
+    async def check(self, endpoint: Endpoint) -> bool:
+        """主动健康检查：/models 返回 2xx 即视为健康"""
+        try:
+            response = await self.get_client().get(endpoint.health_url, timeout=5.0)
+            ok = response.status_code < 300
+        except httpx.HTTPError:
+            ok = False
+        if ok and not endpoint.healthy:
+            logger.info(f"AI endpoint passed health check: {endpoint.url}")
+            endpoint.healthy = True
+            endpoint.failures = 0
+            self._notify()
+        elif not ok and endpoint.healthy:
+            logger.warning(f"AI endpoint failed health check: {endpoint.url}")
+            endpoint.healthy = False
+        return ok
+
+    def pick(self, exclude: Optional[Endpoint] = None, require_capacity: bool = False) -> Optional[Endpoint]:
+        """
+        负载最低的健康端点（都不健康时在全部端点中选择）
+
+        require_capacity 为 True 时只选择未达到并发上限且有令牌的端点，没有则返回 None
+        """
+        candidates = [e for e in self.endpoints if e is not exclude]
+        healthy = [e for e in candidates if e.healthy]
+        pool = healthy or candidates
+        if require_capacity:
+            pool = [e for e in pool if e.has_capacity()]
+        return min(pool, key=Endpoint.load) if pool else None
+
+    def _notify(self):
+        for listener in self.listeners:
+            listener()
+
+    def _start(self, endpoint: Endpoint, payload: Dict, timeout: float, reserved: bool = False) -> asyncio.Task:
+        """
+        发出请求；进行中的请求数在选择端点时立即增加，同一时刻的多个请求不会都选中同一个端点
+
+        reserved 为 True 表示调度器已为它分配了容量和令牌，否则在这里消耗一个令牌
+        """
+        if reserved:
+            endpoint.reserved -= 1
+        else:
+            endpoint.bucket.take()
+        endpoint.outstanding += 1
+        endpoint.stats["requests"] += 1
+
+        def finished(_):
+            endpoint.outstanding -= 1
+            self._notify()
+
+        task = asyncio.create_task(self._send(endpoint, payload, timeout))
+        task.add_done_callback(finished)
+        return task
+
+    async def _send(self, endpoint: Endpoint, payload: Dict, timeout: float) -> httpx.Response:
+        started = time.monotonic()
+        try:
+            response = await self.get_client().post(endpoint.url, json=payload, timeout=timeout)
+        except httpx.HTTPError:
+            endpoint.record(False)
+            raise
+        ok = response.status_code < 500
+        endpoint.record(ok, time.monotonic() - started if response.status_code == 200 else None)
+        return response
+
+    def _hedge_delay(self, endpoint: Endpoint) -> float:
+        p95 = endpoint.p95()
+        return max(settings.ai_hedge_min_delay, p95 if p95 is not None else DEFAULT_HEDGE_DELAY)
+
+    async def post(self, payload: Dict, timeout: float = 120.0, hedge: bool = False,
+                   endpoint: Optional[Endpoint] = None) -> httpx.Response:
+        """
+        发送 chat/completions 请求
+
+        连接失败或 5xx 时换一个有空余容量的健康端点重试一次；hedge 为 True 时慢请求可对冲到另一个端点（见 _post_to）。
+
+        Args:
+            endpoint: 调度器已分配（预留了容量）的端点；为空时直接选择负载最低的端点
+
+        Raises:
+            httpx.HTTPError: 所有尝试都连接失败
+        """
+        failed = None
+        last = None
+        for attempt in range(2):
+            reserved = attempt == 0 and endpoint is not None
+            if not reserved:
+                endpoint = self.pick(exclude=failed, require_capacity=attempt > 0)
+            if endpoint is None or (attempt and not endpoint.healthy):
+                break
+            try:
+                response = await self._post_to(endpoint, payload, timeout, hedge, reserved)
+            except httpx.HTTPError as e:
+                last, failed = e, endpoint
+                continue
+            if response.status_code < 500:
+                return response
+            last, failed = response, endpoint
+            if attempt == 0 and len(self.endpoints) > 1:
+                logger.warning(f"AI endpoint {endpoint.url} returned {response.status_code}, retrying on another endpoint")
+        if isinstance(last, Exception):
+            raise last
+        return last
+
+    async def _post_to(self, primary: Endpoint, payload: Dict, timeout: float, hedge: bool,
+                       reserved: bool = False) -> httpx.Response:
+        """
+        向 primary 发送请求
+
+        hedge 为 True 且存在其他健康端点时，超过 primary 的 p95 延迟仍未返回则向第二个端点再发一份，
+        先成功的结果生效。
+        """
+        first = self._start(primary, payload, timeout, reserved)
+        pending = {first}
+        try:
+            if not (hedge and settings.ai_hedge_enabled and len(self.endpoints) > 1):
+                return await first
+
+            delay = self._hedge_delay(primary)
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            secondary = self.pick(exclude=primary, require_capacity=True)
+            if done or secondary is None or not secondary.healthy:
+                return await first
+
+            secondary.stats["hedged"] += 1
+            logger.info(f"Hedging AI request: {primary.url} exceeded {delay:.1f}s, also sending to {secondary.url}")
+            pending.add(self._start(secondary, payload, timeout))
+            fallback = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code == 200:
+                        return task.result()
+                    fallback = fallback or task
+            # 两份都没有成功：返回先结束的那份（响应或异常）
+            return fallback.result()
+        finally:
+            # 调用方被取消或对冲的一方已返回时，取消其余请求
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+
+    async def stream(self, payload: Dict, timeout: float = 120.0,
+                     endpoint: Optional[Endpoint] = None) -> AsyncIterator[str]:
+        """
+        以 stream=true 发送 chat/completions 请求，逐段返回生成的文本（SSE 的 delta.content）
+
+        Args:
+            endpoint: 调度器已分配（预留了容量）的端点；为空时直接选择负载最低的端点
+
+        Raises:
+            httpx.HTTPError: 连接失败或端点返回非 200
+        """
+        if endpoint is not None:
+            endpoint.reserved -= 1
+        else:
+            endpoint = self.pick()
+            endpoint.bucket.take()
+        endpoint.outstanding += 1
+        endpoint.stats["requests"] += 1
+        started = time.monotonic()
+        ok, latency = True, None
+        try:
+            async with self.get_client().stream(
+                "POST", endpoint.url, json={**payload, "stream": True}, timeout=timeout
+            ) as response:
+                if response.status_code != 200:
+                    ok = response.status_code < 500
+                    await response.aread()
+                    raise httpx.HTTPStatusError(
+                        f"AI endpoint returned {response.status_code}: {response.text[:200]}",
+                        request=response.request, response=response
+                    )
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        continue
+                    delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+            latency = time.monotonic() - started
+        except httpx.HTTPStatusError:
+            raise
+        except httpx.HTTPError:
+            ok = False
+            raise
+        finally:
+            endpoint.record(ok, latency)
+            endpoint.outstanding -= 1
+            self._notify()
+
+    def status(self) -> List[Dict]:
+        return [endpoint.status() for endpoint in self.endpoints]
+
+
+vlm_pool = VLMPool()
@@ -0,0 +1,83 @@
+"""
+按天打包已关闭日期的截图
+
+每天凌晨把前几天日期分片目录（以及旧版平铺目录）中的原图和缩略图
+打包成单个归档文件，减少 inode 数量，加快备份和目录遍历。
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, Optional
+
+from backend.config import settings
+from backend.services.archive_service import archive_service
+from backend.utils.timezone import beijing_naive
+
+logger = logging.getLogger(__name__)
+
+
+def _sharded_days() -> set:
+    """日期分片目录中存在的日期 YYYYMMDD"""
+    days = set()
+    root = settings.screenshot_path
+    for year in os.listdir(root):
+        year_dir = os.path.join(root, year)
+        if not (year.isdigit() and len(year) == 4 and os.path.isdir(year_dir)):
+            continue
+        for month in os.listdir(year_dir):
+            month_dir = os.path.join(year_dir, month)
+            if not os.path.isdir(month_dir):
+                continue
+            for day in os.listdir(month_dir):
+                if os.path.isdir(os.path.join(month_dir, day)):
+                    days.add(f"{year}{month}{day}")
+    return days
+
+
+class DayArchiver:
+    """按天打包任务"""
+
+    def __init__(self):
+        self.running = False
+        self.last_result: Optional[Dict] = None
+
+    async def run(self) -> Optional[Dict]:
+        """打包所有已关闭的日期（定时任务入口）"""
+        if not settings.archive_enabled:
+            return None
+        if self.running:
+            logger.warning("Archive job is already running")
+            return None
+
+        self.running = True
+        try:
+            self.last_result = await asyncio.to_thread(self._run_sync)
+            return self.last_result
+        finally:
+            self.running = False
+
+    def _run_sync(self) -> Dict:
+        today = beijing_naive().strftime("%Y%m%d")
+        legacy = archive_service.legacy_days()
+        days = sorted(d for d in _sharded_days() | set(legacy) if d < today)
+
+        packed_days = 0
+        packed_files = 0
+        packed_bytes = 0
+        for day in days:
+            try:
+                count, size = archive_service.pack_day(day, legacy.get(day))
+            except Exception as e:
+                logger.error(f"Failed to pack {day}: {e}", exc_info=True)
+                continue
+            if count:
+                packed_days += 1
+                packed_files += count
+                packed_bytes += size
+
+        logger.info(f"Archive finished: {packed_files} files in {packed_days} days ({packed_bytes / 1024 / 1024:.1f} MB)")
+        return {"days": packed_days, "files": packed_files, "bytes": packed_bytes}
+
+
+# 全局实例
+day_archiver = DayArchiver()
@@ -1,29 +1,56 @@
 import asyncio
+import itertools
 import logging
+import time
+from bisect import bisect_left
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from typing import List
+from typing import AsyncIterator, Dict, List, Tuple
 import json
 import os
 
 from backend.database import SessionLocal
 from backend.models import Screenshot, Activity, Report
 from backend.services.ai_service import ai_service
+from backend.services.ai_scheduler import Priority, aged_rank
+from backend.services.vlm_pool import vlm_pool
 from backend.services.vector_service import vector_service
+from backend.services.image_service import image_service
+from backend.services.classifier import activity_classifier, normalize_app
+from backend.services.embedding import build_activity_text, build_activity_metadata
 from backend.config import settings
 from backend.utils.timezone import beijing_naive, get_hour_range_beijing, get_day_range_beijing
 
 logger = logging.getLogger(__name__)
 
 
+def priority_of(timestamp: datetime) -> Priority:
+    """截图的分析优先级：AI_FRESH_WINDOW 秒内的截图优先，更早的按积压处理"""
+    if timestamp and (beijing_naive() - timestamp).total_seconds() <= settings.ai_fresh_window:
+        return Priority.FRESH
+    return Priority.BACKLOG
+
+
+def _sample_key(app_name: str, monitor_id: int):
+    """抽样分组：同一应用（没有应用名时同一显示器）每 BACKLOG_SAMPLE_MINUTES 分钟一组"""
+    app = normalize_app(app_name)
+    return app, None if app else monitor_id
+
+
 class ScreenshotProcessor:
-    """截屏处理器 - 基于异步队列的持续处理"""
+    """截屏处理器 - 基于优先级队列的持续处理（刚上传的截图先于积压的截图）"""
     
     def __init__(self):
-        self.queue = asyncio.Queue()
-        self.processing_task = None
+        # (排序键, 序号, screenshot_id)：排序键按等待时间提升优先级（见 aged_rank），积压的截图不会被新截图一直挤在后面
+        self.queue = asyncio.PriorityQueue()
+        self.seq = itertools.count()
+        self.processing_tasks = []
         self.running = False
-        self.worker_lock = asyncio.Lock()
+        # 正在分析的截图（定期扫描不会重复加入队列，多个工作协程不会重复处理）
+        self.in_flight = set()
+        # 积压抽样时跳过的截图：screenshot_id -> 所在分组被抽中分析的截图 id
+        self.skipped: Dict[int, int] = {}
+        self.backlog_stats = {"sampled": 0, "skipped": 0, "filled": 0, "released": 0}
     
     async def start(self):
         """启动处理器"""
@@ -33,33 +60,48 @@ class ScreenshotProcessor:
         
         self.running = True
         
+        # 用最近的分析结果重建元数据分类缓存
+        db = SessionLocal()
+        try:
+            activity_classifier.warm_up(db)
+        except Exception as e:
+            logger.warning(f"Failed to warm up classification cache: {e}")
+        finally:
+            db.close()
+        
         # 扫描未分析的截图加入队列
         await self._scan_pending_screenshots()
         
-        # 启动工作协程
-        self.processing_task = asyncio.create_task(self._process_worker())
+        # 启动工作协程（多个推理服务时并发分析，默认与各端点并发上限之和相同）
+        workers = settings.analysis_workers or sum(e.max_concurrency for e in vlm_pool.endpoints)
+        self.processing_tasks = [asyncio.create_task(self._process_worker(i)) for i in range(workers)]
         
         # 启动定期扫描协程
         asyncio.create_task(self._periodic_scan())
         
-        logger.info("Screenshot processor started")
+        logger.info(f"Screenshot processor started ({workers} workers)")
     
     async def stop(self):
         """停止处理器"""
         self.running = False
-        if self.processing_task:
-            self.processing_task.cancel()
-            try:
-                await self.processing_task
-            except asyncio.CancelledError:
-                pass
+        for task in self.processing_tasks:
+            task.cancel()
+        await asyncio.gather(*self.processing_tasks, return_exceptions=True)
+        self.processing_tasks = []
         logger.info("Screenshot processor stopped")
     
-    async def add_to_queue(self, screenshot_id: int):
+    async def add_to_queue(self, screenshot_id: int, priority: Priority = Priority.FRESH):
         """添加截图到处理队列"""
-        await self.queue.put(screenshot_id)
+        if priority == Priority.BACKLOG and self._shedding(self.queue.qsize()):
+            # 积压过多：补传的旧截图留给定期扫描统一抽样
+            logger.info(f"Backlog over threshold, deferring screenshot {screenshot_id} to the next scan")
+            return
+        await self._put(screenshot_id, priority)
         logger.info(f"Added screenshot {screenshot_id} to processing queue (queue size: {self.queue.qsize()})")
     
+    async def _put(self, screenshot_id: int, priority: Priority):
+        await self.queue.put((aged_rank(priority, time.monotonic()), next(self.seq), screenshot_id))
+    
     async def _scan_pending_screenshots(self):
         """扫描未分析的截图（同时检查文件系统）"""
         db = SessionLocal()
@@ -70,20 +112,32 @@ class ScreenshotProcessor:
                 Screenshot.is_similar == False
             ).order_by(Screenshot.timestamp).all()
             
-            valid_count = 0
+            valid = []
             invalid_count = 0
             
             for screenshot in screenshots:
-                # 检查文件是否存在
-                if os.path.exists(screenshot.filepath):
-                    await self.queue.put(screenshot.id)
-                    valid_count += 1
+                if screenshot.id in self.in_flight or screenshot.id in self.skipped:
+                    continue
+                # 检查文件是否存在（散列文件或按天打包的归档）
+                if image_service.exists(screenshot.filename):
+                    valid.append(screenshot)
                 else:
                     # 文件不存在，标记为已分析避免重复检查
                     logger.warning(f"Screenshot file not found: {screenshot.filepath}, marking as analyzed")
                     screenshot.is_analyzed = True
                     invalid_count += 1
             
+            # 新截图全部分析；积压的截图超过阈值时抽样分析，其余的等待补全
+            backlog = [s for s in valid if priority_of(s.timestamp) == Priority.BACKLOG]
+            if self._shedding(len(backlog)):
+                sampled = self._subsample(backlog)
+                logger.info(f"Backlog of {len(backlog)} screenshots over threshold, analyzing {sampled} samples")
+            
+            valid = [s for s in valid if s.id not in self.skipped]
+            for screenshot in valid:
+                await self._put(screenshot.id, priority_of(screenshot.timestamp))
+            valid_count = len(valid)
+            
             if valid_count > 0:
                 logger.info(f"Found {valid_count} pending screenshots (skipped {invalid_count} missing files)")
             elif screenshots:
@@ -98,27 +152,160 @@ class ScreenshotProcessor:
         finally:
             db.close()
     
+    @staticmethod
+    def _shedding(backlog_size: int) -> bool:
+        return settings.backlog_threshold > 0 and backlog_size > settings.backlog_threshold
+    
+    def _subsample(self, backlog: List[Screenshot]) -> int:
+        """
+        积压抽样：同一应用每 BACKLOG_SAMPLE_MINUTES 分钟只分析最早的一张，其余记入 self.skipped
+        
+        Returns:
+            抽中分析的截图数
+        """
+        bucket_seconds = max(settings.backlog_sample_minutes, 1) * 60
+        samples = {}
+        for screenshot in backlog:
+            key = (*_sample_key(screenshot.app_name, screenshot.monitor_id), int(screenshot.timestamp.timestamp() // bucket_seconds))
+            sample_id = samples.setdefault(key, screenshot.id)
+            if sample_id != screenshot.id:
+                self.skipped[screenshot.id] = sample_id
+        self.backlog_stats["sampled"] += len(samples)
+        self.backlog_stats["skipped"] += len(backlog) - len(samples)
+        return len(samples)
+    
+    async def _fill_skipped(self):
+        """
+        用相邻的分析结果补全跳过的截图
+        
+        所在分组的抽样截图分析完成后，取同一应用 BACKLOG_SAMPLE_MINUTES 分钟内时间最近的活动复制一份
+        （source 为 fill）；抽样截图分析失败、附近没有可用结果时放回队列正常分析。
+        """
+        db = SessionLocal()
+        try:
+            ids = list(self.skipped)
+            screenshots = []
+            for i in range(0, len(ids), 500):
+                screenshots += db.query(Screenshot).filter(Screenshot.id.in_(ids[i:i + 500])).all()
+            sample_ids = {self.skipped[s.id] for s in screenshots}
+            pending_samples = {
+                sample_id for (sample_id,) in db.query(Screenshot.id).filter(
+                    Screenshot.id.in_(sample_ids), Screenshot.is_analyzed == False
+                )
+            } if sample_ids else set()
+            # 抽样截图已分析完（或已被删除）的才补全
+            ready = [s for s in screenshots if not s.is_analyzed and self.skipped[s.id] not in pending_samples]
+            for screenshot in screenshots:
+                if screenshot.is_analyzed:
+                    del self.skipped[screenshot.id]
+            for screenshot_id in set(ids) - {s.id for s in screenshots}:
+                del self.skipped[screenshot_id]
+            if not ready:
+                return 0
+            
+            window = timedelta(minutes=max(settings.backlog_sample_minutes, 1))
+            start = min(s.timestamp for s in ready) - window
+            end = max(s.timestamp for s in ready) + window
+            rows = db.query(Activity, Screenshot.app_name, Screenshot.monitor_id).join(
+                Screenshot, Screenshot.id == Activity.screenshot_id
+            ).filter(
+                Activity.timestamp >= start,
+                Activity.timestamp <= end,
+                (Activity.source != "fill") | (Activity.source.is_(None))
+            ).order_by(Activity.timestamp).all()
+            neighbours: Dict[tuple, List[Activity]] = {}
+            for activity, app_name, monitor_id in rows:
+                neighbours.setdefault(_sample_key(app_name, monitor_id), []).append(activity)
+            
+            filled = released = 0
+            entries = []
+            for screenshot in ready:
+                del self.skipped[screenshot.id]
+                nearest = self._nearest(neighbours.get(_sample_key(screenshot.app_name, screenshot.monitor_id), []), screenshot.timestamp, window)
+                if nearest is None:
+                    await self._put(screenshot.id, Priority.BACKLOG)
+                    released += 1
+                    continue
+                activity = Activity(
+                    screenshot_id=screenshot.id,
+                    screenshot_filename=screenshot.filename,
+                    timestamp=screenshot.timestamp,
+                    activity_type=nearest.activity_type,
+                    description=nearest.description,
+                    application=nearest.application,
+                    content_summary=nearest.content_summary,
+                    source="fill",
+                    model_name=nearest.model_name,
+                    prompt_version=nearest.prompt_version,
+                    vector_id=f"activity_{screenshot.id}"
+                )
+                db.add(activity)
+                entries.append((activity.vector_id, build_activity_text(activity), build_activity_metadata(activity),
+                                screenshot.filename))
+                screenshot.is_analyzed = True
+                filled += 1
+            db.commit()
+            # 一次补全可能有上千条：向量批量计算并写入，与删除分析图片一起在线程中执行，不阻塞上传和接口
+            if entries:
+                await asyncio.to_thread(self._index_filled, entries)
+            
+            self.backlog_stats["filled"] += filled
+            self.backlog_stats["released"] += released
+            logger.info(f"Filled {filled} skipped screenshots from neighbours ({released} queued for analysis, "
+                        f"{len(self.skipped)} waiting)")
+            return filled
+        finally:
+            db.close()
+    
+    @staticmethod
+    def _index_filled(entries: List[tuple]):
+        for i in range(0, len(entries), 256):
+            chunk = entries[i:i + 256]
+            vector_service.add_activities([e[0] for e in chunk], [e[1] for e in chunk], [e[2] for e in chunk])
+        for _, _, _, filename in entries:
+            image_service.discard_analysis_variant(filename)
+    
+    @staticmethod
+    def _nearest(activities: List[Activity], timestamp: datetime, window: timedelta):
+        """按时间排序的活动中离 timestamp 最近且不超过 window 的一条"""
+        i = bisect_left([a.timestamp for a in activities], timestamp)
+        candidates = [a for a in activities[max(i - 1, 0):i + 1] if abs(a.timestamp - timestamp) <= window]
+        return min(candidates, key=lambda a: abs(a.timestamp - timestamp), default=None)
+    
+    def status(self) -> Dict:
+        """分析队列和积压抽样的状态"""
+        return {
+            "queue_size": self.queue.qsize(),
+            "in_flight": len(self.in_flight),
+            "waiting_fill": len(self.skipped),
+            "backlog_threshold": settings.backlog_threshold,
+            **self.backlog_stats
+        }
+    
     async def _periodic_scan(self):
         """定期扫描未分析的截图（每5秒）"""
         while self.running:
             try:
                 await asyncio.sleep(5)
                 
+                if self.skipped:
+                    await self._fill_skipped()
+                
                 # 只在队列为空时扫描
                 if self.queue.empty():
                     await self._scan_pending_screenshots()
             except Exception as e:
                 logger.error(f"Error in periodic scan: {e}")
     
-    async def _process_worker(self):
-        """工作协程 - 串行处理队列中的截图"""
-        logger.info("Processing worker started")
+    async def _process_worker(self, worker_id: int = 0):
+        """工作协程 - 依次处理队列中的截图（多个工作协程并发，请求由 vlm_pool 分发到各推理服务）"""
+        logger.info(f"Processing worker {worker_id} started")
         
         while self.running:
             try:
                 # 从队列获取任务（超时等待）
                 try:
-                    screenshot_id = await asyncio.wait_for(
+                    _, _, screenshot_id = await asyncio.wait_for(
                         self.queue.get(),
                         timeout=10.0
                     )
@@ -126,26 +313,32 @@ class ScreenshotProcessor:
                     # 超时继续循环
                     continue
                 
+                # 同一截图被重复加入队列时只处理一次
+                if screenshot_id in self.in_flight:
+                    self.queue.task_done()
+                    continue
+                self.in_flight.add(screenshot_id)
+                
                 # 处理截图
-                async with self.worker_lock:
-                    db = SessionLocal()
-                    try:
-                        screenshot = db.query(Screenshot).filter(
-                            Screenshot.id == screenshot_id
-                        ).first()
-                        
-                        if screenshot:
-                            logger.info(f"Processing screenshot {screenshot_id} (queue remaining: {self.queue.qsize()})")
-                            await self._process_screenshot(db, screenshot)
-                            db.commit()
-                        else:
-                            logger.warning(f"Screenshot {screenshot_id} not found")
-                    except Exception as e:
-                        logger.error(f"Error processing screenshot {screenshot_id}: {e}", exc_info=True)
-                        db.rollback()
-                    finally:
-                        db.close()
-                        self.queue.task_done()
+                db = SessionLocal()
+                try:
+                    screenshot = db.query(Screenshot).filter(
+                        Screenshot.id == screenshot_id
+                    ).first()
+                    
+                    if screenshot and not screenshot.is_analyzed:
+                        logger.info(f"Processing screenshot {screenshot_id} (queue remaining: {self.queue.qsize()})")
+                        await self._process_screenshot(db, screenshot)
+                        db.commit()
+                    elif not screenshot:
+                        logger.warning(f"Screenshot {screenshot_id} not found")
+                except Exception as e:
+                    logger.error(f"Error processing screenshot {screenshot_id}: {e}", exc_info=True)
+                    db.rollback()
+                finally:
+                    db.close()
+                    self.in_flight.discard(screenshot_id)
+                    self.queue.task_done()
                 
             except asyncio.CancelledError:
                 logger.info("Processing worker cancelled")
@@ -153,18 +346,31 @@ class ScreenshotProcessor:
             except Exception as e:
                 logger.error(f"Unexpected error in worker: {e}", exc_info=True)
         
-        logger.info("Processing worker stopped")
+        logger.info(f"Processing worker {worker_id} stopped")
     
     async def _process_screenshot(self, db: Session, screenshot: Screenshot):
         """处理单个截屏"""
         try:
-            # 构建图片 URL - AI 服务可以访问的地址
-            image_url = f"{settings.ai_image_server}/{screenshot.filename}"
-            
-            logger.info(f"Analyzing screenshot: {screenshot.filename}, URL: {image_url}")
-            
-            # 调用 AI 分析
-            result = await ai_service.analyze_screenshot(image_url)
+            # 已知的 (应用, 窗口标题) 直接按规则或学习缓存分类，不调用视觉模型
+            classified = activity_classifier.classify(screenshot.app_name, screenshot.window_title)
+            if classified:
+                result, source = classified
+                logger.info(f"Classified screenshot by {source}: {screenshot.filename} ({screenshot.app_name})")
+            else:
+                # 构建图片 URL - AI 服务可以访问的地址
+                region = "changed" if self._crop_changed(screenshot) else None
+                image_url = f"{settings.ai_image_server}/{image_service.ai_image_path(screenshot.filename, region)}"
+                
+                logger.info(f"Analyzing screenshot: {screenshot.filename}, URL: {image_url}")
+                
+                # 调用 AI 分析（附带客户端上报的应用名和窗口标题）
+                result = await ai_service.analyze_screenshot(
+                    image_url, activity_classifier.hint(screenshot.app_name, screenshot.window_title),
+                    priority_of(screenshot.timestamp)
+                )
+                source = "vlm"
+                if result:
+                    activity_classifier.learn(screenshot.app_name, screenshot.window_title, result)
             
             if result:
                 # 创建活动记录
@@ -176,32 +382,19 @@ class ScreenshotProcessor:
                     description=result.get("description", ""),
                     application=result.get("application", "未知"),
                     content_summary=result.get("content_summary", ""),
+                    source=source,
                     vector_id=f"activity_{screenshot.id}"
                 )
+                if source == "vlm":
+                    activity.model_name, activity.prompt_version = ai_service.analysis_version
                 
                 db.add(activity)
                 
                 # 构建高质量的嵌入文本（增强语义信息）
-                text_parts = []
-                if activity.activity_type:
-                    text_parts.append(f"活动类型：{activity.activity_type}")
-                if activity.application:
-                    text_parts.append(f"应用程序：{activity.application}")
-                if activity.description:
-                    text_parts.append(f"描述：{activity.description}")
-                if activity.content_summary:
-                    text_parts.append(f"内容：{activity.content_summary}")
-                
-                text_for_embedding = " ".join(text_parts)
-                
                 vector_service.add_activity(
                     activity.vector_id,
-                    text_for_embedding,
-                    {
-                        "activity_id": screenshot.id,
-                        "timestamp": screenshot.timestamp.isoformat(),
-                        "activity_type": activity.activity_type
-                    }
+                    build_activity_text(activity),
+                    build_activity_metadata(activity)
                 )
                 
                 # 标记为已分析，清除失败记录
@@ -221,6 +414,9 @@ class ScreenshotProcessor:
                     logger.error(f"AI analysis failed {screenshot.analysis_failed_count} times, giving up: {screenshot.filename}")
                 else:
                     logger.warning(f"AI analysis failed for: {screenshot.filename} (attempt {screenshot.analysis_failed_count}/3, will retry)")
+            
+            if screenshot.is_analyzed:
+                image_service.discard_analysis_variant(screenshot.filename)
                 
         except Exception as e:
             # 异常处理：记录错误并增加失败计数
@@ -235,6 +431,13 @@ class ScreenshotProcessor:
             else:
                 logger.error(f"Error processing screenshot {screenshot.filename} (attempt {screenshot.analysis_failed_count}/3): {error_msg}", exc_info=True)
     
+    def _crop_changed(self, screenshot: Screenshot) -> bool:
+        """增量上传的帧变化区域足够小时只分析变化的部分"""
+        if not settings.analysis_crop_changed or not screenshot.changed_region or not screenshot.width:
+            return False
+        x0, y0, x1, y1 = map(int, screenshot.changed_region.split(","))
+        return (x1 - x0) * (y1 - y0) <= settings.analysis_crop_max_area * screenshot.width * screenshot.height
+    
     async def process_pending_screenshots(self):
         """兼容旧接口 - 立即扫描并加入队列"""
         await self._scan_pending_screenshots()
@@ -244,6 +447,96 @@ class ScreenshotProcessor:
 class ReportGenerator:
     """报告生成器 - 生成小时报告和日报"""
     
+    @staticmethod
+    def report_to_dict(report: Report) -> Dict:
+        return {
+            "id": report.id,
+            "report_type": report.report_type,
+            "start_time": report.start_time.isoformat(),
+            "end_time": report.end_time.isoformat(),
+            "summary": report.summary,
+            "screenshot_count": report.screenshot_count,
+            "work_minutes": report.work_minutes,
+            "entertainment_minutes": report.entertainment_minutes,
+            "study_minutes": report.study_minutes,
+            "other_minutes": report.other_minutes
+        }
+    
+    async def stream_report(self, start_time: datetime, end_time: datetime,
+                            refresh: bool = False) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        按需生成任意时间段的报告，依次返回 (事件, 数据)：
+        - report：已有相同时间段的报告（refresh 为 False 时），直接返回后结束
+        - meta：开始生成（活动数），在调用模型之前发出
+        - token：模型生成的文本片段
+        - done：生成完成；时间段已经结束时保存为 custom 报告，下次直接返回
+        - error：生成失败
+        """
+        db = SessionLocal()
+        try:
+            if not refresh:
+                existing = db.query(Report).filter(
+                    Report.start_time == start_time,
+                    Report.end_time == end_time
+                ).order_by(Report.id.desc()).first()
+                if existing:
+                    yield "report", self.report_to_dict(existing)
+                    return
+            
+            activities = db.query(Activity).filter(
+                Activity.timestamp >= start_time,
+                Activity.timestamp < end_time
+            ).order_by(Activity.timestamp).all()
+        finally:
+            # 生成期间不占用数据库连接
+            db.close()
+        
+        yield "meta", {
+            "start_time": start_time.isoformat(),
+            "end_time": end_time.isoformat(),
+            "activity_count": len(activities)
+        }
+        if not activities:
+            yield "done", {"id": None, "summary": "该时间段无活动记录", "screenshot_count": 0}
+            return
+        
+        parts = []
+        try:
+            async for delta in ai_service.stream_report(activities, start_time, end_time):
+                parts.append(delta)
+                yield "token", {"text": delta}
+        except Exception as e:
+            logger.error(f"Error streaming report for {start_time} - {end_time}: {e}")
+            yield "error", {"message": "报告生成失败"}
+            return
+        
+        summary = "".join(parts)
+        type_minutes = {}
+        for activity in activities:
+            t = activity.activity_type or "其他"
+            type_minutes[t] = type_minutes.get(t, 0) + 1  # 每个活动约1分钟
+        report = Report(
+            report_type="custom",
+            start_time=start_time,
+            end_time=end_time,
+            summary=summary,
+            screenshot_count=len(activities),
+            work_minutes=type_minutes.get("工作", 0),
+            study_minutes=type_minutes.get("学习", 0),
+            entertainment_minutes=type_minutes.get("娱乐", 0),
+            other_minutes=type_minutes.get("其他", 0)
+        )
+        if summary and end_time <= beijing_naive():
+            db = SessionLocal()
+            try:
+                db.add(report)
+                db.commit()
+                db.refresh(report)
+            finally:
+                db.close()
+            logger.info(f"Generated custom report for {start_time} - {end_time}")
+        yield "done", self.report_to_dict(report)
+    
     async def generate_hourly_report(self, target_hour: datetime = None):
         """生成小时报告"""
         db = SessionLocal()
@@ -0,0 +1,311 @@
+"""
+重新分析历史截图
+
+更换视觉模型（AI_MODEL_NAME）或修改分析提示词（ANALYSIS_PROMPT_VERSION）后，按时间范围重新分析已分析过的截图：
+- 按截图 id 分批处理，每批完成后把检查点写入 reanalysis_jobs 表，服务重启后自动继续
+- 同时分析的截图数和每秒请求数可按任务设置，请求以最低优先级排队，不影响新截图的分析
+- 新结果先暂存在 activity_revisions 表，全部完成后在一个事务中替换 activities，
+  时间线和报告不会看到新旧混合的结果；提交后再更新对应的向量
+
+已是目标版本的活动（除非 force）和规则分类的活动不重新分析；分析失败的截图保留原结果。
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from backend.config import settings
+from backend.database import SessionLocal
+from backend.models import Screenshot, Activity, ReanalysisJob, ActivityRevision
+from backend.services.ai_service import ai_service
+from backend.services.ai_scheduler import Priority
+from backend.services.classifier import activity_classifier
+from backend.services.embedding import build_activity_text, build_activity_metadata
+from backend.services.image_service import image_service
+from backend.services.vector_service import vector_service
+from backend.utils.timezone import beijing_naive
+
+logger = logging.getLogger(__name__)
+
+
+class RequestPacer:
+    """按固定间隔放行请求（rate 为每秒请求数，0 表示不限速）"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self.next_slot = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def job_to_dict(job: ReanalysisJob) -> Dict:
+    return {
+        "id": job.id,
+        "start_time": job.start_time.isoformat(),
+        "end_time": job.end_time.isoformat(),
+        "model_name": job.model_name,
+        "prompt_version": job.prompt_version,
+        "force": job.force,
+        "concurrency": job.concurrency,
+        "rate": job.rate,
+        "state": job.state,
+        "last_screenshot_id": job.last_screenshot_id,
+        "processed": job.processed,
+        "staged": job.staged,
+        "failed": job.failed,
+        "swapped": job.swapped,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+class Reanalyzer:
+    """重新分析任务执行器（同一时间只运行一个任务）"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.job_id: Optional[int] = None
+        # 运行中的任务收到的暂停 / 取消请求，在当前批次结束后生效
+        self.stop_state: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def create(self, db: Session, start_time: datetime, end_time: datetime,
+               concurrency: Optional[int] = None, rate: Optional[float] = None,
+               force: bool = False) -> ReanalysisJob:
+        """创建任务并开始执行"""
+        model_name, prompt_version = ai_service.analysis_version
+        job = ReanalysisJob(
+            start_time=start_time,
+            end_time=end_time,
+            model_name=model_name,
+            prompt_version=prompt_version,
+            force=force,
+            concurrency=concurrency or settings.reanalysis_concurrency,
+            rate=settings.reanalysis_rate if rate is None else rate,
+            state="running"
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        self.start(job.id)
+        return job
+
+    def start(self, job_id: int):
+        self.job_id = job_id
+        self.stop_state = None
+        self.task = asyncio.create_task(self._run(job_id))
+
+    def resume_interrupted(self):
+        """服务启动时继续上次未完成的任务"""
+        db = SessionLocal()
+        try:
+            job = db.query(ReanalysisJob).filter(
+                ReanalysisJob.state == "running"
+            ).order_by(ReanalysisJob.id).first()
+        finally:
+            db.close()
+        if job:
+            logger.info(f"Resuming reanalysis job {job.id} after screenshot {job.last_screenshot_id}")
+            self.start(job.id)
+
+    def request_stop(self, state: str):
+        """暂停（paused）或取消（cancelled）运行中的任务"""
+        self.stop_state = state
+
+    async def stop(self):
+        """服务关闭：中断当前批次，任务保持 running 状态，下次启动时从检查点继续"""
+        if self.running:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    @staticmethod
+    def discard(db: Session, job: ReanalysisJob, state: str = "cancelled"):
+        """放弃任务暂存的结果"""
+        db.query(ActivityRevision).filter(ActivityRevision.job_id == job.id).delete(synchronize_session=False)
+        job.state = state
+        job.finished_at = beijing_naive()
+        db.commit()
+
+    # ------------------------------------------------------------------
+    # 执行
+    # ------------------------------------------------------------------
+
+    async def _run(self, job_id: int):
+        db = SessionLocal()
+        try:
+            job = db.query(ReanalysisJob).filter(ReanalysisJob.id == job_id).first()
+            if (job.model_name, job.prompt_version) != ai_service.analysis_version:
+                # 任务创建后又更换了模型或提示词，继续执行会混入另一版本的结果
+                raise RuntimeError(
+                    f"Analysis version changed to {ai_service.analysis_version}, "
+                    f"job targets {(job.model_name, job.prompt_version)}"
+                )
+
+            semaphore = asyncio.Semaphore(max(job.concurrency or 1, 1))
+            pacer = RequestPacer(job.rate)
+            logger.info(f"Reanalysis job {job.id} running ({job.start_time} - {job.end_time}, "
+                        f"concurrency {job.concurrency}, rate {job.rate}/s)")
+
+            while True:
+                if self.stop_state:
+                    if self.stop_state == "cancelled":
+                        self.discard(db, job)
+                    else:
+                        job.state = self.stop_state
+                        db.commit()
+                    logger.info(f"Reanalysis job {job.id} {job.state}")
+                    return
+
+                batch = self._next_batch(db, job)
+                if not batch:
+                    break
+                todo = self._outdated(db, job, batch)
+                results = await asyncio.gather(*(self._analyze(s, semaphore, pacer) for s in todo))
+
+                for screenshot, result in zip(todo, results):
+                    if result is None:
+                        job.failed += 1
+                        continue
+                    db.add(ActivityRevision(
+                        job_id=job.id,
+                        screenshot_id=screenshot.id,
+                        activity_type=result.get("activity_type", "其他"),
+                        description=result.get("description", ""),
+                        application=result.get("application", "未知"),
+                        content_summary=result.get("content_summary", ""),
+                        model_name=job.model_name,
+                        prompt_version=job.prompt_version
+                    ))
+                    job.staged += 1
+                # 检查点与暂存结果在同一事务中提交
+                job.last_screenshot_id = batch[-1].id
+                job.processed += len(batch)
+                db.commit()
+
+            updated = self._swap(db, job)
+            entries = [(a.vector_id, build_activity_text(a), build_activity_metadata(a)) for a in updated]
+            await asyncio.to_thread(self._reindex, entries)
+            logger.info(f"Reanalysis job {job.id} completed: {job.swapped} activities replaced, {job.failed} failed")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Reanalysis job {job_id} failed: {e}", exc_info=True)
+            db.rollback()
+            job = db.query(ReanalysisJob).filter(ReanalysisJob.id == job_id).first()
+            if job:
+                job.state = "failed"
+                job.error = str(e)[:500]
+                job.finished_at = beijing_naive()
+                db.commit()
+        finally:
+            db.close()
+
+    @staticmethod
+    def _next_batch(db: Session, job: ReanalysisJob) -> List[Screenshot]:
+        """按 id 顺序取下一批范围内已分析的截图（keyset 分页，从检查点继续）"""
+        return db.query(Screenshot).filter(
+            Screenshot.id > job.last_screenshot_id,
+            Screenshot.timestamp >= job.start_time,
+            Screenshot.timestamp < job.end_time,
+            Screenshot.is_similar == False,
+            Screenshot.is_analyzed == True
+        ).order_by(Screenshot.id).limit(settings.reanalysis_batch_size).all()
+
+    @staticmethod
+    def _outdated(db: Session, job: ReanalysisJob, batch: List[Screenshot]) -> List[Screenshot]:
+        """需要重新分析的截图：活动不是目标版本（或 force），不是规则分类，图片仍存在"""
+        activities = {
+            a.screenshot_id: a for a in db.query(Activity).filter(
+                Activity.screenshot_id.in_([s.id for s in batch])
+            )
+        }
+        todo = []
+        for screenshot in batch:
+            activity = activities.get(screenshot.id)
+            if activity is not None:
+                if activity.source == "rule":
+                    continue
+                if not job.force and (activity.model_name, activity.prompt_version) == (job.model_name, job.prompt_version):
+                    continue
+            if image_service.exists(screenshot.filename):
+                todo.append(screenshot)
+        return todo
+
+    @staticmethod
+    async def _analyze(screenshot: Screenshot, semaphore: asyncio.Semaphore, pacer: RequestPacer) -> Optional[Dict]:
+        async with semaphore:
+            await pacer.wait()
+            image_url = f"{settings.ai_image_server}/{image_service.ai_image_path(screenshot.filename)}"
+            return await ai_service.analyze_screenshot(
+                image_url,
+                activity_classifier.hint(screenshot.app_name, screenshot.window_title),
+                Priority.REANALYSIS
+            )
+
+    @staticmethod
+    def _swap(db: Session, job: ReanalysisJob) -> List[Activity]:
+        """在一个事务中用暂存的结果替换活动记录，返回更新过的活动"""
+        revisions = db.query(ActivityRevision).filter(ActivityRevision.job_id == job.id).all()
+        screenshot_ids = [r.screenshot_id for r in revisions]
+        activities: Dict[int, Activity] = {}
+        screenshots: Dict[int, Screenshot] = {}
+        for i in range(0, len(screenshot_ids), 500):
+            chunk = screenshot_ids[i:i + 500]
+            activities.update((a.screenshot_id, a) for a in db.query(Activity).filter(Activity.screenshot_id.in_(chunk)))
+            screenshots.update((s.id, s) for s in db.query(Screenshot).filter(Screenshot.id.in_(chunk)))
+
+        updated = []
+        for revision in revisions:
+            screenshot = screenshots.get(revision.screenshot_id)
+            if screenshot is None:
+                # 暂存后截图已被保留策略删除
+                continue
+            activity = activities.get(revision.screenshot_id)
+            if activity is None:
+                # 之前分析失败被放弃的截图
+                activity = Activity(
+                    screenshot_id=screenshot.id,
+                    screenshot_filename=screenshot.filename,
+                    timestamp=screenshot.timestamp,
+                    vector_id=f"activity_{screenshot.id}"
+                )
+                db.add(activity)
+            activity.activity_type = revision.activity_type
+            activity.description = revision.description
+            activity.application = revision.application
+            activity.content_summary = revision.content_summary
+            activity.model_name = revision.model_name
+            activity.prompt_version = revision.prompt_version
+            activity.source = "vlm"
+            updated.append(activity)
+
+        db.query(ActivityRevision).filter(ActivityRevision.job_id == job.id).delete(synchronize_session=False)
+        job.swapped = len(updated)
+        job.state = "completed"
+        job.finished_at = beijing_naive()
+        db.commit()
+        return updated
+
+    @staticmethod
+    def _reindex(entries: List[tuple]):
+        """更新替换后活动的向量（向量库不支持事务，在数据库提交之后执行）"""
+        for vector_id, text, metadata in entries:
+            vector_service.delete_activity(vector_id)
+            vector_service.add_activity(vector_id, text, metadata)
+
+
+reanalyzer = Reanalyzer()
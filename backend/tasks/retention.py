@@ -0,0 +1,296 @@
+"""
+分级保留策略
+
+- 超过 retain_original_days 的原图：并行重新压缩（降低质量），压缩成功后才标记 is_compressed，失败的下次重试
+- 超过 retain_compressed_days 的截图：删除图片和缩略图，记录标记为 is_purged 并保留，
+  时间线、报告和搜索仍可使用其活动记录；retention_delete_records 开启时连同活动、向量和截图记录一并删除
+- 每次执行记录回收的字节数（retention_logs 表）
+
+整个任务在线程中运行，按批次提交并对磁盘读写限速，不阻塞事件循环和上传 I/O。
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import or_, select
+
+from backend.config import settings
+from backend.database import SessionLocal
+from backend.models import Screenshot, Activity, RetentionLog
+from backend.services.image_service import image_service
+from backend.services.archive_service import archive_service, day_of
+from backend.services.vector_service import vector_service
+from backend.utils.timezone import beijing_naive
+
+logger = logging.getLogger(__name__)
+
+
+class ByteRateLimiter:
+    """简单的字节速率限制（线程安全）"""
+
+    def __init__(self, max_mb_per_second: float):
+        self.bytes_per_second = max_mb_per_second * 1024 * 1024
+        self.started = time.monotonic()
+        self.consumed = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, nbytes: int):
+        if self.bytes_per_second <= 0:
+            return
+        with self.lock:
+            self.consumed += nbytes
+            ahead = self.consumed / self.bytes_per_second - (time.monotonic() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def _thumbnail_name(filename: str) -> str:
+    return f"thumbnails/thumb_{filename}"
+
+
+class RetentionManager:
+    """保留策略执行器"""
+
+    def __init__(self):
+        self.running = False
+        self.last_result: Optional[Dict] = None
+
+    async def run(self) -> Optional[Dict]:
+        """执行一次保留策略（定时任务入口）"""
+        if not settings.retention_enabled:
+            return None
+        if self.running:
+            logger.warning("Retention job is already running")
+            return None
+
+        self.running = True
+        try:
+            self.last_result = await asyncio.to_thread(self._run_sync)
+            return self.last_result
+        finally:
+            self.running = False
+
+    def _run_sync(self) -> Dict:
+        limiter = ByteRateLimiter(settings.retention_max_mb_per_second)
+        result = {"compressed_count": 0, "deleted_count": 0, "bytes_reclaimed": 0}
+        started_at = beijing_naive()
+        error = None
+
+        try:
+            # 先删除过期截图，避免对即将删除的文件做无用压缩
+            deleted, deleted_bytes = self._delete_expired()
+            result["deleted_count"] = deleted
+            result["bytes_reclaimed"] += deleted_bytes
+
+            compressed, compressed_bytes = self._compress_originals(limiter)
+            result["compressed_count"] = compressed
+            result["bytes_reclaimed"] += compressed_bytes
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Retention job failed: {e}", exc_info=True)
+
+        db = SessionLocal()
+        try:
+            db.add(RetentionLog(
+                started_at=started_at,
+                finished_at=beijing_naive(),
+                error=error[:500] if error else None,
+                **result
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+        logger.info(
+            f"Retention finished: compressed {result['compressed_count']}, deleted {result['deleted_count']}, "
+            f"reclaimed {result['bytes_reclaimed'] / 1024 / 1024:.1f} MB"
+        )
+        return result
+
+    def _compress_originals(self, limiter: ByteRateLimiter) -> tuple[int, int]:
+        """并行重新压缩超过 retain_original_days 的原图"""
+        if settings.retain_original_days <= 0:
+            return 0, 0
+
+        cutoff = beijing_naive() - timedelta(days=settings.retain_original_days)
+        compressed = 0
+        reclaimed = 0
+        last_id = 0
+
+        # 已打包的截图按天收集，最后每天重写一次打包文件
+        packed: Dict[str, Dict[str, int]] = {}
+
+        def compress_one(item):
+            """Returns: (screenshot_id, 状态, 新大小, 节省的字节数)，状态为 compressed / packed / missing / failed"""
+            screenshot_id, filename = item
+            filepath = image_service.resolve_path(filename)
+            if not filepath:
+                day = day_of(filename)
+                if day and archive_service.has(filename):
+                    packed.setdefault(day, {})[filename] = screenshot_id
+                    return screenshot_id, "packed", None, 0
+                return screenshot_id, "missing", None, 0
+            old_size = os.path.getsize(filepath)
+            limiter.acquire(old_size)
+            try:
+                new_size = image_service.compress_image(filepath, quality=settings.retention_compress_quality)
+                return screenshot_id, "compressed", new_size, old_size - new_size
+            except Exception as e:
+                logger.warning(f"Failed to compress {filepath}: {e}")
+                return screenshot_id, "failed", None, 0
+
+        with ThreadPoolExecutor(max_workers=max(1, settings.retention_workers)) as pool:
+            while True:
+                db = SessionLocal()
+                try:
+                    # 只压缩已分析（或无需分析）的截图，避免影响 AI 输入质量
+                    # 只记录参考帧指针的相似帧没有自己的图片，跳过
+                    rows = db.query(Screenshot.id, Screenshot.filename).filter(
+                        Screenshot.id > last_id,
+                        Screenshot.timestamp < cutoff,
+                        or_(Screenshot.is_compressed == False, Screenshot.is_compressed.is_(None)),
+                        or_(Screenshot.is_purged == False, Screenshot.is_purged.is_(None)),
+                        or_(Screenshot.is_analyzed == True, Screenshot.is_similar == True),
+                        Screenshot.reference_filename.is_(None)
+                    ).order_by(Screenshot.id).limit(settings.retention_batch_size).all()
+
+                    if not rows:
+                        break
+                    last_id = rows[-1].id
+
+                    for screenshot_id, state, new_size, saved in pool.map(compress_one, rows):
+                        if state == "compressed":
+                            db.query(Screenshot).filter(Screenshot.id == screenshot_id).update({
+                                "is_compressed": True,
+                                "file_size": new_size
+                            })
+                            compressed += 1
+                            reclaimed += saved
+                        elif state == "missing":
+                            # 文件已不存在，没有可压缩的内容
+                            db.query(Screenshot).filter(Screenshot.id == screenshot_id).update({"is_compressed": True})
+                        # failed 下次执行时重试；packed 在打包文件重写成功后再标记
+                    db.commit()
+                finally:
+                    db.close()
+
+        for day, names in packed.items():
+            done = set()
+
+            def transform(name, data):
+                if name not in names:
+                    return data
+                limiter.acquire(len(data))
+                try:
+                    new_data = image_service.compress_bytes(data, settings.retention_compress_quality)
+                except Exception as e:
+                    logger.warning(f"Failed to compress {name} in archive {day}: {e}")
+                    return data
+                done.add(name)
+                return new_data
+
+            try:
+                reclaimed += archive_service.rewrite_day(day, transform)
+            except Exception as e:
+                # 打包文件没有重写，这一天的截图都不标记，下次执行时重试
+                logger.warning(f"Failed to rewrite archive {day}: {e}")
+                continue
+            compressed += len(done)
+            db = SessionLocal()
+            try:
+                for filename in done:
+                    db.query(Screenshot).filter(Screenshot.id == names[filename]).update({
+                        "is_compressed": True,
+                        "file_size": archive_service.entry_size(filename)
+                    })
+                db.commit()
+            finally:
+                db.close()
+
+        return compressed, reclaimed
+
+    def _delete_expired(self) -> tuple[int, int]:
+        """
+        删除超过 retain_compressed_days 的截图图片和缩略图
+
+        默认保留截图和活动记录（标记 is_purged），retention_delete_records 开启时连同活动、向量和记录一并删除
+        """
+        if settings.retain_compressed_days <= 0:
+            return 0, 0
+
+        cutoff = beijing_naive() - timedelta(days=settings.retain_compressed_days)
+        deleted = 0
+        reclaimed = 0
+        # 已打包的截图按天收集待删除条目
+        packed_drops: Dict[str, set] = {}
+
+        # 仍被未过期相似帧引用的参考帧暂不删除
+        still_referenced = select(Screenshot.reference_filename).where(
+            Screenshot.timestamp >= cutoff,
+            Screenshot.reference_filename.is_not(None)
+        )
+
+        delete_records = settings.retention_delete_records
+        last_id = 0
+        while True:
+            db = SessionLocal()
+            try:
+                query = db.query(Screenshot).filter(
+                    Screenshot.timestamp < cutoff,
+                    Screenshot.filename.not_in(still_referenced)
+                )
+                if not delete_records:
+                    query = query.filter(
+                        Screenshot.id > last_id,
+                        or_(Screenshot.is_purged == False, Screenshot.is_purged.is_(None))
+                    )
+                screenshots = query.order_by(Screenshot.id).limit(settings.retention_batch_size).all()
+
+                if not screenshots:
+                    break
+                last_id = screenshots[-1].id
+
+                if delete_records:
+                    ids = [s.id for s in screenshots]
+                    activities = db.query(Activity).filter(Activity.screenshot_id.in_(ids)).all()
+                    for activity in activities:
+                        if activity.vector_id:
+                            vector_service.delete_activity(activity.vector_id)
+                        db.delete(activity)
+
+                for screenshot in screenshots:
+                    names = (screenshot.filename, _thumbnail_name(screenshot.filename), image_service.diff_name(screenshot.filename),
+                             image_service.analysis_name(screenshot.filename))
+                    for name in names:
+                        path = image_service.resolve_path(name)
+                        if path:
+                            reclaimed += os.path.getsize(path)
+                            os.remove(path)
+                        elif archive_service.has(name):
+                            packed_drops.setdefault(day_of(name), set()).add(name)
+                    if delete_records:
+                        db.delete(screenshot)
+                    else:
+                        screenshot.is_purged = True
+                        screenshot.thumbnail_path = None
+                        screenshot.file_size = None
+                        screenshot.diff_box = None
+
+                db.commit()
+                deleted += len(screenshots)
+            finally:
+                db.close()
+
+        for day, names in packed_drops.items():
+            reclaimed += archive_service.rewrite_day(day, lambda name, data: None if name in names else data)
+
+        return deleted, reclaimed
+
+
+# 全局实例
+retention_manager = RetentionManager()
@@ -0,0 +1,297 @@
+"""
+向量索引重建与一致性修复
+
+从 activities 表分块读取活动，在多进程中并行计算 embedding，
+批量 upsert 到向量库，并通过检查点文件支持断点续跑。
+
+注意：CLI 模式会直接打开向量库，运行期间请停止后端服务
+（Chroma 与 NumPy 后端都不支持多进程同时写入）。服务运行时请使用
+管理接口 POST /api/vector-index/rebuild。
+
+运行方式:
+  python -m backend.tasks.vector_rebuild                 # 断点续跑重建
+  python -m backend.tasks.vector_rebuild --reset         # 清空后全量重建（更换模型后）
+  python -m backend.tasks.vector_rebuild --check         # 仅报告孤儿数据
+  python -m backend.tasks.vector_rebuild --repair        # 删除孤儿向量并补齐缺失向量
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.config import settings
+from backend.database import SessionLocal
+from backend.models import Activity
+from backend.services.embedding import load_embedder, build_activity_text, build_activity_metadata
+
+logger = logging.getLogger(__name__)
+
+# 管理接口（服务进程内）默认的 embedding 进程数：每个进程各加载一份模型
+SERVER_REBUILD_WORKERS = 2
+
+# 子进程内的 embedding 函数（每个 worker 只加载一次模型）
+_worker_embed = None
+
+
+def _init_worker(backend: str):
+    global _worker_embed
+    _worker_embed = load_embedder(backend)
+
+
+def _embed_batch(texts: List[str]):
+    return _worker_embed(texts)
+
+
+def _vector_id(activity: Activity) -> str:
+    return activity.vector_id or f"activity_{activity.screenshot_id}"
+
+
+class VectorIndexRebuilder:
+    """向量索引重建器"""
+
+    def __init__(self):
+        self.checkpoint_path = os.path.join(settings.storage_path, "vector_rebuild_checkpoint.json")
+        self.status: Dict = {"state": "idle"}
+
+    # ------------------------------------------------------------------
+    # 检查点
+    # ------------------------------------------------------------------
+
+    def load_checkpoint(self) -> Dict:
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        # 后端或模型变化后旧检查点失效
+        if checkpoint.get("backend") != settings.vector_backend or checkpoint.get("model") != settings.embedding_model:
+            return {}
+        return checkpoint
+
+    def save_checkpoint(self, last_activity_id: int, processed: int):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "backend": settings.vector_backend,
+                "model": settings.embedding_model,
+                "last_activity_id": last_activity_id,
+                "processed": processed
+            }, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def clear_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    # ------------------------------------------------------------------
+    # 重建
+    # ------------------------------------------------------------------
+
+    def _iter_chunks(self, after_id: int, chunk_size: int, vector_ids: Optional[set] = None):
+        """按主键分块读取活动（keyset 分页，不随进度变慢）"""
+        last_id = after_id
+        while True:
+            db = SessionLocal()
+            try:
+                rows = db.query(Activity).filter(
+                    Activity.id > last_id
+                ).order_by(Activity.id).limit(chunk_size).all()
+            finally:
+                db.close()
+
+            if not rows:
+                return
+            last_id = rows[-1].id
+
+            if vector_ids is not None:
+                rows = [a for a in rows if _vector_id(a) in vector_ids]
+                if not rows:
+                    continue
+
+            yield last_id, (
+                [_vector_id(a) for a in rows],
+                [build_activity_text(a) for a in rows],
+                [build_activity_metadata(a) for a in rows]
+            )
+
+    def rebuild(
+        self,
+        reset: bool = False,
+        workers: Optional[int] = None,
+        batch_size: int = 256,
+        only_ids: Optional[set] = None
+    ) -> Dict:
+        """
+        重建向量索引
+
+        Args:
+            reset: 清空向量库和检查点后全量重建
+            workers: embedding 进程数（默认 CPU 核数，服务进程内调用时应传较小的值）
+            batch_size: 每批活动数
+            only_ids: 只处理这些向量 ID（用于修复缺失向量，不使用检查点）
+
+        Returns:
+            统计信息
+        """
+        from backend.services.vector_service import vector_service
+
+        workers = workers or os.cpu_count() or 1
+        use_checkpoint = only_ids is None
+
+        if reset:
+            vector_service.reset()
+            self.clear_checkpoint()
+
+        checkpoint = self.load_checkpoint() if use_checkpoint else {}
+        last_id = checkpoint.get("last_activity_id", 0)
+        processed = checkpoint.get("processed", 0)
+
+        self.status = {"state": "running", "processed": processed, "last_activity_id": last_id, "workers": workers}
+        started = time.time()
+        logger.info(f"Vector rebuild started (resume after id {last_id}, workers: {workers})")
+
+        # 保持一定数量的批次在途，按提交顺序写入，保证检查点单调递增
+        max_in_flight = workers * 2
+        pending = deque()
+
+        def drain_one():
+            nonlocal processed
+            chunk_last_id, ids, documents, metadatas, future = pending.popleft()
+            vector_service.upsert_embeddings(ids, future.result(), documents, metadatas)
+            processed += len(ids)
+            if use_checkpoint:
+                self.save_checkpoint(chunk_last_id, processed)
+            self.status.update({"processed": processed, "last_activity_id": chunk_last_id})
+
+        try:
+            # spawn 启动子进程：服务进程中已有其他线程和已加载的模型，fork 可能死锁并复制整个进程内存
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(settings.vector_backend,),
+                mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                for chunk_last_id, (ids, documents, metadatas) in self._iter_chunks(last_id, batch_size, only_ids):
+                    future = pool.submit(_embed_batch, documents)
+                    pending.append((chunk_last_id, ids, documents, metadatas, future))
+                    if len(pending) >= max_in_flight:
+                        drain_one()
+                while pending:
+                    drain_one()
+        except Exception as e:
+            self.status.update({"state": "failed", "error": str(e)})
+            logger.error(f"Vector rebuild failed: {e}", exc_info=True)
+            raise
+
+        elapsed = time.time() - started
+        if use_checkpoint:
+            self.clear_checkpoint()
+        self.status = {
+            "state": "completed",
+            "processed": processed,
+            "elapsed_seconds": round(elapsed, 1),
+            "workers": workers
+        }
+        logger.info(f"Vector rebuild completed: {processed} activities in {elapsed:.1f}s")
+        return self.status
+
+    # ------------------------------------------------------------------
+    # 一致性检查
+    # ------------------------------------------------------------------
+
+    def check_consistency(self, sample_size: int = 20) -> Dict:
+        """
+        对比 activities 表与向量库
+
+        Returns:
+            missing_vectors: 有活动但没有向量
+            orphan_vectors: 有向量但没有对应活动
+        """
+        from backend.services.vector_service import vector_service
+
+        db = SessionLocal()
+        try:
+            activity_ids = {
+                vector_id or f"activity_{screenshot_id}"
+                for vector_id, screenshot_id in db.query(Activity.vector_id, Activity.screenshot_id)
+            }
+        finally:
+            db.close()
+
+        vector_ids = set(vector_service.list_ids())
+        missing = activity_ids - vector_ids
+        orphans = vector_ids - activity_ids
+
+        return {
+            "activity_count": len(activity_ids),
+            "vector_count": len(vector_ids),
+            "missing_vectors": len(missing),
+            "orphan_vectors": len(orphans),
+            "missing_sample": sorted(missing)[:sample_size],
+            "orphan_sample": sorted(orphans)[:sample_size],
+            "_missing": missing,
+            "_orphans": orphans
+        }
+
+    def repair(self, workers: Optional[int] = None, batch_size: int = 256) -> Dict:
+        """删除孤儿向量，补齐缺失向量（运行期间 status 为 running，与重建互斥）"""
+        from backend.services.vector_service import vector_service
+
+        self.status = {"state": "running", "task": "repair"}
+        try:
+            report = self.check_consistency()
+            for vector_id in report["_orphans"]:
+                vector_service.delete_activity(vector_id)
+            if report["_missing"]:
+                self.rebuild(workers=workers, batch_size=batch_size, only_ids=report["_missing"])
+        except Exception as e:
+            self.status = {"state": "failed", "task": "repair", "error": str(e)}
+            raise
+
+        result = {
+            "deleted_orphans": report["orphan_vectors"],
+            "added_missing": report["missing_vectors"]
+        }
+        self.status = {"state": "completed", "task": "repair", **result}
+        return result
+
+
+def public_report(report: Dict) -> Dict:
+    """去掉内部使用的完整集合"""
+    return {k: v for k, v in report.items() if not k.startswith("_")}
+
+
+vector_rebuilder = VectorIndexRebuilder()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量索引重建与一致性修复")
+    parser.add_argument("--reset", action="store_true", help="清空向量库后全量重建")
+    parser.add_argument("--check", action="store_true", help="只报告孤儿数据，不做修改")
+    parser.add_argument("--repair", action="store_true", help="删除孤儿向量并补齐缺失向量")
+    parser.add_argument("--workers", type=int, default=None, help="embedding 进程数（默认 CPU 核数）")
+    parser.add_argument("--batch-size", type=int, default=256, help="每批活动数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.check:
+        result = public_report(vector_rebuilder.check_consistency())
+    elif args.repair:
+        result = vector_rebuilder.repair(workers=args.workers, batch_size=args.batch_size)
+    else:
+        result = vector_rebuilder.rebuild(reset=args.reset, workers=args.workers, batch_size=args.batch_size)
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
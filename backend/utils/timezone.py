@@ -93,4 +93,34 @@ def get_day_range_beijing(target_date: Optional[datetime] = None) -> tuple[datet
     end_time = start_time + timedelta(days=1)
     
     # 返回 naive datetime（用于数据库查询）
-    return start_time, end_time
\ No newline at end of file
+    return start_time, end_time
+
+def parse_datetime_beijing(value: str) -> datetime:
+    """
+    解析 ISO 格式的时间，返回北京时间 naive datetime（无时区信息时按北京时间处理）
+    
+    Raises:
+        ValueError: 格式不正确
+    """
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(BEIJING_TZ).replace(tzinfo=None)
+    return dt
+
+
+def parse_capture_time(value: Optional[str]) -> datetime:
+    """
+    解析客户端上报的截图时间（ISO 格式），返回北京时间 naive datetime
+    
+    无时区信息时按北京时间处理；缺失、无法解析或晚于当前时间时使用当前时间。
+    """
+    now = beijing_naive()
+    if not value or not isinstance(value, str):
+        return now
+    try:
+        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return now
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(BEIJING_TZ).replace(tzinfo=None)
+    return min(dt, now)
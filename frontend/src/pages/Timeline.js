@@ -7,6 +7,8 @@ function Timeline() {
   const [loading, setLoading] = useState(true);
   const [page, setPage] = useState(0);
   const [total, setTotal] = useState(0);
+  // cursors[n] 为第 n 页的游标（第 0 页为空），翻页时按游标读取，不受页数影响
+  const [cursors, setCursors] = useState([null]);
   const [selectedDate, setSelectedDate] = useState(getTodayBeijing());
   const [selectedImage, setSelectedImage] = useState(null);
 
@@ -16,7 +18,7 @@ function Timeline() {
     setLoading(true);
     try {
       const response = await screenshotsAPI.getScreenshots({
-        skip: page * limit,
+        cursor: cursors[page] || undefined,
         limit: limit,
         start_date: `${selectedDate}T00:00:00+08:00`,
         end_date: `${selectedDate}T23:59:59+08:00`,
@@ -24,6 +26,12 @@ function Timeline() {
       
       setScreenshots(response.data.items);
       setTotal(response.data.total);
+      const nextCursor = response.data.next_cursor;
+      setCursors((prev) => {
+        const next = prev.slice(0, page + 1);
+        if (nextCursor) next.push(nextCursor);
+        return next;
+      });
     } catch (error) {
       console.error('Error loading screenshots:', error);
     } finally {
@@ -48,6 +56,7 @@ function Timeline() {
           value={selectedDate}
           onChange={(e) => {
             setSelectedDate(e.target.value);
+            setCursors([null]);
             setPage(0);
           }}
         />
@@ -109,8 +118,8 @@ function Timeline() {
               </button>
               <button
                 className="join-item btn"
-                onClick={() => setPage(Math.min(totalPages - 1, page + 1))}
-                disabled={page >= totalPages - 1}
+                onClick={() => setPage(page + 1)}
+                disabled={page + 1 >= cursors.length}
               >
                 »
               </button>